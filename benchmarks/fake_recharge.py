@@ -0,0 +1,285 @@
+"""
+A local stand-in of the Recharge 2021-11 list endpoints, serving records
+generated from the tap schemas.
+
+It follows the behaviour the tap relies on: cursor pagination with
+`next_cursor`, the `updated_at_min`, `updated_at_max`, `sort_by` and
+`owner_resource` filters, the `limit` page size and the leaky bucket rate
+limit with its `X-Recharge-Limit` and `Retry-After` headers, and gzip
+responses when the request accepts them. A latency can be added to every
+response.
+
+    python benchmarks/fake_recharge.py --port 8080 --records 10000
+"""
+
+import argparse
+import base64
+import datetime
+import gzip
+import json
+import os
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+SCHEMAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tap_recharge', 'schemas')
+
+# The metafields endpoint serves the records of the 3 metafields schemas
+METAFIELDS_OWNER_RESOURCES = ['store', 'customer', 'subscription']
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 250
+START_DATETIME = datetime.datetime(2021, 1, 1)
+# Time between the updated_at values of consecutive records
+RECORD_INTERVAL = datetime.timedelta(minutes=7)
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def load_schema(name: str) -> dict:
+    with open(os.path.join(SCHEMAS_DIR, f'{name}.json'), encoding='utf-8') as file:
+        return json.load(file)
+
+
+def get_types(schema: dict) -> list:
+    if 'anyOf' in schema:
+        return [typ for subschema in schema['anyOf'] for typ in get_types(subschema)]
+    types = schema.get('type', [])
+    return types if isinstance(types, list) else [types]
+
+
+def generate_value(schema: dict, rnd: random.Random, depth: int = 0): # pylint: disable=too-many-return-statements
+    """Returns a value valid for the schema, null one time out of ten when allowed."""
+    if 'anyOf' in schema:
+        return generate_value(rnd.choice(schema['anyOf']), rnd, depth)
+    types = get_types(schema)
+    if 'null' in types and (rnd.random() < 0.1 or depth > 3):
+        return None
+    if 'object' in types:
+        return {key: generate_value(subschema, rnd, depth + 1)
+                for key, subschema in schema.get('properties', {}).items()}
+    if 'array' in types:
+        return [generate_value(schema.get('items', {}), rnd, depth + 1) for _ in range(rnd.randint(0, 3))]
+    if schema.get('format') == 'date-time':
+        return (START_DATETIME + datetime.timedelta(seconds=rnd.randint(0, 10**8))).strftime(DATETIME_FORMAT)
+    if 'integer' in types:
+        return rnd.randint(0, 10**9)
+    if 'number' in types:
+        return round(rnd.uniform(0, 1000), 2)
+    if 'boolean' in types:
+        return rnd.random() < 0.5
+    if 'string' in types:
+        return ''.join(rnd.choices('abcdefghijklmnopqrstuvwxyz ', k=rnd.randint(4, 24)))
+    return None
+
+
+def generate_records(name: str, count: int, seed: int = 0) -> list:
+    """
+    Returns the records of an endpoint, in ascending `updated_at` order with
+    sequential ids.
+    """
+    rnd = random.Random(f'{name}-{seed}')
+    if name == 'metafields':
+        schemas = [load_schema(f'metafields_{owner_resource}') for owner_resource in METAFIELDS_OWNER_RESOURCES]
+    else:
+        schemas = [load_schema(name)]
+
+    records = []
+    for index in range(count):
+        schema = schemas[index % len(schemas)]
+        record = generate_value(schema, rnd)
+        record['id'] = index + 1
+        record['updated_at'] = (START_DATETIME + index * RECORD_INTERVAL).strftime(DATETIME_FORMAT)
+        if name == 'metafields':
+            record['owner_resource'] = METAFIELDS_OWNER_RESOURCES[index % len(schemas)]
+        records.append(record)
+    return records
+
+
+def parse_datetime(value: str) -> datetime.datetime:
+    value = value.replace('Z', '+00:00')
+    dtime = datetime.datetime.fromisoformat(value)
+    if dtime.tzinfo:
+        dtime = dtime.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dtime
+
+
+def encode_cursor(query: dict, offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([query, offset]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii'))))
+
+
+class LeakyBucket:
+    """The server side of the rate limit, a bucket of `size` calls leaking `leak_rate` calls per second."""
+
+    def __init__(self, size: int, leak_rate: float):
+        self.size = size
+        self.leak_rate = leak_rate
+        self.level = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self) -> tuple:
+        """Adds a call to the bucket, returns (accepted, used calls, seconds before a call fits)."""
+        with self.lock:
+            now = time.monotonic()
+            self.level = max(self.level - (now - self.updated) * self.leak_rate, 0.0)
+            self.updated = now
+            if self.level + 1 > self.size:
+                return False, int(self.level), (self.level + 1 - self.size) / self.leak_rate
+            self.level += 1
+            return True, int(self.level), 0
+
+
+class FakeRecharge:
+    """
+    The data and the behaviour of the stand-in.
+
+    :param records: The number of records of each endpoint
+    :param latency: Seconds added to every response
+    :param max_page_size: The largest `limit` accepted
+    :param bucket_size: The size of the rate limit bucket
+    :param leak_rate: The calls leaking from the bucket per second, None disables the rate limit
+    :param seed: The seed of the generated records
+    """
+
+    def __init__(
+            self,
+            records: int = 1000,
+            latency: float = 0.0,
+            max_page_size: int = MAX_PAGE_SIZE,
+            bucket_size: int = 40,
+            leak_rate: float = None,
+            seed: int = 0):
+        self.records = records
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.bucket_size = bucket_size
+        self.bucket = LeakyBucket(bucket_size, leak_rate) if leak_rate else None
+        self.seed = seed
+        self.datasets = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+
+    def get_dataset(self, name: str) -> list:
+        with self.lock:
+            if name not in self.datasets:
+                self.datasets[name] = generate_records(name, self.records, self.seed)
+            return self.datasets[name]
+
+    def get_page(self, name: str, params: dict) -> dict:
+        """Returns the page of a list endpoint for the query params."""
+        limit = min(int(params.get('limit', DEFAULT_PAGE_SIZE)), self.max_page_size)
+        if params.get('cursor'):
+            query, offset = decode_cursor(params['cursor'])
+        else:
+            query = {key: value for key, value in params.items() if key not in ('limit', 'cursor')}
+            offset = 0
+
+        records = self.get_dataset(name)
+        if 'owner_resource' in query:
+            records = [record for record in records if record.get('owner_resource') == query['owner_resource']]
+        if 'updated_at_min' in query:
+            updated_at_min = parse_datetime(query['updated_at_min']).strftime(DATETIME_FORMAT)
+            records = [record for record in records if record['updated_at'] >= updated_at_min]
+        if 'updated_at_max' in query:
+            updated_at_max = parse_datetime(query['updated_at_max']).strftime(DATETIME_FORMAT)
+            records = [record for record in records if record['updated_at'] < updated_at_max]
+        if query.get('sort_by', '').endswith('-desc'):
+            records = records[::-1]
+
+        page = records[offset:offset + limit]
+        next_offset = offset + limit
+        return {
+            'next_cursor': encode_cursor(query, next_offset) if next_offset < len(records) else None,
+            'previous_cursor': encode_cursor(query, max(offset - limit, 0)) if offset else None,
+            name: page
+        }
+
+    def handle(self, path: str, params: dict) -> tuple:
+        """Returns the (status code, headers, body) of a GET request."""
+        with self.lock:
+            self.requests += 1
+        headers = {}
+
+        if self.bucket:
+            accepted, used, retry_after = self.bucket.add()
+            headers['X-Recharge-Limit'] = f'{used}/{self.bucket.size}'
+            if not accepted:
+                with self.lock:
+                    self.rate_limited += 1
+                headers['Retry-After'] = f'{retry_after:.3f}'
+                return 429, headers, {'errors': 'Too many requests'}
+        else:
+            # An empty bucket, so the limiter of the tap never waits
+            headers['X-Recharge-Limit'] = f'0/{self.bucket_size}'
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        name = path.strip('/')
+        if not name:
+            return 200, headers, {}
+        if name == 'store':
+            return 200, headers, {'store': self.get_dataset('store')[0]}
+        if not os.path.exists(os.path.join(SCHEMAS_DIR, f'{name}.json')) and name != 'metafields':
+            return 404, headers, {'errors': 'Not Found'}
+        return 200, headers, self.get_page(name, params)
+
+    def serve(self, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+        """Returns the HTTP server, not started, `server_address` holds the bound port."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self): # pylint: disable=invalid-name
+                url = urlparse(self.path)
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                status_code, headers, body = fake.handle(url.path, params)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    data = gzip.compress(data, compresslevel=6)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--records', type=int, default=1000, help='Records of each endpoint')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--max-page-size', type=int, default=MAX_PAGE_SIZE)
+    parser.add_argument('--bucket-size', type=int, default=40)
+    parser.add_argument('--leak-rate', type=float, default=None, help='Rate limit leak rate, no rate limit when not set')
+    args = parser.parse_args()
+
+    fake = FakeRecharge(args.records, args.latency, args.max_page_size, args.bucket_size, args.leak_rate)
+    server = fake.serve(args.host, args.port)
+    print(f'Serving on http://{args.host}:{server.server_address[1]}/')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Measures the throughput of the tap against the local stand-in of the
+Recharge API (fake_recharge.py). Each stream is synced in its own process,
+from an empty state, with stdout discarded, and reported with:
+
+    records/s    records written per second of wall time
+    requests/s   requests sent per second of wall time, retries included
+    cpu us/rec   CPU time of the tap process per record written
+    peak rss     peak resident memory of the tap process, in MiB
+
+    python benchmarks/run.py --records 5000 --streams charges orders
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline results.json --tolerance 0.2
+
+With --baseline, the run fails when the records/s of a stream drop by more
+than the tolerance compared with the saved results.
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+
+from fake_recharge import MAX_PAGE_SIZE, FakeRecharge
+
+
+DEFAULT_STREAMS = [
+    'addresses', 'charges', 'collections', 'customers', 'discounts', 'metafields_store',
+    'onetimes', 'orders', 'plans', 'products', 'store', 'subscriptions']
+
+
+class CountingSink:
+    """Stands in for stdout, counts the RECORD messages written."""
+
+    def __init__(self):
+        self.records = 0
+
+    def write(self, text: str) -> int:
+        self.records += text.count('"type": "RECORD"') + text.count('"type":"RECORD"')
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def serve(options: dict, addresses: multiprocessing.Queue):
+    """Runs the stand-in, in its own process so its CPU time is not counted."""
+    server = FakeRecharge(**options).serve()
+    addresses.put(server.server_address)
+    server.serve_forever()
+
+
+def sync_stream(stream_name: str, base_url: str, config: dict, results: multiprocessing.Queue):
+    """Syncs one stream and puts its measures in the results queue."""
+    # Imported in the benchmark process only
+    # pylint: disable=import-outside-toplevel
+    import logging
+    from singer import metadata
+    from tap_recharge.client import RechargeClient
+    from tap_recharge.discover import discover
+    from tap_recharge.http_cache import ResponseCache
+    from tap_recharge.sync import get_pool_maxsize, sync
+
+    # The METRIC and progress logs of the tap
+    logging.disable(logging.INFO)
+    config = dict({'access_token': 'benchmark', 'start_date': '2020-01-01T00:00:00Z'}, **config)
+
+    catalog = discover()
+    for stream in catalog.streams:
+        if stream.tap_stream_id == stream_name:
+            mdata = metadata.to_map(stream.metadata)
+            stream.metadata = metadata.to_list(metadata.write(mdata, (), 'selected', True))
+
+    sink = CountingSink()
+    sys.stdout = sink
+    client = RechargeClient(
+        config['access_token'],
+        request_timeout=config.get('request_timeout'),
+        rate_limit_leak_rate=config.get('rate_limit_leak_rate'),
+        json_backend=config.get('json_backend'),
+        decode_retries=config.get('decode_retries'),
+        base_url=base_url,
+        pool_maxsize=get_pool_maxsize(config),
+        keep_alive=config.get('keep_alive'),
+        idle_connection_timeout=config.get('idle_connection_timeout'),
+        tls_session_reuse=config.get('tls_session_reuse'),
+        response_cache=ResponseCache.from_config(config),
+        compression=config.get('compression'))
+
+    start_usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with client:
+        sync(client, config, {}, catalog)
+    elapsed = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu_seconds = (usage.ru_utime - start_usage.ru_utime) + (usage.ru_stime - start_usage.ru_stime)
+    requests = client.rate_limiter.requests
+    results.put({
+        'stream': stream_name,
+        'records': sink.records,
+        'requests': requests,
+        'seconds': round(elapsed, 3),
+        'records_per_second': round(sink.records / elapsed, 1),
+        'requests_per_second': round(requests / elapsed, 1),
+        'cpu_us_per_record': round(cpu_seconds / max(sink.records, 1) * 10**6, 1),
+        # kilobytes on Linux
+        'peak_rss_mib': round(usage.ru_maxrss / 1024, 1),
+    })
+
+
+def run(stream_names: list, base_url: str, config: dict) -> list:
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for stream_name in stream_names:
+        queue = context.Queue()
+        process = context.Process(target=sync_stream, args=(stream_name, base_url, config, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return results
+
+
+def print_results(results: list):
+    columns = ['stream', 'records', 'requests', 'seconds', 'records_per_second',
+               'requests_per_second', 'cpu_us_per_record', 'peak_rss_mib']
+    headers = ['stream', 'records', 'requests', 'seconds', 'records/s', 'requests/s', 'cpu us/rec', 'peak rss']
+    rows = [headers] + [[str(result[column]) for column in columns] for result in results]
+    widths = [max(len(row[index]) for row in rows) for index in range(len(columns))]
+    for row in rows:
+        print('  '.join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """Returns the streams whose records/s dropped by more than the tolerance."""
+    baseline = {result['stream']: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['stream'])
+        if previous and result['records_per_second'] < previous['records_per_second'] * (1 - tolerance):
+            regressions.append(
+                f"{result['stream']}: {result['records_per_second']} records/s, "
+                f"{previous['records_per_second']} in the baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', nargs='+', default=DEFAULT_STREAMS)
+    parser.add_argument('--records', type=int, default=2000, help='Records of each endpoint')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--max-page-size', type=int, default=MAX_PAGE_SIZE)
+    parser.add_argument('--bucket-size', type=int, default=40)
+    parser.add_argument('--leak-rate', type=float, default=None,
+                        help='Rate limit leak rate of the stand-in, no rate limit when not set')
+    parser.add_argument('--config', type=json.loads, default={}, help='Tap config, as a JSON object')
+    parser.add_argument('--output', help='Saves the results to this JSON file')
+    parser.add_argument('--baseline', help='Compares the results with this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Accepted drop of records/s')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    addresses = context.Queue()
+    server = context.Process(target=serve, daemon=True, args=({
+        'records': args.records,
+        'latency': args.latency,
+        'max_page_size': args.max_page_size,
+        'bucket_size': args.bucket_size,
+        'leak_rate': args.leak_rate}, addresses))
+    server.start()
+    host, port = addresses.get()
+
+    try:
+        results = run(args.streams, f'http://{host}:{port}/', args.config)
+    finally:
+        server.terminate()
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
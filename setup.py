@@ -3,7 +3,7 @@
 from setuptools import setup, find_packages
 
 setup(name='tap-recharge',
-      version='3.0.1',
+      version='3.1.0',
       description='Singer.io tap for extracting data from the ReCharge Payments API 2.0',
       author='jeff.huth@bytecode.io',
       classifiers=['Programming Language :: Python :: 3 :: Only'],
@@ -27,5 +27,14 @@ setup(name='tap-recharge',
           'dev': [
               'pylint',
               'ipdb'
+          ],
+          'orjson': [
+              'orjson'
+          ],
+          'async': [
+              'aiohttp'
+          ],
+          'brotli': [
+              'brotli'
           ]
       })
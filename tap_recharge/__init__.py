@@ -4,7 +4,8 @@ from singer import get_logger, utils
 
 from tap_recharge.client import RechargeClient
 from tap_recharge.discover import discover
-from tap_recharge.sync import sync
+from tap_recharge.http_cache import ResponseCache
+from tap_recharge.sync import get_pool_maxsize, sync
 
 LOGGER = get_logger()
 
@@ -31,7 +32,16 @@ def main():
     with RechargeClient(
         parsed_args.config['access_token'],
         parsed_args.config['user_agent'],
-        parsed_args.config.get('request_timeout')
+        parsed_args.config.get('request_timeout'),
+        parsed_args.config.get('rate_limit_leak_rate'),
+        parsed_args.config.get('json_backend'),
+        parsed_args.config.get('decode_retries'),
+        pool_maxsize=get_pool_maxsize(parsed_args.config),
+        keep_alive=parsed_args.config.get('keep_alive'),
+        idle_connection_timeout=parsed_args.config.get('idle_connection_timeout'),
+        tls_session_reuse=parsed_args.config.get('tls_session_reuse'),
+        response_cache=ResponseCache.from_config(parsed_args.config),
+        compression=parsed_args.config.get('compression')
         ) as client:
 
         state = {}
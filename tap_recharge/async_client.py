@@ -0,0 +1,342 @@
+"""
+This module defines the asyncio client of the Recharge API, used by the
+async stream engine (see async_streams.py). It follows RechargeClient: the
+same error mapping, backoff, rate limiter and decode retries, on an aiohttp
+session instead of a requests session. aiohttp is an optional dependency
+(the `async` extra).
+"""
+
+import asyncio
+import datetime
+import sys
+import time
+
+import backoff
+import singer
+from singer import metrics, utils
+
+try:
+    import aiohttp
+except ImportError: # pragma: no cover
+    aiohttp = None
+
+from tap_recharge.client import (
+    BASE_URL,
+    RateLimiter,
+    RechargeCacheMissError,
+    RechargeRateLimitError,
+    RechargeTruncatedResponseError,
+    Server5xxError,
+    get_decode_error,
+    get_decode_retries,
+    get_headers,
+    get_leak_rate,
+    get_request_timeout,
+    get_retry_delay,
+    raise_for_error,
+    should_retry_decode)
+from tap_recharge.compression import TransferStats, get_accept_encoding, get_content_encoding
+from tap_recharge.connection import DEFAULT_IDLE_CONNECTION_TIMEOUT
+from tap_recharge.http_cache import ResponseCache, get_request_key
+from tap_recharge.json_backend import get_json_backend
+from tap_recharge.profiling import Profiler
+
+LOGGER = singer.get_logger()
+
+# Connections open at once, the rate limiter bounds the requests in flight
+DEFAULT_MAX_CONNECTIONS = 100
+
+# The errors retried with backoff, as ConnectionError, Timeout and
+# ChunkedEncodingError for RechargeClient
+RETRIED_ERRORS = (asyncio.TimeoutError, Server5xxError) + (
+    (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) if aiohttp else ())
+
+
+def retry_handler(details):
+    """
+    Backoff handler calling the `on_retry` callback of a request before it is
+    retried after a timeout or a body cut short, see client.retry_handler.
+    """
+    on_retry = details['kwargs'].get('on_retry')
+    exception = sys.exc_info()[1]
+    if on_retry and isinstance(exception, (asyncio.TimeoutError, aiohttp.ClientPayloadError)):
+        on_retry(exception)
+
+
+def is_async_supported() -> bool:
+    """Whether aiohttp, which the async client requires, is installed."""
+    return aiohttp is not None
+
+
+def get_query_params(params: dict) -> dict:
+    """
+    Returns the query params as strings, the way requests sends them
+    (e.g. the datetime of `updated_at_min`), aiohttp only accepts strings
+    and numbers.
+    """
+    return {
+        key: value if isinstance(value, (str, int, float)) and not isinstance(value, bool) else str(value)
+        for key, value in (params or {}).items()
+        if value is not None}
+
+
+class BufferedResponse:
+    """
+    A response whose body has been read, with the attributes of a requests
+    response used by raise_for_error and get_decode_error.
+
+    :param status_code: The HTTP status code
+    :param headers: The response headers
+    :param content: The response body
+    :param json_backend: The backend decoding the body
+    """
+
+    def __init__(self, status_code: int, headers, content: bytes, json_backend):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.json_backend = json_backend
+
+    def json(self):
+        return self.json_backend.loads(self.content)
+
+
+class AsyncRechargeClient:
+    """
+    The asyncio client of the Recharge API. The aiohttp session is opened by
+    `async with`, which also checks the access token.
+
+    :param access_token: The API access token
+    :param user_agent: The User-Agent header of the requests
+    :param request_timeout: Timeout for requests in seconds
+    :param rate_limit_leak_rate: The calls per second leaking from the rate limit bucket
+    :param json_backend: The JSON library decoding the pages
+    :param decode_retries: The retries of a truncated response body
+    :param base_url: The root of the API
+    :param max_connections: The number of connections open at once
+    :param idle_connection_timeout: Seconds an idle connection is kept open
+    :param rate_limiter: A limiter shared with a RechargeClient, so both draw from the same budget
+    :param profiler: A profiler shared with a RechargeClient
+    :param response_cache: Records the pages of the sync, or replays them without calling the API
+    :param compression: The compression of the responses, see get_accept_encoding
+    :param transfer_stats: The byte counts shared with a RechargeClient
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+            self,
+            access_token,
+            user_agent=None,
+            request_timeout=None,
+            rate_limit_leak_rate=None,
+            json_backend=None,
+            decode_retries=None,
+            base_url=None,
+            max_connections=None,
+            idle_connection_timeout=None,
+            rate_limiter: RateLimiter = None,
+            profiler: Profiler = None,
+            response_cache: ResponseCache = None,
+            compression=None,
+            transfer_stats: TransferStats = None):
+        if aiohttp is None:
+            raise ValueError('async_engine is set but aiohttp is not installed, install it with `pip install tap-recharge[async]`')
+        self.__access_token = access_token
+        self.__user_agent = user_agent
+        self.__session = None
+        self.base_url = base_url or BASE_URL
+        self.request_timeout = get_request_timeout(request_timeout)
+        self.rate_limiter = rate_limiter or RateLimiter(get_leak_rate(rate_limit_leak_rate))
+        self.json_backend = get_json_backend(json_backend)
+        self.decode_retries = get_decode_retries(decode_retries)
+        self.max_connections = int(max_connections) if max_connections and int(max_connections) else DEFAULT_MAX_CONNECTIONS
+        if idle_connection_timeout is not None and str(idle_connection_timeout).strip() != '':
+            self.idle_connection_timeout = float(idle_connection_timeout)
+        else:
+            self.idle_connection_timeout = DEFAULT_IDLE_CONNECTION_TIMEOUT
+        self.profiler = profiler or Profiler()
+        self.response_cache = response_cache
+        self.accept_encoding = get_accept_encoding(compression)
+        self.transfer_stats = transfer_stats or TransferStats()
+
+    @property
+    def replaying(self) -> bool:
+        return self.response_cache is not None and self.response_cache.replaying
+
+    def now(self) -> datetime.datetime:
+        """The current time, the time of the recorded sync with the response cache."""
+        if self.response_cache is not None:
+            return self.response_cache.get_now()
+        return utils.now()
+
+    @classmethod
+    def from_config(cls, config: dict, **kwargs):
+        """
+        Creates the client from the tap config.
+
+        :param config: A dictionary containing tap config data
+        :param kwargs: The other arguments of the client, e.g. a shared `rate_limiter`
+        """
+        return cls(
+            config['access_token'],
+            config.get('user_agent'),
+            config.get('request_timeout'),
+            config.get('rate_limit_leak_rate'),
+            config.get('json_backend'),
+            config.get('decode_retries'),
+            max_connections=config.get('max_connections'),
+            idle_connection_timeout=config.get('idle_connection_timeout'),
+            compression=config.get('compression'),
+            **kwargs)
+
+    async def __aenter__(self):
+        if self.__access_token is None:
+            raise Exception('Error: Missing access_token.')
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            # 0 never closes the idle connections, None is the aiohttp equivalent
+            keepalive_timeout=self.idle_connection_timeout or None)
+        self.__session = aiohttp.ClientSession(
+            connector=connector,
+            headers=get_headers(self.__access_token, self.__user_agent, self.accept_encoding),
+            # The connect and read timeouts of requests, not a deadline of the whole request
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=self.request_timeout,
+                sock_read=self.request_timeout))
+        try:
+            # A replayed sync runs offline
+            if not self.replaying:
+                await self.check_access_token()
+        except BaseException:
+            await self.__session.close()
+            raise
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.__session.close()
+
+    # Backoff the request for 5 times when Timeout or Connection error occurs
+    @backoff.on_exception(
+        backoff.expo,
+        RETRIED_ERRORS,
+        max_tries=5,
+        factor=2)
+    async def check_access_token(self):
+        async with self.__session.get(self.base_url) as response:
+            if response.status != 200:
+                LOGGER.error('Error status_code = %s', response.status)
+                raise_for_error(BufferedResponse(response.status, response.headers, await response.read(), self.json_backend))
+        return True
+
+    # Added backoff for 5 times when Timeout error occurs
+    @backoff.on_exception(
+        backoff.expo,
+        RETRIED_ERRORS,
+        max_tries=5,
+        factor=2,
+        on_backoff=retry_handler)
+    # The rate limiter already waits for the Retry-After delay of a 429
+    @backoff.on_exception(
+        backoff.constant,
+        RechargeRateLimitError,
+        max_tries=5,
+        interval=0)
+    async def request(self, method, path=None, url=None, **kwargs):
+        if self.replaying:
+            return self.__replay(method, path, url, **kwargs)
+        start = time.perf_counter()
+        sleep_time = self.rate_limiter.reserve()
+        try:
+            if sleep_time > 0:
+                await asyncio.sleep(sleep_time)
+            self.profiler.add(path or url, 'throttle', time.perf_counter() - start)
+            return await self.__request(method, path, url, **kwargs)
+        finally:
+            self.rate_limiter.release()
+
+    def __replay(self, method, path=None, url=None, **kwargs):
+        """Serves the request from the response cache, see RechargeClient.__replay."""
+        key = get_request_key(method, path or url, kwargs.get('params'), kwargs.get('json'))
+        start = time.perf_counter()
+        content = self.response_cache.load(key)
+        if content is None:
+            raise RechargeCacheMissError(
+                f'{key["method"]} {key["path"]} {key["params"]} was not recorded in {self.response_cache.path}')
+        self.profiler.add(path or url, 'download', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        data = self.json_backend.loads(content)
+        self.profiler.add(path or url, 'decode', time.perf_counter() - start)
+        return data
+
+    async def __send(self, method, url, endpoint, key, **kwargs):
+        """Sends the request and reads the body, returns a BufferedResponse."""
+        start = time.perf_counter()
+        with metrics.http_request_timer(endpoint) as timer:
+            async with self.__session.request(method, url, **kwargs) as response:
+                timer.tags[metrics.Tag.http_status_code] = response.status
+                received = time.perf_counter()
+                self.profiler.add(key, 'request', received - start)
+                content = await response.read()
+                self.profiler.add(key, 'download', time.perf_counter() - received)
+                # The bytes received before decompression, on aiohttp versions tracking them
+                wire_bytes = getattr(response.content, 'total_raw_bytes', len(content))
+
+        self.transfer_stats.add(key, get_content_encoding(response.headers), wire_bytes, len(content))
+
+        response = BufferedResponse(response.status, response.headers, content, self.json_backend)
+        self.rate_limiter.update(response.status_code, response.headers)
+
+        if response.status_code != 200:
+            raise_for_error(response)
+
+        return response
+
+    async def __request(self, method, path=None, url=None, **kwargs):
+        # Called before a request is retried, see retry_handler
+        on_retry = kwargs.pop('on_retry', None)
+
+        if not url and path:
+            url = self.base_url + path
+        endpoint = kwargs.pop('endpoint', None)
+        # The params of the caller, which on_retry may update
+        params = kwargs.get('params')
+        if method == 'POST':
+            kwargs.setdefault('headers', {})['Content-Type'] = 'application/json'
+
+        # Intermittent truncated or malformed bodies; the request is sent
+        # again within the decode retry budget
+        attempt = 0
+        while True:
+            kwargs['params'] = get_query_params(params)
+            cache_key = get_request_key(method, path or url, kwargs['params'], kwargs.get('json'))
+            response = await self.__send(method, url, endpoint, path or url, **kwargs)
+            try:
+                start = time.perf_counter()
+                data = self.json_backend.loads(response.content)
+                self.profiler.add(path or url, 'decode', time.perf_counter() - start)
+            except ValueError as err:  # includes orjson and simplejson JSONDecodeError
+                error = get_decode_error(response, err)
+            else:
+                if self.response_cache is not None:
+                    self.response_cache.store(cache_key, response.content)
+                return data
+
+            attempt += 1
+            if not should_retry_decode(error, attempt, self.decode_retries):
+                LOGGER.error(error)
+                raise error
+
+            LOGGER.warning('%s, retrying (%s/%s)', error, attempt, self.decode_retries)
+            # Let the caller request a smaller page for the same cursor
+            if on_retry and isinstance(error, RechargeTruncatedResponseError):
+                on_retry(error)
+            await asyncio.sleep(get_retry_delay(attempt))
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path=path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path=path, **kwargs)
+
@@ -0,0 +1,307 @@
+"""
+This module defines the async stream engine: the cursor paging of the
+CursorPagingStream family on the AsyncRechargeClient, so one event loop
+keeps the pages of every stream and backfill window in flight at once.
+The records are still written through the stream's own `write_record`,
+so bookmarks, checkpoints, saved cursors, projection and the change index
+behave as in the threaded sync. Each page is transformed and written on
+the executor of the event loop, so a slow stdout or change index never
+stalls the requests in flight.
+"""
+
+import asyncio
+import datetime
+import functools
+
+import singer
+from singer import Transformer, metrics, utils
+
+from tap_recharge.async_client import AsyncRechargeClient
+from tap_recharge.streams import (
+    INVALID_CURSOR_ERRORS,
+    Checkpoint,
+    CursorPagingStream,
+    get_recharge_bookmark,
+    get_recharge_cursor,
+    write_recharge_bookmark,
+    write_recharge_cursor)
+
+LOGGER = singer.get_logger()
+
+
+class AsyncCursorPagingStream:
+    """
+    Syncs a CursorPagingStream with the AsyncRechargeClient. Pages are always
+    decoded whole, `streaming_parse` does not apply.
+
+    :param stream: The stream to sync
+    :param client: The async API client
+    """
+
+    def __init__(self, stream: CursorPagingStream, client: AsyncRechargeClient):
+        self.stream = stream
+        self.client = client
+
+    @property
+    def tap_stream_id(self) -> str:
+        return self.stream.tap_stream_id
+
+    async def get_pages(self, params: dict, cursor: str = None):
+        """
+        Pages through the stream endpoint, see CursorPagingStream.get_pages.
+
+        :param params: The query params of the first page
+        :param cursor: The cursor to start from instead of the first page
+        :return: Async iterator over (cursor, records) tuples for each page
+        """
+        stream = self.stream
+        while True:
+            if cursor:
+                page_params = {'cursor': cursor, 'limit': stream.page_limit.limit}
+            else:
+                page_params = dict(params, limit=stream.page_limit.limit)
+
+            request_kwargs = {}
+            if stream.page_limit.adaptive:
+                request_kwargs['on_retry'] = functools.partial(stream.page_limit.shrink, page_params)
+
+            records = await self.client.get(stream.path, url=None, params=page_params, **request_kwargs)
+            stream.page_limit.success()
+
+            page = records.get(stream.data_key) or []
+            if page and stream.excluded_fields:
+                page = stream.project(page)
+            yield cursor, page
+
+            cursor = records.get('next_cursor')
+            if not cursor:
+                break
+
+    async def prefetch(self, pages):
+        """
+        Runs the pages iterator on its own task, fetching up to
+        `prefetch_pages` pages ahead while the current page is written.
+
+        :param pages: Async iterator over the (cursor, records) pages
+        :return: Async iterator over the same pages, in order
+        """
+        buffer = asyncio.Queue(self.stream.prefetch_pages)
+        done = object()
+
+        async def produce():
+            try:
+                async for page in pages:
+                    await buffer.put(page)
+                await buffer.put(done)
+            except Exception as err: # pylint: disable=broad-except
+                await buffer.put(err)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                page = await buffer.get()
+                if page is done:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            producer.cancel()
+
+    @staticmethod
+    async def run_blocking(func, *args):
+        """Runs a blocking call (a write to the writer queue, a transform) on the executor of the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+    async def get_record_pages(self, bookmark_datetime: datetime.datetime = None):
+        """
+        Async iterator over the records of the stream, a page at a time, see
+        CursorPagingStream.get_records. The cursor saved with the checkpoints
+        is the one of the page yielded.
+        """
+        stream = self.stream
+        params, query = stream.get_query(bookmark_datetime)
+
+        saved_cursor = stream.cursor
+        stream.cursor = None
+        pages = self.get_pages(params)
+
+        if stream.is_cursor_valid(saved_cursor, query):
+            LOGGER.info('Resuming %s from the cursor saved at %s', self.tap_stream_id, saved_cursor['created_at'])
+            stream.cursor = saved_cursor
+            resumed_pages = self.get_pages(params, saved_cursor['cursor'])
+            try:
+                first_page = await resumed_pages.__anext__()
+            except INVALID_CURSOR_ERRORS as err:
+                LOGGER.warning('The saved cursor of %s was rejected, resuming from the bookmark: %s', self.tap_stream_id, err)
+                stream.cursor = None
+            else:
+                pages = self.chain(first_page, resumed_pages)
+
+        if stream.prefetch_pages:
+            pages = self.prefetch(pages)
+
+        try:
+            async for cursor, page in pages:
+                stream.set_cursor(cursor, query)
+                yield page
+        finally:
+            await pages.aclose()
+
+    @staticmethod
+    async def chain(first_page: tuple, pages):
+        yield first_page
+        async for page in pages:
+            yield page
+
+    # pylint: disable=too-many-arguments
+    async def sync(
+            self,
+            state: dict,
+            stream_schema: dict,
+            stream_metadata: dict,
+            config: dict,
+            transformer: Transformer) -> dict:
+        """
+        Runs a sharded backfill when one is planned or in progress, otherwise
+        the incremental sync, see CursorPagingStream.sync.
+        """
+        stream = self.stream
+        stream.configure(config)
+        stream.streaming_parse = False
+        stream.set_projection(stream_metadata)
+
+        if stream.support_query_filter:
+            state = stream.plan_backfill(state, config)
+
+        try:
+            if state.get('backfill', {}).get(self.tap_stream_id):
+                return await self.sync_backfill(state, stream_schema, stream_metadata, config, transformer)
+            return await self.sync_incremental(state, stream_schema, stream_metadata, config, transformer)
+        finally:
+            if stream.change_index:
+                stream.change_index.close()
+
+    # pylint: disable=too-many-arguments
+    async def sync_incremental(
+            self,
+            state: dict,
+            stream_schema: dict,
+            stream_metadata: dict,
+            config: dict,
+            transformer: Transformer) -> dict:
+        """The incremental sync, see IncrementalStream.sync."""
+        stream = self.stream
+        start_date = get_recharge_bookmark(state, self.tap_stream_id, config['start_date'])
+        bookmark_datetime = utils.strptime_to_utc(start_date)
+        max_datetime = bookmark_datetime
+        checkpoint = Checkpoint(config)
+        stream.cursor = get_recharge_cursor(state, self.tap_stream_id)
+
+        def write_page(page: list, counter: metrics.Counter) -> bool:
+            """Writes the records of a page, returns False once a record older than the bookmark is read."""
+            nonlocal state, max_datetime
+            for record in page:
+                if stream.sort_descending:
+                    record_datetime = stream.get_replication_datetime(record)
+                    if record_datetime and record_datetime < bookmark_datetime:
+                        return False
+
+                record_datetime = stream.write_record(
+                    record,
+                    bookmark_datetime,
+                    stream_schema,
+                    stream_metadata,
+                    transformer,
+                    counter)
+                if record_datetime:
+                    max_datetime = max(record_datetime, max_datetime)
+
+                if checkpoint.tick() and not stream.sort_descending:
+                    state = write_recharge_bookmark(state, self.tap_stream_id, utils.strftime(max_datetime))
+                    state = write_recharge_cursor(state, self.tap_stream_id, stream.cursor)
+                    stream.writer.write_state(state)
+            return True
+
+        pages = self.get_record_pages(bookmark_datetime)
+        with metrics.record_counter(self.tap_stream_id) as counter:
+            try:
+                async for page in pages:
+                    if not await self.run_blocking(write_page, page, counter):
+                        break
+            finally:
+                # Stops the pages fetched ahead
+                await pages.aclose()
+
+        state = write_recharge_bookmark(state, self.tap_stream_id, utils.strftime(max_datetime))
+        state = write_recharge_cursor(state, self.tap_stream_id, None)
+        await self.run_blocking(stream.writer.write_state, state)
+
+        return state
+
+    async def get_window_pages(self, windows: list):
+        """
+        Pages through every window at the same time, each on its own task,
+        see CursorPagingStream.get_window_pages.
+
+        :param windows: The windows to page through
+        :return: Async iterator over (window, records) tuples in the order the
+            pages arrive, records is None once the window is exhausted
+        """
+        pages = asyncio.Queue(len(windows) * 2)
+
+        async def produce(window):
+            params = self.stream.get_params(updated_at_min=utils.strptime_to_utc(window['updated_at_min']))
+            if window['updated_at_max']:
+                params['updated_at_max'] = utils.strptime_to_utc(window['updated_at_max'])
+            try:
+                async for _, page in self.get_pages(params):
+                    await pages.put((window, page))
+                await pages.put((window, None))
+            except Exception as err: # pylint: disable=broad-except
+                await pages.put((window, err))
+
+        producers = [asyncio.ensure_future(produce(window)) for window in windows]
+        remaining = len(producers)
+        try:
+            while remaining:
+                window, page = await pages.get()
+                if isinstance(page, Exception):
+                    raise page
+                if page is None:
+                    remaining -= 1
+                yield window, page
+        finally:
+            for producer in producers:
+                producer.cancel()
+
+    # pylint: disable=too-many-arguments
+    async def sync_backfill(
+            self,
+            state: dict,
+            stream_schema: dict,
+            stream_metadata: dict,
+            config: dict,
+            transformer: Transformer) -> dict:
+        """Syncs the unfinished windows of the backfill concurrently, see CursorPagingStream.sync_backfill."""
+        stream = self.stream
+        backfill = state['backfill'][self.tap_stream_id]
+        windows = backfill['windows']
+        checkpoint = Checkpoint(config)
+
+        LOGGER.info('Backfilling %s over %s windows', self.tap_stream_id, len(windows))
+
+        with metrics.record_counter(self.tap_stream_id) as counter:
+            async for window, page in self.get_window_pages(list(windows)):
+                if page is None:
+                    windows.remove(window)
+                    await self.run_blocking(stream.writer.write_state, state)
+                    continue
+
+                await self.run_blocking(
+                    stream.write_window_page, backfill, window, page, stream_schema, stream_metadata, transformer, counter)
+
+                if checkpoint.tick(len(page)):
+                    await self.run_blocking(stream.writer.write_state, state)
+
+        return await self.run_blocking(stream.finish_backfill, state)
@@ -0,0 +1,123 @@
+"""
+This module defines the local index used to skip unchanged records of the
+streams that cannot be filtered by `updated_at_min`.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from tap_recharge.timestamps import strptime_to_utc
+
+
+INDEX_FILE = 'change_index.sqlite'
+# Entries written to the index in one transaction
+COMMIT_RECORDS = 1000
+
+
+def get_record_hash(record: dict, replication_key: str) -> str:
+    """
+    Hashes the content of a record, leaving out the replication key so a
+    record whose `updated_at` moved without any other change keeps its hash.
+    """
+    content = {key: value for key, value in record.items() if key != replication_key}
+    data = json.dumps(content, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ChangeIndex:
+    """
+    An SQLite index of the records written by the streams, keyed by primary
+    key, holding the replication value and the content hash of each record.
+
+    An entry is only trusted once the bookmark the sync starts from covers
+    its replication value, i.e. once a STATE written after the record was
+    committed by the target. The records of an interrupted sync are therefore
+    written again on the next run.
+
+    The entries are buffered and written in short transactions of
+    `COMMIT_RECORDS` entries, so the streams synced concurrently never wait
+    on a write lock held for the length of another stream.
+
+    :param path: The path of the SQLite database
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # The async engine writes the pages of a stream on the threads of its
+        # executor, one page at a time
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS records ('
+            'stream TEXT NOT NULL, '
+            'key TEXT NOT NULL, '
+            'replication_value TEXT NOT NULL, '
+            'hash TEXT NOT NULL, '
+            'PRIMARY KEY (stream, key))')
+        self.connection.commit()
+        # The entries not committed yet, keyed by (stream, key)
+        self.pending = {}
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """
+        Opens the index under the `state_dir` config directory, None when the
+        index is not configured.
+        """
+        state_dir = config.get('state_dir')
+        if not state_dir:
+            return None
+        os.makedirs(state_dir, exist_ok=True)
+        return cls(os.path.join(state_dir, INDEX_FILE))
+
+    def is_unchanged(
+            self,
+            tap_stream_id: str,
+            key: str,
+            record_hash: str,
+            bookmark: str) -> bool:
+        """
+        Whether the record was already written with the same content.
+
+        :param tap_stream_id: The stream of the record
+        :param key: The primary key of the record, as a string
+        :param record_hash: The hash from get_record_hash
+        :param bookmark: The bookmark the sync started from
+        :return: True if a trusted entry holds the same hash
+        """
+        row = self.pending.get((tap_stream_id, key)) or self.connection.execute(
+            'SELECT replication_value, hash FROM records WHERE stream = ? AND key = ?',
+            (tap_stream_id, key)).fetchone()
+        if not row:
+            return False
+        replication_value, indexed_hash = row
+        return indexed_hash == record_hash and \
+            strptime_to_utc(replication_value) <= strptime_to_utc(bookmark)
+
+    def add(
+            self,
+            tap_stream_id: str,
+            key: str,
+            replication_value: str,
+            record_hash: str):
+        """Saves the entry of a written record, committed with the next batch."""
+        self.pending[(tap_stream_id, key)] = (replication_value, record_hash)
+        if len(self.pending) >= COMMIT_RECORDS:
+            self.commit()
+
+    def commit(self):
+        """Writes the pending entries in a single transaction."""
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO records (stream, key, replication_value, hash) VALUES (?, ?, ?, ?)',
+                [(stream, key, replication_value, record_hash)
+                 for (stream, key), (replication_value, record_hash) in self.pending.items()])
+        self.pending = {}
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -1,3 +1,7 @@
+import datetime
+import random
+import sys
+import threading
 import time
 import backoff
 import requests
@@ -6,8 +10,31 @@ import singer
 from singer import metrics, utils
 from requests.exceptions import Timeout, ChunkedEncodingError
 
+from tap_recharge.compression import TransferStats, get_accept_encoding, get_content_encoding, get_wire_bytes
+from tap_recharge.connection import DEFAULT_IDLE_CONNECTION_TIMEOUT, DEFAULT_POOL_MAXSIZE, PooledHTTPAdapter
+from tap_recharge.http_cache import ResponseCache, get_request_key
+from tap_recharge.json_backend import get_json_backend, is_truncated_document
+from tap_recharge.json_stream import CHUNK_SIZE, StreamingPage
+from tap_recharge.profiling import Profiler
+
 LOGGER = singer.get_logger()
+BASE_URL = 'https://api.rechargeapps.com/'
 REQUEST_TIMEOUT = 600
+# Call/rate limit: https://docs.rechargepayments.com/docs/api-rate-limits
+# Leaky bucket of 40 calls leaking 2 calls per second. The bucket size and
+# level are read from the X-Recharge-Limit header ("used/size") of every
+# response, the leak rate can be raised for higher API plans.
+DEFAULT_BUCKET_SIZE = 40
+DEFAULT_LEAK_RATE = 2.0
+# Calls of the bucket left for other apps sharing the access token
+BUCKET_RESERVE = 2
+# Delay used for a 429 response without a Retry-After header
+RATE_LIMIT_DELAY = 5
+# Retries of a truncated response body, malformed content is retried once
+DECODE_RETRIES = 3
+# Base and cap of the jittered exponential delay between those retries
+DECODE_RETRY_DELAY = 2
+DECODE_RETRY_MAX_DELAY = 60
 
 class Server5xxError(Exception):
     pass
@@ -57,6 +84,15 @@ class RechargeUnprocessableEntityError(RechargeError):
 class RechargeInvalidAPI(RechargeError):
     pass
 
+class RechargeMalformedResponseError(RechargeError):
+    pass
+
+class RechargeTruncatedResponseError(RechargeMalformedResponseError):
+    pass
+
+class RechargeCacheMissError(RechargeError):
+    pass
+
 class RechargeInternalServiceError(Server5xxError):
     pass
 
@@ -132,10 +168,6 @@ ERROR_CODE_EXCEPTION_MAPPING = {
 
 def get_exception_for_error_code(error_code):
     """Function to retrieve exceptions based on error code"""
-    if error_code == 429:
-        # Delay for 5 seconds for leaky bucket rate limit algorithm
-        time.sleep(5)
-
     exception = ERROR_CODE_EXCEPTION_MAPPING.get(error_code, {}).get('exception')
     # If the error code is not from the listed error codes then return Server5XXError or RechargeError respectively
     if not exception:
@@ -168,23 +200,261 @@ def raise_for_error(response):
     raise ex(message) from None
 
 
+def retry_handler(details):
+    """
+    Backoff handler calling the `on_retry` callback of a request before it is
+    retried after a Timeout or ChunkedEncodingError, letting the caller
+    adapt the request (e.g. shrink the page size).
+    """
+    on_retry = details['kwargs'].get('on_retry')
+    exception = sys.exc_info()[1]
+    if on_retry and isinstance(exception, (Timeout, ChunkedEncodingError)):
+        on_retry(exception)
+
+
+def get_decode_error(response, err):
+    """
+    Returns the error for a response body that could not be decoded:
+    RechargeTruncatedResponseError when the body is shorter than its
+    Content-Length or ends before the JSON document is complete,
+    RechargeMalformedResponseError otherwise.
+    """
+    headers = getattr(response, 'headers', None) or {}
+    content_length = headers.get('Content-Length')
+    # Content-Length is the size of the encoded body when it is compressed
+    truncated = bool(content_length) and not headers.get('Content-Encoding') and \
+        str(content_length).isdigit() and len(response.content) < int(content_length)
+
+    if truncated or is_truncated_document(err):
+        return RechargeTruncatedResponseError(f'Truncated response body: {err}')
+    return RechargeMalformedResponseError(f'Malformed response body: {err}')
+
+
+def should_retry_decode(error, attempt, retries):
+    """
+    Whether a response body that could not be decoded is requested again:
+    a truncated transfer is retried up to `retries` times, malformed
+    content once (it rarely decodes on a second attempt).
+    """
+    if not isinstance(error, RechargeTruncatedResponseError):
+        retries = min(retries, 1)
+    return attempt <= retries
+
+
+def get_retry_delay(attempt):
+    """Exponential delay with equal jitter before the given retry (from 1)."""
+    delay = min(DECODE_RETRY_MAX_DELAY, DECODE_RETRY_DELAY * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def get_request_timeout(request_timeout) -> float:
+    """Returns the request timeout in seconds, the default when it is 0, "0", "" or None."""
+    # if request_timeout is other than 0,"0" or "" then use request_timeout
+    if request_timeout and float(request_timeout):
+        return float(request_timeout)
+    # If value is 0,"0" or "" then set default to 300 seconds.
+    return REQUEST_TIMEOUT
+
+
+def get_leak_rate(rate_limit_leak_rate) -> float:
+    """Returns the rate limit leak rate, the default when it is 0, "0", "" or None."""
+    # if rate_limit_leak_rate is other than 0,"0" or "" then use it
+    if rate_limit_leak_rate and float(rate_limit_leak_rate):
+        return float(rate_limit_leak_rate)
+    return DEFAULT_LEAK_RATE
+
+
+def get_decode_retries(decode_retries) -> int:
+    """Returns the decode retry budget, the default when it is None or "", 0 disables the retries."""
+    if decode_retries is not None and str(decode_retries).strip() != '':
+        return int(decode_retries)
+    return DECODE_RETRIES
+
+
+def get_headers(access_token, user_agent=None, accept_encoding=None) -> dict:
+    """Returns the headers sent with every request of a client."""
+    headers = {
+        'X-Recharge-Access-Token': access_token,
+        'Accept': 'application/json',
+        'X-Recharge-Version': '2021-11'}
+    if accept_encoding:
+        headers['Accept-Encoding'] = accept_encoding
+    if user_agent:
+        headers['User-Agent'] = user_agent
+    return headers
+
+
+class RateLimiter:
+    """
+    Thread-safe leaky bucket limiter following the Recharge rate limit. The
+    bucket size and level are synced from the X-Recharge-Limit header of each
+    response and a 429 blocks every caller for its Retry-After delay. One
+    limiter is shared by every thread using the client, so concurrent streams
+    draw from the same request budget.
+
+    :param leak_rate: The number of calls leaking from the bucket per second
+    """
+
+    def __init__(self, leak_rate=DEFAULT_LEAK_RATE):
+        self.leak_rate = leak_rate
+        self.bucket_size = DEFAULT_BUCKET_SIZE
+        self.level = 0.0
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.rate_limited = 0
+        self.throttled_seconds = 0.0
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __leak(self, now):
+        self.level = max(self.level - (now - self.__updated) * self.leak_rate, 0.0)
+        self.__updated = now
+
+    def reserve(self) -> float:
+        """
+        Reserves a call in the bucket, returns the seconds to wait before
+        sending it. The call must be released with `release` once finished.
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__leak(now)
+            # Reserve the call before sleeping so other callers queue behind it
+            self.level += 1
+            overflow = self.level - (self.bucket_size - BUCKET_RESERVE)
+            sleep_time = max(overflow / self.leak_rate, self.blocked_until - now, 0)
+            self.in_flight += 1
+            self.requests += 1
+            self.throttled_seconds += sleep_time
+        return sleep_time
+
+    def acquire(self):
+        """Blocks until a call fits in the bucket."""
+        sleep_time = self.reserve()
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+
+    def release(self):
+        """Marks a call acquired with `acquire` as finished."""
+        with self.__lock:
+            self.in_flight -= 1
+
+    def update(self, status_code, headers):
+        """
+        Syncs the bucket with the rate limit headers of a response.
+
+        :param status_code: The HTTP status code of the response
+        :param headers: The response headers
+        """
+        limit = headers.get('X-Recharge-Limit')
+        retry_after = headers.get('Retry-After')
+
+        with self.__lock:
+            now = time.monotonic()
+            self.__leak(now)
+            if limit:
+                try:
+                    used, size = (int(value) for value in limit.split('/'))
+                except ValueError:
+                    LOGGER.warning('Unexpected X-Recharge-Limit header: %s', limit)
+                else:
+                    self.bucket_size = size
+                    # Calls still in flight are not counted by the server yet
+                    self.level = float(used + max(self.in_flight - 1, 0))
+
+            if status_code == 429:
+                self.rate_limited += 1
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = RATE_LIMIT_DELAY
+                self.level = float(self.bucket_size)
+                self.blocked_until = max(self.blocked_until, now + delay)
+                LOGGER.warning('Rate limited, pausing requests for %s seconds', delay)
+
+    def get_metrics(self):
+        """Returns the current state of the limiter."""
+        with self.__lock:
+            self.__leak(time.monotonic())
+            return {
+                'bucket_size': self.bucket_size,
+                'bucket_level': round(self.level, 2),
+                'leak_rate': self.leak_rate,
+                'requests': self.requests,
+                'rate_limited': self.rate_limited,
+                'throttled_seconds': round(self.throttled_seconds, 3)
+            }
+
+    def log_metrics(self):
+        """Logs the state of the limiter as Singer metrics."""
+        for name, value in self.get_metrics().items():
+            metrics.log(LOGGER, metrics.Point('gauge', f'rate_limit.{name}', value, {}))
+
+
 class RechargeClient:
     def __init__(
             self,
             access_token,
             user_agent=None,
-            request_timeout=REQUEST_TIMEOUT):
+            request_timeout=REQUEST_TIMEOUT,
+            rate_limit_leak_rate=None,
+            json_backend=None,
+            decode_retries=None,
+            base_url=None,
+            pool_maxsize=None,
+            keep_alive=None,
+            idle_connection_timeout=None,
+            tls_session_reuse=None,
+            response_cache: ResponseCache = None,
+            compression=None):
         self.__access_token = access_token
         self.__user_agent = user_agent
         self.__session = requests.Session()
-        self.__base_url = None
+        # if pool_maxsize is other than 0,"0" or "" then use it
+        if pool_maxsize and int(pool_maxsize):
+            pool_maxsize = int(pool_maxsize)
+        else:
+            pool_maxsize = DEFAULT_POOL_MAXSIZE
+        # if idle_connection_timeout is other than None or "" then use it, 0 never closes the idle connections
+        if idle_connection_timeout is not None and str(idle_connection_timeout).strip() != '':
+            idle_connection_timeout = float(idle_connection_timeout)
+        else:
+            idle_connection_timeout = DEFAULT_IDLE_CONNECTION_TIMEOUT
+        # The pooled connections are shared by the threads of the sync
+        self.http_adapter = PooledHTTPAdapter(
+            pool_maxsize,
+            keep_alive=str(keep_alive).lower() != 'false',
+            idle_timeout=idle_connection_timeout,
+            tls_session_reuse=str(tls_session_reuse).lower() == 'true')
+        self.__session.mount('https://', self.http_adapter)
+        self.__session.mount('http://', self.http_adapter)
+        # The root of the API, only changed to run against a local stand-in (see benchmarks/)
+        self.base_url = base_url or BASE_URL
         self.__verified = False
-        # if request_timeout is other than 0,"0" or "" then use request_timeout
-        if request_timeout and float(request_timeout):
-            request_timeout = float(request_timeout)
-        else: # If value is 0,"0" or "" then set default to 300 seconds.
-            request_timeout = REQUEST_TIMEOUT
-        self.request_timeout = request_timeout
+        self.request_timeout = get_request_timeout(request_timeout)
+        self.rate_limiter = RateLimiter(get_leak_rate(rate_limit_leak_rate))
+        # The JSON library used to decode the pages, orjson when installed
+        self.json_backend = get_json_backend(json_backend)
+        self.decode_retries = get_decode_retries(decode_retries)
+        # The durations of the phases of the sync, shared with the streams
+        self.profiler = Profiler()
+        # Records the pages of the sync, or replays them without calling the API
+        self.response_cache = response_cache
+        # The compressions accepted for the responses, and their bytes by endpoint
+        self.accept_encoding = get_accept_encoding(compression)
+        self.transfer_stats = TransferStats()
+        # The headers of every request, built once and merged in by the session
+        self.__session.headers.update(get_headers(access_token, user_agent, self.accept_encoding))
+
+    @property
+    def replaying(self) -> bool:
+        return self.response_cache is not None and self.response_cache.replaying
+
+    def now(self) -> datetime.datetime:
+        """The current time, the time of the recorded sync with the response cache."""
+        if self.response_cache is not None:
+            return self.response_cache.get_now()
+        return utils.now()
 
     # Backoff the request for 5 times when Timeout or Connection error occurs
     @backoff.on_exception(
@@ -193,7 +463,8 @@ class RechargeClient:
         max_tries=5,
         factor=2)
     def __enter__(self):
-        self.__verified = self.check_access_token()
+        # A replayed sync runs offline
+        self.__verified = self.replaying or self.check_access_token()
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
@@ -202,15 +473,9 @@ class RechargeClient:
     def check_access_token(self):
         if self.__access_token is None:
             raise Exception('Error: Missing access_token.')
-        headers = {}
-        if self.__user_agent:
-            headers['User-Agent'] = self.__user_agent
-        headers['X-Recharge-Access-Token'] = self.__access_token
-        headers['Accept'] = 'application/json'
         response = self.__session.get(
             # Simple endpoint that returns 1 record w/ default organization URN
-            url='https://api.rechargeapps.com',
-            headers=headers,
+            url=self.base_url,
             timeout=self.request_timeout)
         if response.status_code != 200:
             LOGGER.error('Error status_code = %s', response.status_code)
@@ -221,76 +486,141 @@ class RechargeClient:
     # Added backoff for 5 times when Timeout error occurs
     @backoff.on_exception(
         backoff.expo,
-        (Timeout, Server5xxError, requests.ConnectionError, RechargeRateLimitError, ChunkedEncodingError),
+        (Timeout, Server5xxError, requests.ConnectionError, ChunkedEncodingError),
         max_tries=5,
-        factor=2)
-    # Call/rate limit: https://docs.rechargepayments.com/docs/api-rate-limits
-    # Reduced rate limit from (120, 60) to (100, 60) due to intermittent 429 errors
-    @utils.ratelimit(100, 60)
-    def request(self, method, path=None, url=None, **kwargs): # pylint: disable=too-many-branches,too-many-statements
-        if not self.__verified:
-            self.__verified = self.check_access_token()
+        factor=2,
+        on_backoff=retry_handler)
+    # The rate limiter already waits for the Retry-After delay of a 429
+    @backoff.on_exception(
+        backoff.constant,
+        RechargeRateLimitError,
+        max_tries=5,
+        interval=0)
+    def request(self, method, path=None, url=None, **kwargs):
+        if self.replaying:
+            return self.__replay(method, path, url, **kwargs)
+        start = time.perf_counter()
+        self.rate_limiter.acquire()
+        self.profiler.add(path or url, 'throttle', time.perf_counter() - start)
+        try:
+            return self.__request(method, path, url, **kwargs)
+        finally:
+            self.rate_limiter.release()
+
+    def __replay(self, method, path=None, url=None, **kwargs):
+        """Serves the request from the response cache, without the rate limit."""
+        key = get_request_key(method, path or url, kwargs.get('params'), kwargs.get('json'))
+        start = time.perf_counter()
+        content = self.response_cache.load(key)
+        if content is None:
+            raise RechargeCacheMissError(
+                f'{key["method"]} {key["path"]} {key["params"]} was not recorded in {self.response_cache.path}')
+        self.profiler.add(path or url, 'download', time.perf_counter() - start)
+
+        if kwargs.get('stream_key'):
+            return StreamingPage([content], kwargs['stream_key'])
+
+        start = time.perf_counter()
+        data = self.json_backend.loads(content)
+        self.profiler.add(path or url, 'decode', time.perf_counter() - start)
+        return data
+
+    def __send(self, method, url, endpoint, **kwargs):
+        with metrics.http_request_timer(endpoint) as timer:
+            response = self.__session.request(method, url, stream=True, timeout=self.request_timeout, **kwargs)
+            timer.tags[metrics.Tag.http_status_code] = response.status_code
 
-        if not url and self.__base_url is None:
-            self.__base_url = 'https://api.rechargeapps.com/'
+        self.rate_limiter.update(response.status_code, getattr(response, 'headers', None) or {})
 
-        if not url and path:
-            url = self.__base_url + path
+        if response.status_code != 200:
+            raise_for_error(response)
 
-        if 'endpoint' in kwargs:
-            endpoint = kwargs['endpoint']
-            del kwargs['endpoint']
-        else:
-            endpoint = None
+        return response
 
-        if 'headers' not in kwargs:
-            kwargs['headers'] = {}
-        kwargs['headers']['X-Recharge-Access-Token'] = self.__access_token
-        kwargs['headers']['Accept'] = 'application/json'
-        kwargs['headers']['X-Recharge-Version'] = '2021-11'
+    def __add_transfer(self, response, key, decoded_bytes):
+        self.transfer_stats.add(
+            key,
+            get_content_encoding(getattr(response, 'headers', None)),
+            get_wire_bytes(response, decoded_bytes),
+            decoded_bytes)
 
-        if self.__user_agent:
-            kwargs['headers']['User-Agent'] = self.__user_agent
+    def __stream(self, response, key, stream_key):
+        """Returns the page parsed as its body downloads, its bytes are counted once it is closed."""
+        decoded_bytes = 0
 
-        if method == 'POST':
-            kwargs['headers']['Content-Type'] = 'application/json'
+        def chunks():
+            nonlocal decoded_bytes
+            for chunk in response.iter_content(CHUNK_SIZE):
+                decoded_bytes += len(chunk)
+                yield chunk
 
-        # Intermittent JSONDecodeErrors when parsing JSON; Adding 2 attempts
-        # FIRST ATTEMPT
-        with metrics.http_request_timer(endpoint) as timer:
-            response = self.__session.request(method, url, stream=True, timeout=self.request_timeout, **kwargs)
-            timer.tags[metrics.Tag.http_status_code] = response.status_code
+        def close():
+            self.__add_transfer(response, key, decoded_bytes)
+            response.close()
 
-        if response.status_code != 200:
-            raise_for_error(response)
+        return StreamingPage(chunks(), stream_key, close)
 
-        # Catch invalid JSON (e.g. unterminated string errors)
-        try:
-            response_json = response.json()
-            return response_json
-        except ValueError as err:  # includes simplejson.decoder.JSONDecodeError
-            LOGGER.warning(err)
+    def __request(self, method, path=None, url=None, **kwargs): # pylint: disable=too-many-branches,too-many-statements
+        # Called before a request is retried, see retry_handler
+        on_retry = kwargs.pop('on_retry', None)
+        # The key of the records array to parse while the page downloads
+        stream_key = kwargs.pop('stream_key', None)
 
-        # SECOND ATTEMPT, if there is a ValueError (unterminated string error)
-        with metrics.http_request_timer(endpoint) as timer:
-            response = self.__session.request(
-                method,
-                url,
-                stream=True,
-                timeout=self.request_timeout,
-                **kwargs)
-            timer.tags[metrics.Tag.http_status_code] = response.status_code
+        if not self.__verified:
+            self.__verified = self.check_access_token()
 
-        if response.status_code != 200:
-            raise_for_error(response)
+        if not url and path:
+            url = self.base_url + path
 
-        # Log invalid JSON (e.g. unterminated string errors)
-        try:
-            response_json = response.json()
-            return response_json
-        except ValueError as err:  # includes simplejson.decoder.JSONDecodeError
-            LOGGER.error(err)
-            raise Exception(err)
+        endpoint = kwargs.pop('endpoint', None)
+
+        # The other headers are the session defaults
+        if method == 'POST':
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'Content-Type': 'application/json'})
+
+        # The recorded pages are read whole, so a truncated body is retried
+        # instead of being recorded
+        recording = self.response_cache is not None
+
+        # Intermittent truncated or malformed bodies; the request is sent
+        # again within the decode retry budget
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            response = self.__send(method, url, endpoint, **kwargs)
+            self.profiler.add(path or url, 'request', time.perf_counter() - start)
+
+            if stream_key and not recording:
+                # The body is downloaded, decompressed and decoded as the records are synced
+                return self.__stream(response, path or url, stream_key)
+
+            start = time.perf_counter()
+            content = response.content
+            self.profiler.add(path or url, 'download', time.perf_counter() - start)
+            self.__add_transfer(response, path or url, len(content))
+            try:
+                start = time.perf_counter()
+                data = self.json_backend.loads(content)
+                self.profiler.add(path or url, 'decode', time.perf_counter() - start)
+            except ValueError as err:  # includes orjson and simplejson JSONDecodeError
+                error = get_decode_error(response, err)
+            else:
+                if recording:
+                    self.response_cache.store(get_request_key(method, path or url, kwargs.get('params'), kwargs.get('json')), content)
+                    if stream_key:
+                        return StreamingPage([content], stream_key)
+                return data
+
+            attempt += 1
+            if not should_retry_decode(error, attempt, self.decode_retries):
+                LOGGER.error(error)
+                raise error
+
+            LOGGER.warning('%s, retrying (%s/%s)', error, attempt, self.decode_retries)
+            # Let the caller request a smaller page for the same cursor
+            if on_retry and isinstance(error, RechargeTruncatedResponseError):
+                on_retry(error)
+            time.sleep(get_retry_delay(attempt))
 
     def get(self, path, **kwargs):
         return self.request('GET', path=path, **kwargs)
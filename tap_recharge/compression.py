@@ -0,0 +1,130 @@
+"""
+This module negotiates the compression of the API responses and counts the
+bytes of each endpoint on the wire and once decoded. The bodies are
+decompressed by urllib3 (and aiohttp for the async client) as they are read,
+including the pages parsed while they download with `streaming_parse`.
+"""
+
+import threading
+
+import singer
+from singer import metrics
+
+try:
+    import brotli # pylint: disable=unused-import
+except ImportError: # pragma: no cover
+    try:
+        import brotlicffi as brotli # pylint: disable=unused-import
+    except ImportError:
+        brotli = None
+
+
+LOGGER = singer.get_logger()
+
+IDENTITY = 'identity'
+
+# The Accept-Encoding header of each `compression` config value
+ACCEPT_ENCODINGS = {
+    'gzip': 'gzip',
+    'br': 'br',
+    'none': IDENTITY
+}
+
+
+def is_brotli_supported() -> bool:
+    """Whether a brotli library, which urllib3 and aiohttp decode `br` bodies with, is installed."""
+    return brotli is not None
+
+
+def get_accept_encoding(compression: str = None) -> str:
+    """
+    Returns the Accept-Encoding header of the requests for the `compression`
+    config: `gzip`, `br`, `none`, or `auto` (default) to accept brotli when
+    installed, gzip and deflate.
+    """
+    compression = (compression or 'auto').lower()
+    if compression in ('auto', 'true'):
+        return 'br, gzip, deflate' if is_brotli_supported() else 'gzip, deflate'
+    if compression == 'false':
+        compression = 'none'
+
+    if compression not in ACCEPT_ENCODINGS:
+        raise ValueError(f'Unknown compression: {compression}, expected one of auto, {", ".join(ACCEPT_ENCODINGS)}')
+    if compression == 'br' and not is_brotli_supported():
+        raise ValueError('compression is br but brotli is not installed')
+
+    return ACCEPT_ENCODINGS[compression]
+
+
+def get_wire_bytes(response, decoded_bytes: int) -> int:
+    """
+    Returns the bytes of a requests response body read from the wire, before
+    decompression, the decoded size when the response does not track them.
+    """
+    raw = getattr(response, 'raw', None)
+    wire_bytes = raw.tell() if raw is not None and hasattr(raw, 'tell') else None
+    return wire_bytes if isinstance(wire_bytes, int) else decoded_bytes
+
+
+def get_content_encoding(headers) -> str:
+    encoding = (headers or {}).get('Content-Encoding')
+    return encoding.lower() if isinstance(encoding, str) and encoding else IDENTITY
+
+
+class TransferStats:
+    """
+    Counts the responses and their bytes on the wire and decoded by endpoint,
+    from every thread.
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self.__lock = threading.Lock()
+
+    def add(self, key: str, encoding: str, wire_bytes: int, decoded_bytes: int):
+        """
+        Records the body of a response.
+
+        :param key: The endpoint path
+        :param encoding: The Content-Encoding of the response
+        :param wire_bytes: The size of the body as received
+        :param decoded_bytes: The size of the body once decompressed
+        """
+        with self.__lock:
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = {'responses': 0, 'compressed': 0, 'wire_bytes': 0, 'decoded_bytes': 0}
+            stats['responses'] += 1
+            if encoding != IDENTITY:
+                stats['compressed'] += 1
+            stats['wire_bytes'] += wire_bytes
+            stats['decoded_bytes'] += decoded_bytes
+
+    def get_summary(self) -> list:
+        """Returns the statistics of each endpoint, with the compression ratio of its bodies."""
+        with self.__lock:
+            return [dict(
+                stats,
+                endpoint=key,
+                ratio=round(stats['decoded_bytes'] / stats['wire_bytes'], 2) if stats['wire_bytes'] else None
+            ) for key, stats in sorted(self.endpoints.items())]
+
+    def log_metrics(self):
+        """Logs the bytes on the wire and decoded of each endpoint as Singer counter metrics."""
+        for stats in self.get_summary():
+            tags = {'endpoint': stats['endpoint'], 'responses': stats['responses'], 'compressed': stats['compressed']}
+            metrics.log(LOGGER, metrics.Point('counter', 'bytes_on_wire', stats['wire_bytes'], tags))
+            metrics.log(LOGGER, metrics.Point('counter', 'decoded_bytes', stats['decoded_bytes'], tags))
+
+    def log_summary(self):
+        """Logs the bytes transferred by endpoint, as a table."""
+        summary = self.get_summary()
+        if not summary:
+            return
+        lines = [f"{'endpoint':<24} {'responses':>9} {'compressed':>10} {'wire MiB':>10} {'decoded MiB':>11} {'ratio':>6}"]
+        for stats in summary:
+            ratio = f"{stats['ratio']:.2f}" if stats['ratio'] else '-'
+            lines.append(
+                f"{stats['endpoint']:<24} {stats['responses']:>9} {stats['compressed']:>10} "
+                f"{stats['wire_bytes'] / 2 ** 20:>10.3f} {stats['decoded_bytes'] / 2 ** 20:>11.3f} {ratio:>6}")
+        LOGGER.info('Bytes transferred by endpoint:\n%s', '\n'.join(lines))
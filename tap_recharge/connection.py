@@ -0,0 +1,202 @@
+"""
+This module holds the HTTP adapter of the client session: the size of its
+connection pool, TCP keep-alive, the reaping of idle connections, the
+optional TLS session reuse and the connection reuse statistics.
+"""
+
+import socket
+import ssl
+import threading
+import time
+import weakref
+
+import singer
+from singer import metrics
+from requests.adapters import HTTPAdapter, DEFAULT_POOLBLOCK
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+LOGGER = singer.get_logger()
+
+# The requests default, enough for a sequential sync with prefetch
+DEFAULT_POOL_MAXSIZE = 10
+# Pooled connections idle for longer are closed instead of reused, as the
+# server may already have closed its side of them
+DEFAULT_IDLE_CONNECTION_TIMEOUT = 30
+# Probes keeping the pooled connections open through NAT and load balancers
+KEEPALIVE_IDLE_SECONDS = 60
+KEEPALIVE_INTERVAL_SECONDS = 15
+KEEPALIVE_PROBES = 4
+
+
+def get_keepalive_socket_options() -> list:
+    """Returns the socket options enabling TCP keep-alive, with the probe timings where the platform supports them."""
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    for name, value in [
+            ('TCP_KEEPIDLE', KEEPALIVE_IDLE_SECONDS),
+            ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL_SECONDS),
+            ('TCP_KEEPCNT', KEEPALIVE_PROBES)]:
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+def get_pool_classes(on_connect) -> dict:
+    """
+    Returns the urllib3 connection pool classes by scheme, with connections
+    calling `on_connect` each time they open a socket. A pooled connection
+    object reconnects in place after its socket was closed, so the pools'
+    own `num_connections` miss those.
+    """
+    def get_connection_class(base):
+        def connect(self):
+            base.connect(self)
+            on_connect()
+        return type(base.__name__, (base,), {'connect': connect})
+
+    return {
+        scheme: type(pool_class.__name__, (pool_class,), {
+            'ConnectionCls': get_connection_class(pool_class.ConnectionCls)})
+        for scheme, pool_class in [('http', HTTPConnectionPool), ('https', HTTPSConnectionPool)]}
+
+
+class SessionReuseContext(ssl.SSLContext):
+    """
+    SSL context resuming the TLS session of the previous connection to the
+    same host, so a new pooled connection skips the full handshake. The
+    TLS 1.3 session tickets arrive after the handshake, so the session is
+    read from the last connection when the next one is opened, or before
+    the pooled connections are closed.
+    """
+
+    def __new__(cls):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self):
+        super().__init__()
+        self.minimum_version = ssl.TLSVersion.TLSv1_2
+        self.handshakes = 0
+        self.resumed = 0
+        self.__sessions = {}
+        self.__sockets = {}
+        self.__lock = threading.Lock()
+
+    def __save_session(self, server_hostname, ssl_sock):
+        session = ssl_sock.session if ssl_sock is not None else None
+        if session is not None and session.has_ticket:
+            self.__sessions[server_hostname] = session
+
+    def save_sessions(self):
+        """Keeps the sessions of the last connection to each host, before its socket is closed."""
+        with self.__lock:
+            for server_hostname, ref in self.__sockets.items():
+                self.__save_session(server_hostname, ref())
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs): # pylint: disable=arguments-differ
+        with self.__lock:
+            ref = self.__sockets.get(server_hostname)
+            self.__save_session(server_hostname, ref() if ref else None)
+            if session is None:
+                session = self.__sessions.get(server_hostname)
+
+        ssl_sock = super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+
+        with self.__lock:
+            self.handshakes += 1
+            if ssl_sock.session_reused:
+                self.resumed += 1
+            self.__sockets[server_hostname] = weakref.ref(ssl_sock)
+            self.__save_session(server_hostname, ssl_sock)
+        return ssl_sock
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter of the client session. Its pool keeps up to `pool_maxsize`
+    connections open per host for the threads sharing the client, and the
+    pooled connections are closed when the adapter has been idle for longer
+    than `idle_timeout` seconds.
+
+    :param pool_maxsize: The number of connections kept open per host
+    :param keep_alive: Reuses the connections with TCP keep-alive, otherwise each request asks the server to close its connection
+    :param idle_timeout: Seconds without requests after which the pooled connections are closed, 0 never closes them
+    :param tls_session_reuse: Resumes the TLS session of the previous connection when a new one is opened
+    """
+
+    def __init__(
+            self,
+            pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+            keep_alive: bool = True,
+            idle_timeout: float = DEFAULT_IDLE_CONNECTION_TIMEOUT,
+            tls_session_reuse: bool = False):
+        # Read by init_poolmanager, which the HTTPAdapter constructor calls
+        self.keep_alive = keep_alive
+        self.idle_timeout = idle_timeout
+        self.ssl_context = SessionReuseContext() if tls_session_reuse else None
+        self.requests = 0
+        self.connections_opened = 0
+        self.idle_reaps = 0
+        self.__in_flight = 0
+        self.__last_used = None
+        self.__lock = threading.Lock()
+        super().__init__(pool_maxsize=pool_maxsize)
+
+    def init_poolmanager(self, connections, maxsize, block=DEFAULT_POOLBLOCK, **pool_kwargs):
+        if self.keep_alive:
+            pool_kwargs['socket_options'] = HTTPConnection.default_socket_options + get_keepalive_socket_options()
+        if self.ssl_context is not None:
+            pool_kwargs['ssl_context'] = self.ssl_context
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = get_pool_classes(self.__on_connect)
+
+    def __on_connect(self):
+        with self.__lock:
+            self.connections_opened += 1
+
+    def __reap(self):
+        """Closes the pooled connections."""
+        if self.ssl_context is not None:
+            self.ssl_context.save_sessions()
+        self.poolmanager.clear()
+        self.idle_reaps += 1
+
+    def send(self, request, **kwargs): # pylint: disable=arguments-differ
+        with self.__lock:
+            now = time.monotonic()
+            if self.idle_timeout and not self.__in_flight and self.__last_used is not None \
+                    and now - self.__last_used > self.idle_timeout:
+                LOGGER.debug('Closing the connections idle for %.1f seconds', now - self.__last_used)
+                self.__reap()
+            self.__in_flight += 1
+            self.requests += 1
+
+        if not self.keep_alive:
+            request.headers['Connection'] = 'close'
+
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            with self.__lock:
+                self.__in_flight -= 1
+                self.__last_used = time.monotonic()
+
+    def get_metrics(self) -> dict:
+        """Returns the connection reuse statistics."""
+        with self.__lock:
+            stats = {
+                'pool_maxsize': self._pool_maxsize,
+                'requests': self.requests,
+                'connections_opened': self.connections_opened,
+                'connections_reused': max(self.requests - self.connections_opened, 0),
+                'idle_reaps': self.idle_reaps
+            }
+        if self.ssl_context is not None:
+            stats['tls_handshakes'] = self.ssl_context.handshakes
+            stats['tls_sessions_resumed'] = self.ssl_context.resumed
+        return stats
+
+    def log_metrics(self):
+        """Logs the connection reuse statistics as Singer metrics."""
+        for name, value in self.get_metrics().items():
+            metrics.log(LOGGER, metrics.Point('gauge', f'connection_pool.{name}', value, {}))
@@ -0,0 +1,174 @@
+"""
+This module defines the response cache of the client, recording the pages
+of a sync to a local directory and replaying them offline, e.g. to re-run a
+sync after a schema or transform change, or to profile it repeatably,
+without spending the rate limit.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+
+import singer
+from singer import metrics, utils
+
+
+LOGGER = singer.get_logger()
+
+RECORD = 'record'
+REPLAY = 'replay'
+CACHE_MODES = (RECORD, REPLAY)
+
+# The params left out of the request keys: the page size of a request
+# changes with the retries of an adaptive page size, not the page it reads
+IGNORED_PARAMS = frozenset(['limit'])
+
+
+def get_request_key(method: str, path: str, params: dict = None, body=None) -> dict:
+    """
+    Returns the fields identifying a request: its method, path, query params
+    (which hold the cursor of the page) except the page size, and JSON body,
+    with the values as strings the way they are sent.
+    """
+    return {
+        'method': method.upper(),
+        'path': path,
+        'params': {
+            key: str(value) for key, value in (params or {}).items()
+            if value is not None and key not in IGNORED_PARAMS},
+        'body': body
+    }
+
+
+def get_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResponseCache:
+    """
+    A content-addressed cache of response bodies. Each body is stored once,
+    compressed, under the hash of its content, and each request is stored
+    under the hash of its key (see get_request_key) pointing to its body.
+    Files are written to a temporary name and renamed, so the threads of a
+    sync and interrupted runs never leave partial entries. The time of the
+    last recorded sync is saved with it (see get_now).
+
+    :param path: The cache directory
+    :param mode: `record` stores the responses of the API, `replay` serves
+        the requests from the cache without calling the API
+    """
+
+    def __init__(self, path: str, mode: str = RECORD):
+        if mode not in CACHE_MODES:
+            raise ValueError(f'Unknown http_cache_mode {mode}, expected one of {", ".join(CACHE_MODES)}')
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.__now = None
+        self.__lock = threading.Lock()
+        os.makedirs(os.path.join(path, 'requests'), exist_ok=True)
+        os.makedirs(os.path.join(path, 'bodies'), exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """
+        Opens the cache in the `http_cache_dir` config directory, None when
+        the cache is not configured.
+        """
+        path = config.get('http_cache_dir')
+        if not path:
+            return None
+        return cls(path, (config.get('http_cache_mode') or RECORD).lower())
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    def __get_request_path(self, key: dict) -> str:
+        digest = get_digest(json.dumps(key, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+        return os.path.join(self.path, 'requests', f'{digest}.json')
+
+    def __get_body_path(self, digest: str) -> str:
+        return os.path.join(self.path, 'bodies', f'{digest}.zz')
+
+    def __write(self, path: str, data: bytes):
+        """Writes the file atomically."""
+        file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def get_now(self) -> datetime.datetime:
+        """
+        Returns the time the sync runs at, fixed for the whole sync: when
+        recording, the time of the first call, saved in the cache; when
+        replaying, the saved time, so the queries built from it (e.g. the
+        backfill windows, the age of a saved cursor) are the recorded ones.
+        """
+        with self.__lock:
+            if self.__now is None:
+                path = os.path.join(self.path, 'clock.json')
+                if self.replaying:
+                    with open(path, 'rb') as file:
+                        self.__now = utils.strptime_to_utc(json.loads(file.read())['now'])
+                else:
+                    self.__now = utils.now()
+                    self.__write(path, json.dumps({'now': utils.strftime(self.__now)}).encode('utf-8'))
+            return self.__now
+
+    def load(self, key: dict) -> bytes:
+        """
+        Returns the recorded body of a request, None when it was not recorded.
+
+        :param key: The request key from get_request_key
+        """
+        try:
+            with open(self.__get_request_path(key), 'rb') as file:
+                entry = json.loads(file.read())
+            with open(self.__get_body_path(entry['body_digest']), 'rb') as file:
+                content = zlib.decompress(file.read())
+        except FileNotFoundError:
+            with self.__lock:
+                self.misses += 1
+            return None
+
+        with self.__lock:
+            self.hits += 1
+        return content
+
+    def store(self, key: dict, content: bytes):
+        """
+        Records the body of a request.
+
+        :param key: The request key from get_request_key
+        :param content: The response body
+        """
+        digest = get_digest(content)
+        body_path = self.__get_body_path(digest)
+        if not os.path.exists(body_path):
+            self.__write(body_path, zlib.compress(content))
+
+        entry = dict(key, body_digest=digest)
+        self.__write(self.__get_request_path(key), json.dumps(entry, sort_keys=True).encode('utf-8'))
+        with self.__lock:
+            self.stored += 1
+
+    def get_metrics(self) -> dict:
+        """Returns the cache statistics."""
+        with self.__lock:
+            return {'hits': self.hits, 'misses': self.misses, 'stored': self.stored}
+
+    def log_metrics(self):
+        """Logs the cache statistics as Singer metrics."""
+        for name, value in self.get_metrics().items():
+            metrics.log(LOGGER, metrics.Point('gauge', f'http_cache.{name}', value, {}))
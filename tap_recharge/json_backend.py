@@ -0,0 +1,152 @@
+"""
+This module defines the JSON backends used to decode the API responses and
+encode the RECORD messages. By default the pages are decoded with orjson
+when installed and the messages are the lines singer-python writes. The
+orjson backend also writes the messages, with compact separators and UTF-8
+characters, byte-identical to the reference encoder with the same options.
+"""
+
+import json
+import re
+
+import simplejson
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
+
+
+# orjson does not escape U+2028/U+2029, messages that may hold either are
+# encoded by the reference encoder
+_DIFFERENT_OUTPUT = re.compile(rb'\xe2\x80[\xa8\xa9]')
+
+# The floats orjson and repr() both write as plain decimals (e.g. 0.0001,
+# 1500.0), orjson writes the others as 0.00001/1e16 where repr() writes
+# 1e-05/1e+16
+_MIN_PLAIN_FLOAT = 1e-4
+_MAX_PLAIN_FLOAT = 1e16
+
+# What is left of a document cut in a number or a literal
+_CUT_VALUE = re.compile(r'[-+0-9.eE]*|t(r(ue?)?)?|f(a(l(se?)?)?)?|n(u(ll?)?)?')
+
+
+def has_different_float(obj) -> bool:
+    """
+    Whether a value holds a float orjson writes differently from the
+    reference encoder: in exponent notation, or not finite (NaN and
+    Infinity, which orjson writes as null).
+    """
+    if isinstance(obj, float):
+        if obj == 0:
+            return False
+        # NaN and Infinity are outside the range too
+        return not _MIN_PLAIN_FLOAT <= abs(obj) < _MAX_PLAIN_FLOAT
+    if isinstance(obj, dict):
+        return any(has_different_float(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(has_different_float(value) for value in obj)
+    return False
+
+
+def dumps_compact(obj) -> str:
+    """Encodes with the reference encoder, with compact separators and UTF-8 characters as orjson."""
+    return simplejson.dumps(obj, use_decimal=True, ensure_ascii=False, separators=(',', ':'))
+
+
+class JsonBackend:
+    """
+    The reference backend: the stdlib decoder, and the encoder and options
+    singer-python writes messages with (simplejson), so RECORD messages are
+    the lines singer.write_record writes.
+    """
+    name = 'json'
+
+    @staticmethod
+    def loads(data: bytes):
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj) -> str:
+        return simplejson.dumps(obj, use_decimal=True)
+
+
+class OrjsonBackend(JsonBackend):
+    """
+    Uses orjson, with compact separators and UTF-8 characters. The messages
+    holding values orjson does not handle (e.g. integers over 64 bits,
+    Decimals) or writes differently (floats outside [1e-4, 1e16), NaN and
+    Infinity, line/paragraph separators) are encoded by the reference
+    encoder with the same options.
+    """
+    # pylint: disable=no-member
+    name = 'orjson'
+
+    @staticmethod
+    def loads(data: bytes):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return JsonBackend.loads(data)
+
+    @staticmethod
+    def dumps(obj) -> str:
+        if has_different_float(obj):
+            return dumps_compact(obj)
+        try:
+            data = orjson.dumps(obj)
+        except TypeError: # includes orjson.JSONEncodeError
+            return dumps_compact(obj)
+        if _DIFFERENT_OUTPUT.search(data):
+            return dumps_compact(obj)
+        return data.decode('utf-8')
+
+
+class OrjsonLoadsBackend(JsonBackend):
+    """
+    Decodes with orjson and encodes with the reference encoder, so RECORD
+    messages are the lines singer.write_record writes. Making orjson write
+    those lines (spaced separators, ASCII escapes) costs more than the
+    reference encoder.
+    """
+    name = 'auto'
+
+    @staticmethod
+    def loads(data: bytes):
+        return OrjsonBackend.loads(data)
+
+
+JSON_BACKENDS = {
+    'json': JsonBackend,
+    'orjson': OrjsonBackend
+}
+
+
+def is_truncated_document(err: ValueError) -> bool:
+    """
+    Tells a JSON document cut short (e.g. a body truncated in transfer) from
+    malformed content: the decoder stopped at the end of the document, in a
+    number or literal running to the end, or in a string never closed.
+    """
+    if not isinstance(err, json.JSONDecodeError):
+        return False
+    if err.msg.startswith('Unterminated string'):
+        return True
+    return bool(_CUT_VALUE.fullmatch(err.doc[err.pos:].rstrip()))
+
+
+def get_json_backend(name: str = None):
+    """
+    Returns the JSON backend for the `json_backend` config value: `json`,
+    `orjson`, or `auto` (default) to decode with orjson when installed and
+    write the singer-python lines.
+    """
+    if not name or name == 'auto':
+        return OrjsonLoadsBackend if orjson else JsonBackend
+
+    if name not in JSON_BACKENDS:
+        raise ValueError(f'Unknown json_backend: {name}, expected one of auto, {", ".join(JSON_BACKENDS)}')
+    if name == 'orjson' and not orjson:
+        raise ValueError('json_backend is orjson but orjson is not installed')
+
+    return JSON_BACKENDS[name]
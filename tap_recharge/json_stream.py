@@ -0,0 +1,173 @@
+"""
+This module parses list endpoint responses while they download.
+"""
+
+import codecs
+import collections
+import json
+
+from typing import Iterator
+
+from tap_recharge.json_backend import is_truncated_document
+
+
+# Size of the chunks read from the response body
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+_DECODER = json.JSONDecoder()
+_END = object()
+
+
+class TruncatedPageError(ValueError):
+    """The body ended before the page was complete."""
+
+
+class StreamingPage:
+    """
+    A page of a list endpoint, e.g. {"next_cursor": "...", "charges": [...]},
+    parsed incrementally. The records of the `data_key` array are yielded one
+    at a time as the body arrives, without holding the whole page in memory.
+    The other top-level values (like `next_cursor`) are kept in `fields`.
+
+    Supports the `get` calls used on the parsed dict of a page: `get(data_key)`
+    returns the record iterator, any other key is parsed up to (records met
+    on the way are kept for the iterator).
+
+    :param chunks: Iterator over the bytes of the response body
+    :param data_key: The key of the records array
+    :param close: Called once the body has been parsed or the page is closed
+    """
+
+    def __init__(self, chunks: Iterator[bytes], data_key: str, close=None):
+        self.data_key = data_key
+        self.fields = {}
+        self.done = False
+        self._chunks = iter(chunks)
+        self._close = close
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+        self._pending = collections.deque()
+        self._events = self._parse()
+
+    def __iter__(self):
+        return self.records()
+
+    def records(self) -> Iterator[dict]:
+        """Yields the records of the page as they are parsed."""
+        try:
+            while True:
+                if self._pending:
+                    yield self._pending.popleft()
+                    continue
+                record = next(self._events, _END)
+                if record is _END:
+                    return
+                yield record
+        finally:
+            # Release the connection once the records are read or abandoned
+            self.close()
+
+    def get(self, key: str, default=None):
+        if key == self.data_key:
+            return self.records()
+
+        while key not in self.fields and not self.done:
+            record = next(self._events, _END)
+            if record is _END:
+                break
+            self._pending.append(record)
+
+        return self.fields.get(key, default)
+
+    def close(self):
+        if self._close:
+            self._close()
+            self._close = None
+
+    def _read(self) -> bool:
+        """Appends the next chunk of the body to the buffer, False at the end."""
+        if self._eof:
+            return False
+
+        # Drop the parsed part of the buffer
+        self._buffer = self._buffer[self._position:]
+        self._position = 0
+
+        for chunk in self._chunks:
+            text = self._text_decoder.decode(chunk)
+            if text:
+                self._buffer += text
+                return True
+
+        self._eof = True
+        text = self._text_decoder.decode(b'', final=True)
+        self._buffer += text
+        return bool(text)
+
+    def _peek(self) -> str:
+        """Skips whitespace and returns the next character, '' at the end of the body."""
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in WHITESPACE:
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read():
+                return ''
+
+    def _expect(self, characters: str) -> str:
+        character = self._peek()
+        if not character:
+            raise TruncatedPageError(f'Expecting one of {characters!r} at position {self._position}, '
+                                     f'found the end of the {self.data_key} page')
+        if character not in characters:
+            raise ValueError(f'Expecting one of {characters!r} at position {self._position}, '
+                             f'found {character!r} while parsing the {self.data_key} page')
+        self._position += 1
+        return character
+
+    def _value(self):
+        """Decodes the next JSON value, reading the body until the value is complete."""
+        self._peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError as err:
+                if self._read():
+                    continue
+                if is_truncated_document(err):
+                    raise TruncatedPageError(str(err)) from err
+                raise
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and self._read():
+                continue
+            self._position = end
+            return value
+
+    def _parse(self) -> Iterator[dict]:
+        self._expect('{')
+        if self._peek() == '}':
+            self._position += 1
+        else:
+            while True:
+                key = self._value()
+                self._expect(':')
+                if key == self.data_key and self._peek() == '[':
+                    self._position += 1
+                    if self._peek() == ']':
+                        self._position += 1
+                    else:
+                        while True:
+                            yield self._value()
+                            if self._expect(',]') == ']':
+                                break
+                else:
+                    self.fields[key] = self._value()
+
+                if self._expect(',}') == '}':
+                    break
+
+        self.done = True
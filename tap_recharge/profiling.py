@@ -0,0 +1,165 @@
+"""
+This module times the phases of a sync (rate limit wait, HTTP request,
+body download, JSON decode, transform and write) by stream, and runs the
+optional cProfile hook.
+"""
+
+import contextlib
+import cProfile
+import io
+import math
+import pstats
+import sys
+import threading
+
+import singer
+from singer import metrics
+
+
+LOGGER = singer.get_logger()
+
+# The phases in the order a record goes through them
+PHASES = ['throttle', 'request', 'download', 'decode', 'transform', 'write']
+
+# Each histogram bucket spans a factor of 2 ** (1 / BUCKETS_PER_OCTAVE),
+# so the percentiles are within 19% of the measured durations
+BUCKETS_PER_OCTAVE = 4
+MIN_SECONDS = 1e-7
+
+# Functions of the cProfile stats logged at the end of the sync
+PROFILE_TOP_FUNCTIONS = 25
+
+# From Python 3.12 cProfile runs on sys.monitoring: only one profiler can be
+# active in the process, and it sees every thread
+PROFILER_PER_THREAD = sys.version_info < (3, 12)
+
+
+class Histogram:
+    """The count, total, maximum and log scale distribution of the durations of a phase."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        bucket = math.ceil(math.log2(max(seconds, MIN_SECONDS)) * BUCKETS_PER_OCTAVE)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, percent: float) -> float:
+        """Returns the upper bound of the bucket holding the percentile, capped at the maximum."""
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(2 ** (bucket / BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+
+class Profiler:
+    """
+    Collects the durations of the phases of the sync by stream, from every
+    thread. The network phases are keyed by the endpoint path, which is the
+    stream name except for the metafields streams.
+
+    :param profile_path: Where the cProfile stats are saved, no profiling when not set
+    """
+
+    def __init__(self, profile_path: str = None):
+        self.profile_path = profile_path
+        self.histograms = {}
+        self.profiles = []
+        self.active_profiles = 0
+        self.__lock = threading.Lock()
+
+    def add(self, key: str, phase: str, seconds: float):
+        """Records the duration of a phase of the stream or endpoint."""
+        with self.__lock:
+            histogram = self.histograms.get((key, phase))
+            if histogram is None:
+                histogram = self.histograms[(key, phase)] = Histogram()
+            histogram.add(seconds)
+
+    def get_summary(self) -> list:
+        """Returns the statistics of each stream and phase, in seconds."""
+        with self.__lock:
+            histograms = sorted(
+                self.histograms.items(),
+                key=lambda item: (item[0][0], PHASES.index(item[0][1]) if item[0][1] in PHASES else len(PHASES)))
+            return [{
+                'endpoint': key,
+                'phase': phase,
+                'count': histogram.count,
+                'total': round(histogram.total, 6),
+                'p50': round(histogram.percentile(50), 6),
+                'p95': round(histogram.percentile(95), 6),
+                'p99': round(histogram.percentile(99), 6),
+                'max': round(histogram.max, 6)
+            } for (key, phase), histogram in histograms]
+
+    def log_metrics(self):
+        """
+        Logs a Singer timer metric per stream and phase, its value is the total
+        time, the count and percentiles are tags.
+        """
+        for stats in self.get_summary():
+            tags = {key: value for key, value in stats.items() if key != 'total'}
+            metrics.log(LOGGER, metrics.Point('timer', 'phase_duration', stats['total'], tags))
+
+    def log_summary(self):
+        """Logs the time spent in each phase by stream, as a table."""
+        summary = self.get_summary()
+        if not summary:
+            return
+        lines = [f"{'endpoint':<24} {'phase':<10} {'count':>9} {'total s':>10} "
+                 f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for stats in summary:
+            lines.append(
+                f"{stats['endpoint']:<24} {stats['phase']:<10} {stats['count']:>9} {stats['total']:>10.3f} "
+                f"{stats['p50'] * 1000:>9.3f} {stats['p95'] * 1000:>9.3f} "
+                f"{stats['p99'] * 1000:>9.3f} {stats['max'] * 1000:>9.3f}")
+        LOGGER.info('Time spent by phase:\n%s', '\n'.join(lines))
+
+    @contextlib.contextmanager
+    def profile(self):
+        """
+        Runs the block under cProfile when `profile_path` is set. Before
+        Python 3.12 cProfile only sees the calling thread, so each worker
+        thread runs its own profile; from 3.12 the first profile sees every
+        thread and the blocks entered while it runs are not profiled again.
+        """
+        with self.__lock:
+            enabled = bool(self.profile_path) and (PROFILER_PER_THREAD or not self.active_profiles)
+            if enabled:
+                self.active_profiles += 1
+        if not enabled:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            yield
+        finally:
+            profile.disable()
+            with self.__lock:
+                self.active_profiles -= 1
+                self.profiles.append(profile)
+
+    def dump_profile(self):
+        """Saves the merged cProfile stats of the profiled threads to `profile_path`."""
+        with self.__lock:
+            profiles = list(self.profiles)
+        if not self.profile_path or not profiles:
+            return
+
+        output = io.StringIO()
+        stats = pstats.Stats(*profiles, stream=output)
+        stats.dump_stats(self.profile_path)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        LOGGER.info('Saved the profile of the sync to %s\n%s', self.profile_path, output.getvalue())
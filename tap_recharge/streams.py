@@ -2,19 +2,243 @@
 This module defines the stream classes and their individual sync logic.
 """
 
+import collections
+import contextlib
 import datetime
-
+import functools
+import itertools
+import json
+import queue
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 from typing import Iterator
 
+import requests
 import singer
 from singer import Transformer, utils, metrics, bookmarks
-
-from tap_recharge.client import RechargeClient
+from requests.exceptions import ChunkedEncodingError
+
+from tap_recharge.change_index import ChangeIndex, get_record_hash
+from tap_recharge.client import (
+    RechargeClient,
+    RechargeBadRequestError,
+    RechargeMalformedResponseError,
+    RechargeNotFoundError,
+    RechargeTruncatedResponseError,
+    RechargeUnprocessableEntityError,
+    get_retry_delay,
+    should_retry_decode)
+from tap_recharge.json_stream import TruncatedPageError
+from tap_recharge.timestamps import strptime_to_utc
+from tap_recharge.transform import get_excluded_fields
+from tap_recharge.writer import MessageWriter
 
 
 LOGGER = singer.get_logger()
 
-MAX_PAGE_LIMIT = 50
+# The 2021-11 list endpoints return up to 250 records per page
+MAX_PAGE_LIMIT = 250
+DEFAULT_PAGE_LIMIT = 250
+# Bounds of the adaptive page size: the smallest page it shrinks to and the
+# number of successful pages before it grows back
+MIN_PAGE_LIMIT = 10
+PAGE_LIMIT_GROW_AFTER = 5
+
+# Backfills are only sharded into windows spanning at least this long
+MIN_BACKFILL_WINDOW = datetime.timedelta(days=1)
+
+# Intermediate STATE is written every `checkpoint_records` records or
+# `checkpoint_seconds` seconds, whichever comes first
+DEFAULT_CHECKPOINT_RECORDS = 1000
+DEFAULT_CHECKPOINT_SECONDS = 60
+
+# Pages fetched ahead of the page being synced, 0 disables the prefetch
+DEFAULT_PREFETCH_PAGES = 1
+
+# Parent requests of a child stream sent at once
+DEFAULT_CHILD_WORKERS = 4
+
+# Saved cursors older than this are not resumed
+MAX_CURSOR_AGE = datetime.timedelta(hours=24)
+
+# Errors returned by the API for a cursor it no longer accepts
+INVALID_CURSOR_ERRORS = (
+    RechargeBadRequestError,
+    RechargeNotFoundError,
+    RechargeUnprocessableEntityError)
+
+
+def get_int_config(config: dict, key: str, default: int) -> int:
+    """
+    Retrieves a positive integer value from the config.
+
+    :param config: A dictionary containing tap config data
+    :param key: The config key
+    :param default: The value used when the key is missing, 0, "0" or ""
+    :return: The config value as int
+    """
+    value = config.get(key)
+    if value and int(value) > 0:
+        return int(value)
+    return default
+
+
+def get_bool_config(config: dict, key: str) -> bool:
+    """
+    Retrieves a boolean value from the config, accepting true/false strings.
+
+    :param config: A dictionary containing tap config data
+    :param key: The config key
+    :return: The config value as bool
+    """
+    value = config.get(key)
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    return bool(value)
+
+
+class PageLimit:
+    """
+    The page size used to page through a stream. When adaptive, the size is
+    halved whenever a request is retried after a Timeout or
+    ChunkedEncodingError, and doubled back towards the configured size after
+    `PAGE_LIMIT_GROW_AFTER` successful pages.
+
+    :param limit: The configured page size
+    :param adaptive: Whether the page size adapts to failed requests
+    """
+
+    def __init__(self, limit: int = DEFAULT_PAGE_LIMIT, adaptive: bool = False):
+        self.max_limit = limit
+        self.limit = limit
+        self.adaptive = adaptive
+        self.successes = 0
+
+    @classmethod
+    def from_config(cls, config: dict, tap_stream_id: str, default: int):
+        """
+        Creates the page limit of a stream from the `page_size` config, either
+        a number for every stream or an object keyed by stream.
+        """
+        page_size = config.get('page_size')
+        if isinstance(page_size, dict):
+            page_size = page_size.get(tap_stream_id)
+        limit = int(page_size) if page_size and int(page_size) > 0 else default
+
+        return cls(min(limit, MAX_PAGE_LIMIT), get_bool_config(config, 'adaptive_page_size'))
+
+    def shrink(self, params: dict, exception: Exception = None):
+        """Halves the page size and updates the params of the retried request."""
+        limit = max(self.limit // 2, MIN_PAGE_LIMIT)
+        if limit < self.limit:
+            LOGGER.warning('Reducing page size from %s to %s after: %s', self.limit, limit, repr(exception))
+        self.limit = limit
+        self.successes = 0
+        params['limit'] = self.limit
+
+    def success(self):
+        """Counts a successful page, growing the page size when due."""
+        if not self.adaptive or self.limit >= self.max_limit:
+            return
+        self.successes += 1
+        if self.successes >= PAGE_LIMIT_GROW_AFTER:
+            self.limit = min(self.limit * 2, self.max_limit)
+            self.successes = 0
+            LOGGER.info('Increasing page size to %s', self.limit)
+
+
+class Checkpoint:
+    """
+    Decides when a stream writes an intermediate STATE message.
+
+    :param config: A dictionary containing tap config data
+    """
+
+    def __init__(self, config: dict):
+        self.records = get_int_config(config, 'checkpoint_records', DEFAULT_CHECKPOINT_RECORDS)
+        self.seconds = get_int_config(config, 'checkpoint_seconds', DEFAULT_CHECKPOINT_SECONDS)
+        self.reset()
+
+    def reset(self):
+        self.pending = 0
+        self.last_time = time.monotonic()
+
+    def tick(self, count: int = 1) -> bool:
+        """
+        Counts processed records, returns True (and restarts the interval)
+        once a checkpoint is due.
+        """
+        self.pending += count
+        if self.pending >= self.records or time.monotonic() - self.last_time >= self.seconds:
+            self.reset()
+            return True
+        return False
+
+
+class RetryingPage:
+    """
+    Wraps a streamed page, requesting it again for the same cursor when the
+    body breaks off or turns out malformed while its records are read, within
+    the client decode retry budget. Records already yielded are skipped (by
+    primary key) on the next attempt, so a bad page does not fail the sync.
+
+    :param request: Returns a new StreamingPage for the same params
+    :param page: The StreamingPage of the first attempt
+    :param data_key: The key of the records array
+    :param key_properties: The primary key of the records
+    :param retries: The client decode retry budget
+    :param on_retry: Called with the error before a truncated page is requested again
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, request, page, data_key: str, key_properties: list, retries: int, on_retry=None):
+        self.request = request
+        self.page = page
+        self.data_key = data_key
+        self.key_properties = key_properties
+        self.retries = retries
+        self.on_retry = on_retry
+
+    def get(self, key: str, default=None):
+        if key == self.data_key:
+            return self.records()
+        return self.page.get(key, default)
+
+    def records(self) -> Iterator[dict]:
+        synced_keys = set()
+        synced = 0
+        attempt = 0
+        while True:
+            try:
+                for record in self.page.get(self.data_key):
+                    if self.key_properties:
+                        key = tuple(record.get(key_property) for key_property in self.key_properties)
+                        if key in synced_keys:
+                            continue
+                        synced_keys.add(key)
+                    synced += 1
+                    yield record
+                return
+            except (ValueError, ChunkedEncodingError, requests.ConnectionError) as err:
+                if isinstance(err, (TruncatedPageError, ChunkedEncodingError, requests.ConnectionError)):
+                    error = RechargeTruncatedResponseError(f'Truncated response body: {err}')
+                else:
+                    error = RechargeMalformedResponseError(f'Malformed response body: {err}')
+
+                attempt += 1
+                if not should_retry_decode(error, attempt, self.retries):
+                    LOGGER.error(error)
+                    raise error from err
+
+                LOGGER.warning('%s after %s records, requesting the page again (%s/%s)',
+                               error, synced, attempt, self.retries)
+                if self.on_retry and isinstance(error, RechargeTruncatedResponseError):
+                    self.on_retry(error)
+                time.sleep(get_retry_delay(attempt))
+                self.page = self.request()
 
 
 def get_recharge_bookmark(
@@ -48,11 +272,85 @@ def write_recharge_bookmark(
 
     return state
 
+def get_recharge_cursor(state: dict, tap_stream_id: str) -> dict:
+    """
+    Retrieves the saved cursor of an interrupted sync from the state dict.
+
+    :param state: The dict of the current state.
+    :param tap_stream_id: The stream for which to get the cursor.
+    :return: Cursor dict for stream or None.
+    """
+    return state.get('cursors', {}).get(tap_stream_id)
+
+def write_recharge_cursor(
+        state: dict,
+        tap_stream_id: str,
+        value: dict) -> dict:
+    """
+    Writes the cursor of the page being synced next to the bookmarks, which
+    keep their original structure:
+        { "cursors": { "tap_stream_id": {
+            "cursor": "value", "created_at": "value", "query": {...}
+        } } }
+    A None value removes the cursor of the stream.
+
+    :param state: The dict of the current state.
+    :param tap_stream_id: The stream for which to write the cursor.
+    :param value: The cursor dict.
+    :return: New state dict.
+    """
+    if value:
+        state = bookmarks.ensure_bookmark_path(state, ['cursors'])
+        state['cursors'][tap_stream_id] = value
+    elif tap_stream_id in state.get('cursors', {}):
+        del state['cursors'][tap_stream_id]
+        if not state['cursors']:
+            del state['cursors']
+
+    return state
+
+def get_recharge_parents(state: dict, tap_stream_id: str) -> list:
+    """
+    Retrieves the parents of a child stream synced at its bookmark from the
+    state dict.
+
+    :param state: The dict of the current state.
+    :param tap_stream_id: The child stream for which to get the parents.
+    :return: List of parent keys, empty when none are saved.
+    """
+    return state.get('parents', {}).get(tap_stream_id, [])
+
+def write_recharge_parents(
+        state: dict,
+        tap_stream_id: str,
+        value: list) -> dict:
+    """
+    Writes the keys of the parents whose children are synced and whose
+    replication value is the bookmark of the child stream:
+        { "parents": { "tap_stream_id": [parent_key, ...] } }
+    An empty value removes the parents of the stream.
+
+    :param state: The dict of the current state.
+    :param tap_stream_id: The child stream for which to write the parents.
+    :param value: The list of parent keys.
+    :return: New state dict.
+    """
+    if value:
+        state = bookmarks.ensure_bookmark_path(state, ['parents'])
+        state['parents'][tap_stream_id] = value
+    elif tap_stream_id in state.get('parents', {}):
+        del state['parents'][tap_stream_id]
+        if not state['parents']:
+            del state['parents']
+
+    return state
+
 class BaseStream:
     """
     A base class representing singer streams.
 
     :param client: The API client used to extract records from external source
+    :param writer: The writer used to emit Singer messages
     """
     tap_stream_id = None
     replication_method = None
@@ -60,12 +358,25 @@ class BaseStream:
     key_properties = []
     valid_replication_keys = []
     path = None
-    params = {}
+    params = MappingProxyType({})
     parent = None
     data_key = None
 
-    def __init__(self, client: RechargeClient):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # The params of the stream class are shared by its instances, so they
+        # are read-only; the query of a request is built by get_params
+        cls.params = MappingProxyType(dict(cls.params))
+
+    def __init__(self, client: RechargeClient, writer: MessageWriter = None):
         self.client = client
+        self.writer = writer or MessageWriter()
+        # The cursor of the page being synced, saved with the checkpoints
+        self.cursor = None
+
+    def get_params(self, **params) -> dict:
+        """Returns a new dict of the stream params, updated with the given params."""
+        return dict(self.params, **params)
 
     def get_records(
             self,
@@ -83,16 +394,20 @@ class BaseStream:
         raise NotImplementedError("Child classes of BaseStream require "
                                   "`get_records` implementation")
 
-    def get_parent_data(self, bookmark_datetime: datetime = None) -> list:
+    def get_parent_data(self, bookmark_datetime: datetime = None, config: dict = None) -> list:
         """
         Returns a list of records from the parent stream.
 
         :param bookmark_datetime: The datetime object representing the
             bookmark date
+        :param config: A dictionary containing tap config data, configures
+            the paging of the parent stream when given
         :return: A list of records
         """
         # pylint: disable=not-callable
-        parent = self.parent(self.client)
+        parent = self.parent(self.client, self.writer)
+        if config is not None and hasattr(parent, 'configure'):
+            parent.configure(config)
         return parent.get_records(bookmark_datetime, is_parent=True)
 
 
@@ -105,6 +420,10 @@ class IncrementalStream(BaseStream):
     :param client: The API client used extract records from the external source
     """
     replication_method = 'INCREMENTAL'
+    # The index of the written records, used to skip unchanged ones
+    change_index = None
+    # Whether the records are requested newest first, see CursorPagingStream.configure
+    sort_descending = False
 
     # pylint: disable=too-many-arguments
     def sync(
@@ -115,7 +434,11 @@ class IncrementalStream(BaseStream):
             config: dict,
             transformer: Transformer) -> dict:
         """
-        The sync logic for an incremental stream.
+        The sync logic for an incremental stream. Records are requested in
+        ascending replication key order, so the greatest value written so far
+        is a safe bookmark and is checkpointed periodically. Records requested
+        newest first are read until one is older than the bookmark, and the
+        bookmark is only written once they are all synced.
 
         :param state: A dictionary representing singer state
         :param stream_schema: A dictionary containing the stream schema
@@ -130,24 +453,33 @@ class IncrementalStream(BaseStream):
             config['start_date'])
         bookmark_datetime = utils.strptime_to_utc(start_date)
         max_datetime = bookmark_datetime
+        checkpoint = Checkpoint(config)
+        self.cursor = get_recharge_cursor(state, self.tap_stream_id)
 
         with metrics.record_counter(self.tap_stream_id) as counter:
             for record in self.get_records(bookmark_datetime):
-                transformed_record = transformer.transform(record, stream_schema, stream_metadata)
-                replication_value = transformed_record.get(self.replication_key)
-
-                # if replication value is not found then, write record
-                if replication_value:
-                    record_datetime = utils.strptime_to_utc(replication_value)
-
-                    # write record if we get record greater than the bookmark date or start date
-                    if record_datetime >= bookmark_datetime:
-                        singer.write_record(self.tap_stream_id, transformed_record)
-                        counter.increment()
-                        max_datetime = max(record_datetime, max_datetime)
-                else:
-                    singer.write_record(self.tap_stream_id, transformed_record)
-                    counter.increment()
+                if self.sort_descending:
+                    record_datetime = self.get_replication_datetime(record)
+                    if record_datetime and record_datetime < bookmark_datetime:
+                        break
+
+                record_datetime = self.write_record(
+                    record,
+                    bookmark_datetime,
+                    stream_schema,
+                    stream_metadata,
+                    transformer,
+                    counter)
+                if record_datetime:
+                    max_datetime = max(record_datetime, max_datetime)
+
+                if checkpoint.tick() and not self.sort_descending:
+                    state = write_recharge_bookmark(
+                        state,
+                        self.tap_stream_id,
+                        utils.strftime(max_datetime))
+                    state = write_recharge_cursor(state, self.tap_stream_id, self.cursor)
+                    self.writer.write_state(state)
 
             bookmark_date = utils.strftime(max_datetime)
 
@@ -155,11 +487,78 @@ class IncrementalStream(BaseStream):
             state,
             self.tap_stream_id,
             bookmark_date)
+        state = write_recharge_cursor(state, self.tap_stream_id, None)
 
-        singer.write_state(state)
+        self.writer.write_state(state)
 
         return state
 
+    def get_replication_datetime(self, record: dict) -> datetime:
+        """Returns the replication key value of a record as datetime, None when missing."""
+        replication_value = record.get(self.replication_key)
+        if not replication_value:
+            return None
+        return strptime_to_utc(replication_value)
+
+    # pylint: disable=too-many-arguments
+    def write_record(
+            self,
+            record: dict,
+            bookmark_datetime: datetime,
+            stream_schema: dict,
+            stream_metadata: dict,
+            transformer: Transformer,
+            counter: metrics.Counter) -> datetime:
+        """
+        Transforms and writes a record unless it is older than the bookmark,
+        or the change index holds it unchanged.
+
+        :param record: The record returned by the API
+        :param bookmark_datetime: The datetime object representing the
+            bookmark date
+        :param stream_schema: A dictionary containing the stream schema
+        :param stream_metadata: A dictionnary containing stream metadata
+        :param transformer: A singer Transformer object
+        :param counter: The record counter of the stream
+        :return: The replication key datetime of the record, None if the
+            record is older than the bookmark or has no replication value
+        """
+        record_datetime = self.get_replication_datetime(record)
+
+        # skip the records older than the bookmark date or start date before transforming them
+        if record_datetime and record_datetime < bookmark_datetime:
+            return None
+
+        if self.change_index and record_datetime:
+            key = json.dumps([record.get(key_property) for key_property in self.key_properties])
+            record_hash = get_record_hash(record, self.replication_key)
+            if self.change_index.is_unchanged(self.tap_stream_id, key, record_hash, utils.strftime(bookmark_datetime)):
+                return record_datetime
+
+        self.transform_and_write(record, stream_schema, stream_metadata, transformer, counter)
+
+        if self.change_index and record_datetime:
+            self.change_index.add(self.tap_stream_id, key, utils.strftime(record_datetime), record_hash)
+
+        return record_datetime
+
+    # pylint: disable=too-many-arguments
+    def transform_and_write(
+            self,
+            record: dict,
+            stream_schema: dict,
+            stream_metadata: dict,
+            transformer: Transformer,
+            counter: metrics.Counter):
+        """Transforms and writes a record, timing both phases."""
+        start = time.perf_counter()
+        transformed_record = transformer.transform(record, stream_schema, stream_metadata)
+        transformed = time.perf_counter()
+        self.writer.write_record(self.tap_stream_id, transformed_record)
+        self.client.profiler.add(self.tap_stream_id, 'transform', transformed - start)
+        self.client.profiler.add(self.tap_stream_id, 'write', time.perf_counter() - transformed)
+        counter.increment()
+
 
 class FullTableStream(BaseStream):
     """
@@ -190,49 +589,601 @@ class FullTableStream(BaseStream):
         """
         with metrics.record_counter(self.tap_stream_id) as counter:
             for record in self.get_records():
+                start = time.perf_counter()
                 transformed_record = transformer.transform(
                     record,
                     stream_schema,
                     stream_metadata)
-                singer.write_record(self.tap_stream_id, transformed_record)
+                transformed = time.perf_counter()
+                self.writer.write_record(self.tap_stream_id, transformed_record)
+                self.client.profiler.add(self.tap_stream_id, 'transform', transformed - start)
+                self.client.profiler.add(self.tap_stream_id, 'write', time.perf_counter() - transformed)
                 counter.increment()
 
-        singer.write_state(state)
+        self.writer.write_state(state)
 
         return state
 
 
-class CursorPagingStream(IncrementalStream):
+class CursorPaging(BaseStream):
     """
-    A generic cursor pagination implemantation for the Recharge API.
+    A generic cursor pagination implemantation for the Recharge API, mixed
+    into the streams paged by `next_cursor`: the adaptive page size, the
+    streaming parse, the prefetch and the projection of their pages.
 
     Docs: https://developer.rechargepayments.com/?python#cursor-pagination
     """
+    page_size = DEFAULT_PAGE_LIMIT
+
+    def __init__(self, client: RechargeClient, writer: MessageWriter = None):
+        super().__init__(client, writer)
+        self.page_limit = PageLimit(self.page_size)
+        # Parse the records of each page while it downloads
+        self.streaming_parse = False
+        # Pages fetched in the background while the current page is synced
+        self.prefetch_pages = 0
+        # Fields dropped from the records as the pages arrive, see set_projection
+        self.excluded_fields = frozenset()
+
+    def get_pages(self, params: dict, cursor: str = None) -> Iterator[tuple]:
+        """
+        Pages through the stream endpoint.
+
+        :param params: The query params of the first page
+        :param cursor: The cursor to start from instead of the first page
+        :return: Iterator over (cursor, records) tuples for each page, where
+            cursor is the one the page was requested with (None for the first page)
+            and records is a list, or an iterator when `streaming_parse` is set
+        """
+        while True:
+            if cursor:
+                page_params = {'cursor': cursor, 'limit': self.page_limit.limit}
+            else:
+                page_params = dict(params, limit=self.page_limit.limit)
+
+            request_kwargs = {}
+            if self.streaming_parse:
+                request_kwargs['stream_key'] = self.data_key
+            if self.page_limit.adaptive:
+                request_kwargs['on_retry'] = functools.partial(self.page_limit.shrink, page_params)
+
+            records = self.client.get(self.path, url=None, params=page_params, **request_kwargs)
+            self.page_limit.success()
+
+            if self.streaming_parse:
+                records = RetryingPage(
+                    functools.partial(self.client.get, self.path, url=None, params=page_params, **request_kwargs),
+                    records,
+                    self.data_key,
+                    self.key_properties,
+                    self.client.decode_retries,
+                    request_kwargs.get('on_retry'))
+
+            # A streamed page yields its records lazily, `next_cursor` is read once they are consumed
+            page = records.get(self.data_key)
+            if page and self.excluded_fields:
+                page = self.project(page)
+            yield cursor, page
+
+            # As per the documentation: https://developer.rechargepayments.com/2021-11/cursor_pagination,
+            # The next cursor is replicated in the API response, and we need to set the
+            # 'cursor' param with that value for getting the next page value
+            cursor = records.get('next_cursor')
+            if not cursor:
+                break
+
+    def configure_paging(self, config: dict):
+        """Sets the paging options of the stream from the config."""
+        self.page_limit = PageLimit.from_config(config, self.tap_stream_id, self.page_size)
+        self.streaming_parse = get_bool_config(config, 'streaming_parse')
+        prefetch_pages = config.get('prefetch_pages')
+        if prefetch_pages is None or str(prefetch_pages).strip() == '':
+            self.prefetch_pages = DEFAULT_PREFETCH_PAGES
+        else:
+            self.prefetch_pages = int(prefetch_pages)
+
+    def set_projection(self, *stream_metadatas: dict):
+        """
+        Sets the fields to drop from the records: the fields left out of the
+        selection of every given stream, as the Transformer would filter them.
+        The key properties and the replication key are always kept.
+
+        :param stream_metadatas: The metadata maps of the streams synced from the records
+        """
+        excluded_fields = frozenset.intersection(*map(get_excluded_fields, stream_metadatas))
+        self.excluded_fields = excluded_fields - set(self.key_properties) - {self.replication_key}
+
+    def project(self, records):
+        """
+        Drops the excluded fields from the records of a page, before they are
+        buffered, hashed and transformed.
+
+        :param records: The records of a page, a list or an iterator when
+            `streaming_parse` is set
+        :return: The projected records, of the same kind
+        """
+        excluded_fields = self.excluded_fields
+        records = (
+            {key: value for key, value in record.items() if key not in excluded_fields}
+            for record in records)
+        return records if self.streaming_parse else list(records)
+
+    def prefetch(self, pages: Iterator[tuple]) -> Iterator[tuple]:
+        """
+        Runs the pages iterator on a background thread, fetching up to
+        `prefetch_pages` pages (following their `next_cursor`) while the
+        current page is transformed and written.
+
+        :param pages: Iterator over the (cursor, records) pages
+        :return: Iterator over the same pages, in order
+        """
+        buffer = queue.Queue()
+        # One slot per page fetched ahead, freed when the page is synced
+        slots = threading.Semaphore(self.prefetch_pages)
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                while True:
+                    while not slots.acquire(timeout=0.1):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    page = next(pages, done)
+                    buffer.put(page)
+                    if page is done:
+                        return
+            except Exception as err: # pylint: disable=broad-except
+                buffer.put(err)
+
+        # A daemon thread, so a request in flight never holds up the exit of the tap
+        producer = threading.Thread(target=produce, name=f'{self.tap_stream_id}-prefetch', daemon=True)
+        producer.start()
+        try:
+            while True:
+                page = buffer.get()
+                if page is done:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                slots.release()
+                yield page
+        finally:
+            stop.set()
+
+
+
+class CursorPagingStream(CursorPaging, IncrementalStream):
+    """A cursor paged stream, filtered by `updated_at_min` and synced incrementally."""
     support_query_filter = True
+
+    def is_cursor_valid(self, saved_cursor: dict, query: dict) -> bool:
+        """
+        Checks a cursor saved by an interrupted sync can be resumed: it is
+        recent enough, belongs to the same query and does not start after
+        the current bookmark.
+
+        :param saved_cursor: The cursor dict from the state
+        :param query: The query of the current sync
+        :return: True if the sync can continue from the saved cursor
+        """
+        if not saved_cursor or not saved_cursor.get('cursor'):
+            return False
+
+        saved_query = dict(saved_cursor.get('query', {}))
+        saved_min = saved_query.pop('updated_at_min', None)
+        current_query = dict(query)
+        current_min = current_query.pop('updated_at_min', None)
+        if saved_query != current_query:
+            return False
+
+        if saved_min and current_min and \
+                utils.strptime_to_utc(saved_min) > utils.strptime_to_utc(current_min):
+            return False
+
+        created_at = utils.strptime_to_utc(saved_cursor['created_at'])
+        return self.client.now() - created_at <= MAX_CURSOR_AGE
+
+    def get_query(self, bookmark_datetime: datetime = None) -> tuple:
+        """
+        Returns the (params, query) of the first page: the query params, and
+        the query saved with the cursor, datetimes as bookmark strings.
+        """
+        params = self.get_params()
+
+        if self.support_query_filter:
+            params['updated_at_min'] = bookmark_datetime
+        if self.sort_descending:
+            params['sort_by'] = f'{self.replication_key}-desc'
+
+        query = {
+            key: utils.strftime(value) if isinstance(value, datetime.datetime) else value
+            for key, value in params.items()}
+        return params, query
+
+    def set_cursor(self, cursor: str, query: dict):
+        """Sets the cursor saved with the checkpoints to the cursor of the page being synced."""
+        if not cursor:
+            self.cursor = None
+        elif cursor != (self.cursor or {}).get('cursor'):
+            self.cursor = {'cursor': cursor, 'created_at': utils.strftime(self.client.now()), 'query': query}
+
     def get_records(
             self,
             bookmark_datetime: datetime = None,
             is_parent: bool = False) -> Iterator[list]:
-        self.params.update({'limit': MAX_PAGE_LIMIT})
-        paging = True
-        path = self.path
-        url = None
+        params, query = self.get_query(bookmark_datetime)
+
+        saved_cursor = self.cursor
+        self.cursor = None
+        pages = self.get_pages(params)
+
+        if self.is_cursor_valid(saved_cursor, query):
+            LOGGER.info('Resuming %s from the cursor saved at %s', self.tap_stream_id, saved_cursor['created_at'])
+            self.cursor = saved_cursor
+            pages = self.get_pages(params, saved_cursor['cursor'])
+            try:
+                first_page = next(pages)
+            except INVALID_CURSOR_ERRORS as err:
+                LOGGER.warning('The saved cursor of %s was rejected, resuming from the bookmark: %s', self.tap_stream_id, err)
+                self.cursor = None
+                pages = self.get_pages(params)
+            else:
+                pages = itertools.chain([first_page], pages)
+
+        # A streamed page is only read as it is synced, so it cannot be fetched ahead
+        if self.prefetch_pages and not self.streaming_parse:
+            pages = self.prefetch(pages)
+
+        for cursor, page in pages:
+            self.set_cursor(cursor, query)
+            yield from page
+
+    # pylint: disable=too-many-arguments
+    def sync(
+            self,
+            state: dict,
+            stream_schema: dict,
+            stream_metadata: dict,
+            config: dict,
+            transformer: Transformer) -> dict:
+        """
+        Runs a sharded backfill when one is planned or in progress, otherwise
+        the incremental sync.
+        """
+        self.configure(config)
+        self.set_projection(stream_metadata)
 
         if self.support_query_filter:
-            self.params.update({'updated_at_min': bookmark_datetime})
+            state = self.plan_backfill(state, config)
+
+        if state.get('backfill', {}).get(self.tap_stream_id):
+            return self.sync_backfill(state, stream_schema, stream_metadata, config, transformer)
+
+        try:
+            return super().sync(state, stream_schema, stream_metadata, config, transformer)
+        finally:
+            if self.change_index:
+                self.change_index.close()
+
+    def configure(self, config: dict):
+        """Sets the paging options and the change index of the stream from the config."""
+        self.configure_paging(config)
+        # A stream that cannot be filtered by updated_at_min reads its records
+        # newest first with the change index, stopping at the bookmark
+        if not self.support_query_filter:
+            self.change_index = ChangeIndex.from_config(config)
+            self.sort_descending = self.change_index is not None
+
+    def plan_backfill(self, state: dict, config: dict) -> dict:
+        """
+        Splits [bookmark, now) into `backfill_windows` windows and saves them
+        in the state as:
+            { "backfill": { "tap_stream_id": {
+                "bookmark": "value",
+                "windows": [{"updated_at_min": "value", "updated_at_max": "value"}, ...]
+            } } }
+        The last window is left open ended, and the cursor of an interrupted
+        incremental sync is dropped. Nothing is planned when a backfill is
+        already in progress or the range is too short to split.
+
+        :param state: The dict of the current state.
+        :param config: A dictionary containing tap config data
+        :return: New state dict.
+        """
+        if state.get('backfill', {}).get(self.tap_stream_id):
+            return state
+
+        backfill_windows = get_int_config(config, 'backfill_windows', 1)
+        bookmark = get_recharge_bookmark(state, self.tap_stream_id, config['start_date'])
+        start_datetime = utils.strptime_to_utc(bookmark)
+        span = self.client.now() - start_datetime
+        window_count = min(backfill_windows, int(span / MIN_BACKFILL_WINDOW))
+
+        if window_count < 2:
+            return state
+
+        step = span / window_count
+        windows = [
+            {
+                'updated_at_min': utils.strftime(start_datetime + step * index),
+                'updated_at_max': utils.strftime(start_datetime + step * (index + 1))
+            } for index in range(window_count)]
+        windows[-1]['updated_at_max'] = None
+
+        LOGGER.info('Planned backfill of %s in %s windows from %s', self.tap_stream_id, window_count, bookmark)
+        state = bookmarks.ensure_bookmark_path(state, ['backfill'])
+        state['backfill'][self.tap_stream_id] = {'bookmark': bookmark, 'windows': windows}
+        # The windows cover the range of a cursor saved by an interrupted
+        # incremental sync, which would page it again once they are done
+        state = write_recharge_cursor(state, self.tap_stream_id, None)
 
-        while paging:
-            records = self.client.get(path, url=url, params=self.params)
+        return state
 
-            # As per the documentation: https://developer.rechargepayments.com/2021-11/cursor_pagination,
-            # The next cursor is replicated in the API response, and we need to set the
-            # 'cursor' param with that value for getting the next page value
-            if records.get('next_cursor'):
-                self.params = {'cursor': records.get('next_cursor'), 'limit': MAX_PAGE_LIMIT}
-            else:
-                paging = False
+    def get_window_pages(self, windows: list) -> Iterator[tuple]:
+        """
+        Pages through every window at the same time, each on its own cursor.
+
+        :param windows: The windows to page through
+        :return: Iterator over (window, records) tuples in the order the pages
+            arrive, records is None once the window is exhausted
+        """
+        pages = queue.Queue(len(windows) * 2)
+        stop = threading.Event()
+
+        def produce(window):
+            params = self.get_params(updated_at_min=utils.strptime_to_utc(window['updated_at_min']))
+            if window['updated_at_max']:
+                params['updated_at_max'] = utils.strptime_to_utc(window['updated_at_max'])
+            try:
+                for _, page in self.get_pages(params):
+                    if stop.is_set():
+                        return
+                    pages.put((window, list(page)))
+                pages.put((window, None))
+            except Exception as err: # pylint: disable=broad-except
+                pages.put((window, err))
+
+        with ThreadPoolExecutor(max_workers=len(windows), thread_name_prefix=self.tap_stream_id) as executor:
+            futures = [executor.submit(produce, window) for window in windows]
+            remaining = len(futures)
+            try:
+                while remaining:
+                    window, page = pages.get()
+                    if isinstance(page, Exception):
+                        raise page
+                    if page is None:
+                        remaining -= 1
+                    yield window, page
+            finally:
+                stop.set()
+                # Unblock the producers still waiting on a full queue
+                while not all(future.done() for future in futures):
+                    try:
+                        pages.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+    # pylint: disable=too-many-arguments
+    def sync_backfill(
+            self,
+            state: dict,
+            stream_schema: dict,
+            stream_metadata: dict,
+            config: dict,
+            transformer: Transformer) -> dict:
+        """
+        Syncs the unfinished windows of the backfill concurrently. Each window
+        keeps its own progress, finished windows are dropped from the state
+        so an interrupted backfill resumes only the remaining ones.
+
+        :param state: A dictionary representing singer state
+        :param stream_schema: A dictionary containing the stream schema
+        :param stream_metadata: A dictionnary containing stream metadata
+        :param config: A dictionary containing tap config data
+        :param transformer: A singer Transformer object
+        :return: State data in the form of a dictionary
+        """
+        backfill = state['backfill'][self.tap_stream_id]
+        windows = backfill['windows']
+        checkpoint = Checkpoint(config)
+
+        LOGGER.info('Backfilling %s over %s windows', self.tap_stream_id, len(windows))
 
-            yield from records.get(self.data_key)
+        with metrics.record_counter(self.tap_stream_id) as counter:
+            for window, page in self.get_window_pages(list(windows)):
+                if page is None:
+                    windows.remove(window)
+                    self.writer.write_state(state)
+                    continue
+
+                self.write_window_page(backfill, window, page, stream_schema, stream_metadata, transformer, counter)
+
+                # Window progress is only updated per page, so checkpoint on page boundaries
+                if checkpoint.tick(len(page)):
+                    self.writer.write_state(state)
+
+        return self.finish_backfill(state)
+
+    # pylint: disable=too-many-arguments
+    def write_window_page(
+            self,
+            backfill: dict,
+            window: dict,
+            page: list,
+            stream_schema: dict,
+            stream_metadata: dict,
+            transformer: Transformer,
+            counter: metrics.Counter):
+        """
+        Writes the records of a page of a backfill window and moves the
+        window start and the backfill bookmark past them.
+
+        :param backfill: The backfill of the stream in the state
+        :param window: The window the page belongs to
+        :param page: The records of the page
+        :param stream_schema: A dictionary containing the stream schema
+        :param stream_metadata: A dictionnary containing stream metadata
+        :param transformer: A singer Transformer object
+        :param counter: The record counter of the stream
+        """
+        window_datetime = utils.strptime_to_utc(window['updated_at_min'])
+        window_max_datetime = window_datetime
+        for record in page:
+            record_datetime = self.write_record(
+                record,
+                window_datetime,
+                stream_schema,
+                stream_metadata,
+                transformer,
+                counter)
+            if record_datetime:
+                window_max_datetime = max(record_datetime, window_max_datetime)
+
+        window['updated_at_min'] = utils.strftime(window_max_datetime)
+        max_datetime = max(window_max_datetime, utils.strptime_to_utc(backfill['bookmark']))
+        backfill['bookmark'] = utils.strftime(max_datetime)
+
+    def finish_backfill(self, state: dict) -> dict:
+        """Drops the finished backfill and any saved cursor from the state and writes its bookmark."""
+        backfill = state['backfill'].pop(self.tap_stream_id)
+        if not state['backfill']:
+            del state['backfill']
+
+        state = write_recharge_cursor(state, self.tap_stream_id, None)
+        state = write_recharge_bookmark(
+            state,
+            self.tap_stream_id,
+            backfill['bookmark'])
+
+        self.writer.write_state(state)
+
+        return state
+
+
+# pylint: disable=abstract-method
+class ChildStream(IncrementalStream):
+    """
+    A stream read with one request per record of its `parent` stream, e.g.
+    `customers/{parent_id}/payment_methods`. The parents updated since the
+    bookmark are paged in ascending order, and their keys, deduplicated,
+    fan out to `child_workers` threads sharing the client and its rate
+    limit. The children of each parent are written in the parent order, so
+    the bookmark is the replication value of the last parent whose children
+    are synced; the parents synced at that value are saved with it, so an
+    interrupted sync resumes without requesting them again.
+
+    Every child of a parent updated since the bookmark is written. `parent`
+    must be a CursorPagingStream filtered by `updated_at_min` and `path`
+    holds a `{parent_id}` field.
+    """
+    parent = None
+    # The field of the parent records identifying the children
+    parent_key = 'id'
+    page_size = DEFAULT_PAGE_LIMIT
+
+    def get_child_records(self, parent_id) -> list:
+        """
+        Pages through the children of a parent. A parent deleted since it was
+        listed (404) is skipped with the children read so far.
+
+        :param parent_id: The key of the parent record
+        :return: The list of child records
+        """
+        path = self.path.format(parent_id=parent_id)
+        params = self.get_params(limit=self.page_size)
+        records = []
+        while True:
+            try:
+                page = self.client.get(path, url=None, params=params)
+            except RechargeNotFoundError as err:
+                LOGGER.warning('Skipping the %s of %s %s, not found: %s', self.tap_stream_id, self.parent.tap_stream_id, parent_id, err)
+                return records
+            records.extend(page.get(self.data_key) or [])
+            cursor = page.get('next_cursor')
+            if not cursor:
+                return records
+            params = {'cursor': cursor, 'limit': self.page_size}
+
+    def get_parent_datetime(self, record: dict) -> datetime:
+        replication_value = record.get(self.parent.replication_key)
+        return strptime_to_utc(replication_value) if replication_value else None
+
+    # pylint: disable=too-many-arguments,too-many-locals
+    def sync(
+            self,
+            state: dict,
+            stream_schema: dict,
+            stream_metadata: dict,
+            config: dict,
+            transformer: Transformer) -> dict:
+        """
+        Requests the children of the parents updated since the bookmark,
+        `child_workers` parents at a time, and writes them in the parent order.
+
+        :param state: A dictionary representing singer state
+        :param stream_schema: A dictionary containing the stream schema
+        :param stream_metadata: A dictionnary containing stream metadata
+        :param config: A dictionary containing tap config data
+        :param transformer: A singer Transformer object
+        :return: State data in the form of a dictionary
+        """
+        start_date = get_recharge_bookmark(state, self.tap_stream_id, config['start_date'])
+        bookmark_datetime = utils.strptime_to_utc(start_date)
+        max_datetime = bookmark_datetime
+        # The parents synced at the bookmark, the children of later parents
+        # are requested again when the sync is interrupted
+        bookmark_parents = get_recharge_parents(state, self.tap_stream_id)
+        seen = set(bookmark_parents)
+        checkpoint = Checkpoint(config)
+        workers = get_int_config(config, 'child_workers', DEFAULT_CHILD_WORKERS)
+        # The parents requested and not written yet, in the parent order
+        pending = collections.deque()
+
+        def write_next():
+            nonlocal max_datetime, bookmark_parents, state
+            parent_id, parent_datetime, future = pending.popleft()
+            for record in future.result():
+                self.transform_and_write(record, stream_schema, stream_metadata, transformer, counter)
+
+            if parent_datetime and parent_datetime > max_datetime:
+                max_datetime = parent_datetime
+                bookmark_parents = []
+            if parent_datetime == max_datetime:
+                bookmark_parents.append(parent_id)
+
+            if checkpoint.tick():
+                state = write_recharge_bookmark(state, self.tap_stream_id, utils.strftime(max_datetime))
+                state = write_recharge_parents(state, self.tap_stream_id, bookmark_parents)
+                self.writer.write_state(state)
+
+        with metrics.record_counter(self.tap_stream_id) as counter, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix=self.tap_stream_id) as executor:
+            try:
+                for parent in self.get_parent_data(bookmark_datetime, config):
+                    parent_id = parent.get(self.parent_key)
+                    if parent_id is None or parent_id in seen:
+                        continue
+                    seen.add(parent_id)
+
+                    pending.append((parent_id, self.get_parent_datetime(parent), executor.submit(self.get_child_records, parent_id)))
+                    # Bounds the children held in memory
+                    if len(pending) >= workers * 2:
+                        write_next()
+
+                while pending:
+                    write_next()
+            finally:
+                for _, _, future in pending:
+                    future.cancel()
+
+        state = write_recharge_bookmark(state, self.tap_stream_id, utils.strftime(max_datetime))
+        state = write_recharge_parents(state, self.tap_stream_id, None)
+        self.writer.write_state(state)
+
+        return state
 
 
 class Addresses(CursorPagingStream):
@@ -367,6 +1318,143 @@ class MetafieldsSubscription(CursorPagingStream):
     data_key = 'metafields'
 
 
+class MetafieldsExtractor(CursorPagingStream):
+    """
+    Pages through the metafields endpoint once, without `owner_resource`, for
+    all the selected metafields streams and dispatches each record to the
+    stream of its owner resource. Each stream keeps its own bookmark, the
+    records older than it are filtered locally. Only used with the
+    `metafields_single_pass` config, as the API reference lists
+    `owner_resource` as a required filter of the endpoint.
+
+    Docs: https://developer.rechargepayments.com/#list-metafields
+
+    :param client: The API client used to extract records from external source
+    :param streams: The metafields streams to sync
+    :param writer: The writer used to emit Singer messages
+    """
+    tap_stream_id = 'metafields'
+    key_properties = ['id']
+    path = 'metafields'
+    replication_key = 'updated_at'
+    valid_replication_keys = ['updated_at']
+    support_query_filter = False
+    params = {
+        'sort_by': f'{replication_key}-asc'
+        }
+    data_key = 'metafields'
+
+    def __init__(self, client: RechargeClient, streams: list, writer: MessageWriter = None):
+        super().__init__(client, writer)
+        self.streams = {stream.params['owner_resource']: stream for stream in streams}
+
+    # pylint: disable=too-many-arguments,too-many-locals
+    def sync_streams(
+            self,
+            state: dict,
+            stream_schemas: dict,
+            stream_metadatas: dict,
+            config: dict,
+            transformer: Transformer) -> dict:
+        """
+        The sync logic of the metafields streams, in a single pass. Each
+        stream is synced on its own when the API requires `owner_resource`.
+
+        :param state: A dictionary representing singer state
+        :param stream_schemas: The stream schemas by tap_stream_id
+        :param stream_metadatas: The stream metadata by tap_stream_id
+        :param config: A dictionary containing tap config data
+        :param transformer: A singer Transformer object
+        :return: State data in the form of a dictionary
+        """
+        self.configure(config)
+        self.set_projection(*stream_metadatas.values())
+        # The records are dispatched by their owner resource
+        self.excluded_fields -= {'owner_resource'}
+        try:
+            return self.sync_pass(state, stream_schemas, stream_metadatas, config, transformer)
+        finally:
+            if self.change_index:
+                self.change_index.close()
+
+    # pylint: disable=too-many-arguments,too-many-locals
+    def sync_pass(
+            self,
+            state: dict,
+            stream_schemas: dict,
+            stream_metadatas: dict,
+            config: dict,
+            transformer: Transformer) -> dict:
+        """Pages through the metafields endpoint and writes the records of every stream."""
+        streams = list(self.streams.values())
+        for stream in streams:
+            stream.change_index = self.change_index
+        bookmark_datetimes = {
+            stream.tap_stream_id: utils.strptime_to_utc(
+                get_recharge_bookmark(state, stream.tap_stream_id, config['start_date']))
+            for stream in streams}
+        max_datetimes = dict(bookmark_datetimes)
+        min_bookmark_datetime = min(bookmark_datetimes.values())
+        checkpoint = Checkpoint(config)
+
+        records = self.get_records()
+        try:
+            records = itertools.chain([next(records)], records)
+        except StopIteration:
+            records = iter([])
+        except (RechargeBadRequestError, RechargeUnprocessableEntityError) as err:
+            LOGGER.warning('Listing every metafield was rejected, syncing the metafields streams one at a time: %s', err)
+            for stream in streams:
+                state = stream.sync(
+                    state,
+                    stream_schemas[stream.tap_stream_id],
+                    stream_metadatas[stream.tap_stream_id],
+                    config,
+                    transformer)
+            return state
+
+        with contextlib.ExitStack() as stack:
+            counters = {
+                stream.tap_stream_id: stack.enter_context(metrics.record_counter(stream.tap_stream_id))
+                for stream in streams}
+
+            for record in records:
+                if self.sort_descending:
+                    record_datetime = self.get_replication_datetime(record)
+                    if record_datetime and record_datetime < min_bookmark_datetime:
+                        break
+
+                stream = self.streams.get(record.get('owner_resource'))
+                # A metafield of a resource whose stream is not selected
+                if not stream:
+                    continue
+
+                tap_stream_id = stream.tap_stream_id
+                record_datetime = stream.write_record(
+                    record,
+                    bookmark_datetimes[tap_stream_id],
+                    stream_schemas[tap_stream_id],
+                    stream_metadatas[tap_stream_id],
+                    transformer,
+                    counters[tap_stream_id])
+                if record_datetime:
+                    max_datetimes[tap_stream_id] = max(record_datetime, max_datetimes[tap_stream_id])
+
+                if checkpoint.tick() and not self.sort_descending:
+                    for tap_stream_id, max_datetime in max_datetimes.items():
+                        state = write_recharge_bookmark(state, tap_stream_id, utils.strftime(max_datetime))
+                    self.writer.write_state(state)
+
+        for tap_stream_id, max_datetime in max_datetimes.items():
+            state = write_recharge_bookmark(state, tap_stream_id, utils.strftime(max_datetime))
+            # The single pass does not resume the cursors of the streams
+            state = write_recharge_cursor(state, tap_stream_id, None)
+
+        self.writer.write_state(state)
+
+        return state
+
+
 class Onetimes(CursorPagingStream):
     """
     Retrieves non-recurring line items on queued orders from the Recharge API.
@@ -411,6 +1499,44 @@ class Plans(CursorPagingStream):
     params = {'sort_by': f'{replication_key}-asc'}
     data_key = 'plans'
 
+class Products(CursorPaging, FullTableStream):
+    """
+    Retrieves products from the Recharge API, in the shape of the 2021-11
+    product resource the client requests with the `X-Recharge-Version`
+    header. The endpoint is paged by cursor but not filtered by
+    `updated_at_min`, so every sync reads the whole catalog.
+
+    Docs: https://developer.rechargepayments.com/2021-11/products/products_list
+    """
+    tap_stream_id = 'products'
+    key_properties = ['external_product_id']
+    path = 'products'
+    data_key = 'products'
+
+    def get_records(
+            self,
+            bookmark_datetime: datetime = None,
+            is_parent: bool = False) -> Iterator[list]:
+        pages = self.get_pages(self.get_params())
+        # A streamed page is only read as it is synced, so it cannot be fetched ahead
+        if self.prefetch_pages and not self.streaming_parse:
+            pages = self.prefetch(pages)
+
+        for _, page in pages:
+            yield from page
+
+    # pylint: disable=too-many-arguments
+    def sync(
+            self,
+            state: dict,
+            stream_schema: dict,
+            stream_metadata: dict,
+            config: dict,
+            transformer: Transformer) -> dict:
+        self.configure_paging(config)
+        self.set_projection(stream_metadata)
+        return super().sync(state, stream_schema, stream_metadata, config, transformer)
+
 class Store(FullTableStream):
     """
     Retrieves basic info about your store setup from the Recharge API.
@@ -446,6 +1572,14 @@ class Subscriptions(CursorPagingStream):
     data_key = 'subscriptions'
 
 
+# The streams of the metafields endpoint, synced in a single pass when
+# more than one is selected
+METAFIELDS_STREAMS = [
+    'metafields_store',
+    'metafields_customer',
+    'metafields_subscription'
+]
+
 STREAMS = {
     'addresses': Addresses,
     'charges': Charges,
@@ -458,6 +1592,7 @@ STREAMS = {
     'onetimes': Onetimes,
     'orders': Orders,
     'plans': Plans,
+    'products': Products,
     'store': Store,
     'subscriptions': Subscriptions
 }
@@ -1,11 +1,281 @@
+import asyncio
+import copy
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
 import singer
 from singer import Transformer, Catalog, metadata
 
+from tap_recharge.async_client import AsyncRechargeClient
+from tap_recharge.async_streams import AsyncCursorPagingStream
 from tap_recharge.client import RechargeClient
-from tap_recharge.streams import STREAMS
+from tap_recharge.connection import DEFAULT_POOL_MAXSIZE
+from tap_recharge.transform import CompiledTransformer
+from tap_recharge.streams import (
+    DEFAULT_PREFETCH_PAGES,
+    METAFIELDS_STREAMS,
+    STREAMS,
+    CursorPagingStream,
+    MetafieldsExtractor,
+    get_bool_config,
+    get_int_config)
+from tap_recharge.writer import MessageWriter, ThreadedMessageWriter
 
 LOGGER = singer.get_logger()
 
+DEFAULT_MAX_WORKERS = 1
+
+
+def get_max_workers(config: dict) -> int:
+    """
+    Returns the number of streams to sync concurrently, 1 (sequential sync)
+    unless `max_workers` is set in the config.
+    """
+    return get_int_config(config, 'max_workers', DEFAULT_MAX_WORKERS)
+
+
+def get_pool_maxsize(config: dict) -> int:
+    """
+    Returns the number of connections the client keeps open, `pool_maxsize`
+    when set, otherwise enough for the requests the sync sends at once: a
+    page and its prefetched pages per backfill window of each worker.
+    """
+    prefetch_pages = config.get('prefetch_pages')
+    if prefetch_pages is None or str(prefetch_pages).strip() == '':
+        prefetch_pages = DEFAULT_PREFETCH_PAGES
+    concurrency = get_max_workers(config) * get_int_config(config, 'backfill_windows', 1) * (int(prefetch_pages) + 1)
+    return get_int_config(config, 'pool_maxsize', max(DEFAULT_POOL_MAXSIZE, concurrency))
+
+# pylint: disable=too-many-arguments
+def sync_stream(
+        client: RechargeClient,
+        config: dict,
+        state: dict,
+        stream,
+        transformer: Transformer,
+        writer: MessageWriter) -> dict:
+    """Sync a single selected stream and return the updated state"""
+
+    tap_stream_id = stream.tap_stream_id
+    stream_obj = STREAMS[tap_stream_id](client, writer)
+    stream_schema = stream.schema.to_dict()
+    stream_metadata = metadata.to_map(stream.metadata)
+
+    LOGGER.info('Starting sync for stream: %s', tap_stream_id)
+
+    writer.write_schema(
+        tap_stream_id,
+        stream_schema,
+        stream_obj.key_properties,
+        stream.replication_key
+    )
+
+    state = stream_obj.sync(
+        state,
+        stream_schema,
+        stream_metadata,
+        config,
+        transformer)
+    writer.write_state(state)
+
+    return state
+
+
+# pylint: disable=too-many-arguments
+def sync_metafields(
+        client: RechargeClient,
+        config: dict,
+        state: dict,
+        streams: list,
+        transformer: Transformer,
+        writer: MessageWriter) -> dict:
+    """Sync the selected metafields streams in a single pass and return the updated state"""
+
+    stream_objs = [STREAMS[stream.tap_stream_id](client, writer) for stream in streams]
+    stream_schemas = {stream.tap_stream_id: stream.schema.to_dict() for stream in streams}
+    stream_metadatas = {stream.tap_stream_id: metadata.to_map(stream.metadata) for stream in streams}
+
+    LOGGER.info('Starting sync for streams: %s', ', '.join(stream_schemas))
+
+    for stream, stream_obj in zip(streams, stream_objs):
+        writer.write_schema(
+            stream.tap_stream_id,
+            stream_schemas[stream.tap_stream_id],
+            stream_obj.key_properties,
+            stream.replication_key
+        )
+
+    state = MetafieldsExtractor(client, stream_objs, writer).sync_streams(
+        state,
+        stream_schemas,
+        stream_metadatas,
+        config,
+        transformer)
+    writer.write_state(state)
+
+    return state
+
+
+def get_sync_groups(streams: list, config: dict = None) -> list:
+    """
+    Groups the selected streams synced together: with `metafields_single_pass`,
+    the metafields streams share a single pass of the metafields endpoint
+    when more than one of them is selected, every other stream is synced on
+    its own.
+    """
+    single_pass = get_bool_config(config or {}, 'metafields_single_pass')
+    metafields_streams = [stream for stream in streams if stream.tap_stream_id in METAFIELDS_STREAMS]
+    groups = []
+    for stream in streams:
+        if single_pass and len(metafields_streams) > 1 and stream.tap_stream_id in METAFIELDS_STREAMS:
+            if stream is metafields_streams[0]:
+                groups.append(metafields_streams)
+        else:
+            groups.append([stream])
+    return groups
+
+
+# pylint: disable=too-many-arguments
+def sync_group(
+        client: RechargeClient,
+        config: dict,
+        state: dict,
+        streams: list,
+        transformer: Transformer,
+        writer: MessageWriter) -> dict:
+    """Sync a group of streams from get_sync_groups and return the updated state"""
+
+    if len(streams) > 1:
+        return sync_metafields(client, config, state, streams, transformer, writer)
+    return sync_stream(client, config, state, streams[0], transformer, writer)
+
+
+def sync_concurrently(
+        client: RechargeClient,
+        config: dict,
+        state: dict,
+        catalog: Catalog,
+        max_workers: int) -> dict:
+    """
+    Sync the selected streams on a thread pool. Each stream works on its own
+    copy of the state and Transformer, the client (and so its rate limit) is
+    shared, and a single writer thread emits the messages.
+    """
+    state = singer.set_currently_syncing(state, None)
+
+    def run(streams, writer):
+        stream_state = copy.deepcopy(state)
+        with Transformer() as transformer, client.profiler.profile():
+            return sync_group(client, config, stream_state, streams, CompiledTransformer(transformer), writer)
+
+    # The profile of the main thread sees the workers from Python 3.12, see Profiler.profile
+    with ThreadedMessageWriter(state, MessageWriter.from_config(config, client.json_backend)) as threaded_writer, \
+            client.profiler.profile():
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stream') as executor:
+            futures = [
+                executor.submit(run, streams, threaded_writer.for_stream(*[stream.tap_stream_id for stream in streams]))
+                for streams in get_sync_groups(list(catalog.get_selected_streams(state)), config)]
+
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+            for future in done:
+                # Re-raise the first stream error, if any
+                future.result()
+
+    return threaded_writer.state
+
+
+# pylint: disable=too-many-arguments
+async def sync_stream_async(
+        async_client: AsyncRechargeClient,
+        config: dict,
+        state: dict,
+        stream,
+        writer: MessageWriter) -> dict:
+    """
+    Sync a single selected cursor paging stream on the async engine and
+    return the updated state. The stream has its own Transformer, as its
+    pages are transformed on the threads of the event loop executor.
+    """
+
+    tap_stream_id = stream.tap_stream_id
+    stream_obj = STREAMS[tap_stream_id](async_client, writer)
+    async_stream = AsyncCursorPagingStream(stream_obj, async_client)
+
+    LOGGER.info('Starting sync for stream: %s', tap_stream_id)
+
+    await async_stream.run_blocking(
+        writer.write_schema,
+        tap_stream_id,
+        stream.schema.to_dict(),
+        stream_obj.key_properties,
+        stream.replication_key
+    )
+
+    with Transformer() as transformer:
+        state = await async_stream.sync(
+            state,
+            stream.schema.to_dict(),
+            metadata.to_map(stream.metadata),
+            config,
+            CompiledTransformer(transformer))
+    await async_stream.run_blocking(writer.write_state, state)
+
+    return state
+
+
+async def sync_async(
+        client: RechargeClient,
+        config: dict,
+        state: dict,
+        catalog: Catalog) -> dict:
+    """
+    Sync the selected streams concurrently on an event loop. The cursor
+    paging streams page through the AsyncRechargeClient, which shares the
+    rate limit of the client; the full table streams and the metafields single
+    pass run on threads with the client. As in sync_concurrently, each
+    stream works on its own copy of the state and a single writer thread
+    emits the messages.
+    """
+    state = singer.set_currently_syncing(state, None)
+    async_client = AsyncRechargeClient.from_config(
+        config,
+        base_url=client.base_url,
+        rate_limiter=client.rate_limiter,
+        profiler=client.profiler,
+        response_cache=client.response_cache,
+        transfer_stats=client.transfer_stats)
+
+    def run(streams, writer):
+        stream_state = copy.deepcopy(state)
+        with Transformer() as transformer:
+            return sync_group(client, config, stream_state, streams, CompiledTransformer(transformer), writer)
+
+    with ThreadedMessageWriter(state, MessageWriter.from_config(config, client.json_backend)) as threaded_writer:
+        loop = asyncio.get_running_loop()
+        async with async_client:
+            with ThreadPoolExecutor(thread_name_prefix='stream') as executor:
+                tasks = []
+                for streams in get_sync_groups(list(catalog.get_selected_streams(state)), config):
+                    writer = threaded_writer.for_stream(*[stream.tap_stream_id for stream in streams])
+                    if len(streams) == 1 and issubclass(STREAMS[streams[0].tap_stream_id], CursorPagingStream):
+                        tasks.append(asyncio.ensure_future(sync_stream_async(
+                            async_client, config, copy.deepcopy(state), streams[0], writer)))
+                    else:
+                        tasks.append(loop.run_in_executor(executor, run, streams, writer))
+
+                done, not_done = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in not_done:
+                    task.cancel()
+                if not_done:
+                    await asyncio.wait(not_done)
+                for task in done:
+                    # Re-raise the first stream error, if any
+                    task.result()
+
+    return threaded_writer.state
+
+
 def sync(
         client: RechargeClient,
         config: dict,
@@ -13,33 +283,39 @@ def sync(
         catalog: Catalog) -> dict:
     """Sync data from tap source"""
 
-    with Transformer() as transformer:
-        for stream in catalog.get_selected_streams(state):
-            tap_stream_id = stream.tap_stream_id
-            stream_obj = STREAMS[tap_stream_id](client)
-            stream_schema = stream.schema.to_dict()
-            stream_metadata = metadata.to_map(stream.metadata)
-
-            LOGGER.info('Starting sync for stream: %s', tap_stream_id)
-
-            state = singer.set_currently_syncing(state, tap_stream_id)
-            singer.write_state(state)
-
-            singer.write_schema(
-                tap_stream_id,
-                stream_schema,
-                stream_obj.key_properties,
-                stream.replication_key
-            )
-
-            state = stream_obj.sync(
-                state,
-                stream_schema,
-                stream_metadata,
-                config,
-                transformer)
-            singer.write_state(state)
+    writer = MessageWriter.from_config(config, client.json_backend)
+    max_workers = get_max_workers(config)
+    client.profiler.profile_path = config.get('profile_path') or None
+
+    if get_bool_config(config, 'async_engine'):
+        LOGGER.info('Syncing streams concurrently on the async engine')
+        with client.profiler.profile():
+            state = asyncio.run(sync_async(client, config, state, catalog))
+    elif max_workers > 1:
+        LOGGER.info('Syncing streams concurrently with %s workers', max_workers)
+        state = sync_concurrently(client, config, state, catalog, max_workers)
+    else:
+        with Transformer() as singer_transformer, client.profiler.profile():
+            transformer = CompiledTransformer(singer_transformer)
+            try:
+                for streams in get_sync_groups(list(catalog.get_selected_streams(state)), config):
+                    state = singer.set_currently_syncing(state, streams[0].tap_stream_id)
+                    writer.write_state(state)
+
+                    state = sync_group(client, config, state, streams, transformer, writer)
+            finally:
+                # The records buffered when a stream fails are still written
+                writer.flush()
 
     state = singer.set_currently_syncing(state, None)
-    singer.write_state(state)
+    writer.write_state(state)
 
+    client.rate_limiter.log_metrics()
+    client.http_adapter.log_metrics()
+    client.transfer_stats.log_metrics()
+    client.transfer_stats.log_summary()
+    if client.response_cache is not None:
+        client.response_cache.log_metrics()
+    client.profiler.log_metrics()
+    client.profiler.log_summary()
+    client.profiler.dump_profile()
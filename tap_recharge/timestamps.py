@@ -0,0 +1,67 @@
+"""
+This module parses the ISO-8601 timestamps returned by the Recharge API
+without going through the generic dateutil parser for every record.
+"""
+
+import datetime
+import functools
+import re
+
+import pytz
+from singer import utils
+
+
+# The formats returned by the API, e.g. 2021-11-18T16:05:22, 2021-11-18T16:05:22+00:00
+# or 2021-11-18T16:05:22.000000Z as written in the bookmarks
+_ISO_8601 = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})'
+    r'(?:\.(\d{1,6})\d*)?'
+    r'(?:(Z)|([+-])(\d{2}):?(\d{2}))?')
+
+# Number of parsed timestamps kept, the bookmark and the values shared by
+# the records of a batch are parsed once
+CACHE_SIZE = 4096
+
+
+def _parse(value: str) -> datetime.datetime:
+    match = _ISO_8601.fullmatch(value)
+    if not match:
+        return None
+
+    year, month, day, hour, minute, second, fraction, utc, sign, offset_hours, offset_minutes = match.groups()
+    try:
+        dtime = datetime.datetime(
+            int(year), int(month), int(day), int(hour), int(minute), int(second),
+            # dateutil truncates the fraction to microseconds
+            int(fraction.ljust(6, '0')) if fraction else 0)
+    except ValueError:
+        return None
+
+    if utc or not sign:
+        # A timestamp without offset is taken as UTC, like singer.utils.strptime_to_utc does
+        return dtime.replace(tzinfo=pytz.UTC)
+
+    offset = datetime.timedelta(hours=int(offset_hours), minutes=int(offset_minutes))
+    if offset >= datetime.timedelta(hours=24):
+        return None
+    tzinfo = datetime.timezone(-offset if sign == '-' else offset)
+    return dtime.replace(tzinfo=tzinfo).astimezone(pytz.UTC)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _cached_strptime_to_utc(value: str) -> datetime.datetime:
+    return _parse(value) or utils.strptime_to_utc(value)
+
+
+def strptime_to_utc(value) -> datetime.datetime:
+    """
+    Same as singer.utils.strptime_to_utc, with a fast path for the ISO-8601
+    formats of the API and a cache of the parsed values. Any other format
+    goes through the generic parser.
+
+    :param value: The timestamp string
+    :return: The timezone aware datetime, in UTC
+    """
+    if isinstance(value, str):
+        return _cached_strptime_to_utc(value)
+    return utils.strptime_to_utc(value)
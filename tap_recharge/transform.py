@@ -0,0 +1,324 @@
+"""
+This module compiles the stream schemas into record transform functions,
+producing the same records as the singer Transformer without walking the
+schema and the metadata for every record.
+"""
+
+import decimal
+import re
+
+from singer import Transformer, utils
+from singer.transform import LOGGER, NO_INTEGER_DATETIME_PARSING, breadcrumb_path
+
+from tap_recharge.timestamps import strptime_to_utc
+
+
+# Returned by a compiled transform when the value does not match the schema
+_FAIL = object()
+
+
+def _transform_null(data, path):
+    if data is None or data == '':
+        return None
+    return _FAIL
+
+
+def _transform_datetime(data, path):
+    if data is None or data == '':
+        return _FAIL
+    # singer.transform.string_to_datetime, with the fast timestamp parser
+    try:
+        return utils.strftime(strptime_to_utc(data))
+    except Exception as ex: # pylint: disable=broad-except
+        LOGGER.warning("%s, (%s)", ex, data)
+        return _FAIL
+
+
+def _transform_decimal(data, path): # pylint: disable=too-many-return-statements
+    if data is None:
+        return _FAIL
+    if isinstance(data, (str, float, int)):
+        try:
+            return str(decimal.Decimal(str(data)))
+        except Exception: # pylint: disable=broad-except
+            return _FAIL
+    if isinstance(data, decimal.Decimal):
+        try:
+            if data.is_snan():
+                return 'NaN'
+            return str(data)
+        except Exception: # pylint: disable=broad-except
+            return _FAIL
+    return _FAIL
+
+
+def _transform_string(data, path):
+    if data is None:
+        return _FAIL
+    if type(data) is str: # pylint: disable=unidiomatic-typecheck
+        return data
+    try:
+        return str(data)
+    except Exception: # pylint: disable=broad-except
+        return _FAIL
+
+
+def _transform_integer(data, path):
+    if type(data) is int: # pylint: disable=unidiomatic-typecheck
+        return data
+    if isinstance(data, str):
+        data = data.replace(',', '')
+    try:
+        return int(data)
+    except Exception: # pylint: disable=broad-except
+        return _FAIL
+
+
+def _transform_number(data, path):
+    if type(data) is float: # pylint: disable=unidiomatic-typecheck
+        return data
+    if isinstance(data, str):
+        data = data.replace(',', '')
+    try:
+        return float(data)
+    except Exception: # pylint: disable=broad-except
+        return _FAIL
+
+
+def _transform_boolean(data, path):
+    if isinstance(data, str) and data.lower() == 'false':
+        return False
+    try:
+        return bool(data)
+    except Exception: # pylint: disable=broad-except
+        return _FAIL
+
+
+def _transform_unknown(data, path):
+    return _FAIL
+
+
+def _transform_any(data, path):
+    return data
+
+
+def get_excluded_fields(metadata: dict) -> frozenset:
+    """
+    Returns the top-level fields left out of the selection, the ones the
+    Transformer filters: not selected or unsupported, unless automatic.
+    """
+    excluded = set()
+    for breadcrumb, entry in (metadata or {}).items():
+        if len(breadcrumb) != 2 or breadcrumb[0] != 'properties':
+            continue
+        inclusion = entry.get('inclusion')
+        if inclusion == 'automatic':
+            continue
+        if entry.get('selected') is False or inclusion == 'unsupported':
+            excluded.add(breadcrumb[1])
+    return frozenset(excluded)
+
+
+def _uses_path(schema) -> bool:
+    """Whether the values of the schema may hold objects, whose removed fields are logged by path."""
+    if not isinstance(schema, dict):
+        return False
+    if 'anyOf' in schema:
+        return any(_uses_path(subschema) for subschema in schema['anyOf'])
+    if 'type' not in schema:
+        return False
+    types = schema['type'] if isinstance(schema['type'], list) else [schema['type']]
+    return 'object' in types or 'array' in types
+
+
+class CompiledSchema:
+    """
+    The transform of one schema and metadata, compiled into nested functions
+    mirroring singer.Transformer.transform_recur: each function returns the
+    transformed value, or _FAIL when the value does not match.
+
+    :param transformer: The Transformer whose `removed` and `filtered` paths are tracked
+    :param schema: The stream schema
+    :param metadata: The stream metadata map
+    """
+
+    def __init__(self, transformer: Transformer, schema: dict, metadata: dict):
+        self.transformer = transformer
+        self.excluded = get_excluded_fields(metadata)
+        self.transform = self.compile(schema)
+
+    def filter(self, data):
+        """Drops the excluded fields, without changing the record of the API."""
+        if not self.excluded or not isinstance(data, dict) or self.excluded.isdisjoint(data):
+            return data
+        for field_name in self.excluded.intersection(data):
+            self.transformer.filtered.add(breadcrumb_path(('properties', field_name)))
+        return {key: value for key, value in data.items() if key not in self.excluded}
+
+    def compile(self, schema: dict):
+        if 'anyOf' in schema:
+            return self.compile_union([self.compile(subschema) for subschema in schema['anyOf']])
+
+        if 'type' not in schema:
+            # no typing information, the value is not transformed
+            return _transform_any
+
+        types = schema['type']
+        types = list(types) if isinstance(types, list) else [types]
+        # null is always tried last
+        if 'null' in types:
+            types.remove('null')
+            types.append('null')
+
+        return self.compile_union([self.compile_type(typ, schema) for typ in types])
+
+    @staticmethod
+    def compile_union(transforms: list):
+        if len(transforms) == 1:
+            return transforms[0]
+
+        def transform_union(data, path):
+            for transform in transforms:
+                value = transform(data, path)
+                if value is not _FAIL:
+                    return value
+            return _FAIL
+
+        return transform_union
+
+    def compile_type(self, typ: str, schema: dict): # pylint: disable=too-many-return-statements
+        if typ == 'null':
+            return _transform_null
+        if schema.get('format') == 'date-time':
+            return _transform_datetime
+        if schema.get('format') == 'singer.decimal':
+            return _transform_decimal
+        if typ == 'object':
+            return self.compile_object(schema.get('properties', {}), schema.get('patternProperties'))
+        if typ == 'array':
+            return self.compile_array(schema)
+        return {
+            'string': _transform_string,
+            'integer': _transform_integer,
+            'number': _transform_number,
+            'boolean': _transform_boolean
+        }.get(typ, _transform_unknown)
+
+    def compile_object(self, properties: dict, pattern_properties: dict):
+        if properties == {} and not pattern_properties:
+            def transform_any_object(data, path):
+                if not isinstance(data, dict):
+                    return _FAIL
+                return data
+            return transform_any_object
+
+        fields = {key: (self.compile(subschema), _uses_path(subschema)) for key, subschema in properties.items()}
+        pattern_fields = {}
+        removed = self.transformer.removed
+
+        def get_pattern_field(key):
+            if key not in pattern_fields:
+                pattern_schemas = [
+                    subschema for pattern, subschema in pattern_properties.items()
+                    if re.match(pattern, key)]
+                pattern_fields[key] = (self.compile({'anyOf': pattern_schemas}), True) if pattern_schemas else None
+            return pattern_fields[key]
+
+        def transform_object(data, path):
+            if not isinstance(data, dict):
+                return _FAIL
+
+            result = {}
+            success = True
+            for key, value in data.items():
+                field = fields.get(key)
+                if field is None and pattern_properties:
+                    field = get_pattern_field(key)
+                if field is None:
+                    # not in the schema, tracked like the Transformer does
+                    removed.add('.'.join(map(str, path + [key])))
+                    continue
+
+                transform, uses_path = field
+                value = transform(value, path + [key] if uses_path else path)
+                if value is _FAIL:
+                    success = False
+                    value = None
+                result[key] = value
+
+            return result if success else _FAIL
+
+        return transform_object
+
+    def compile_array(self, schema: dict):
+        if 'items' not in schema:
+            def transform_invalid_array(data, path):
+                raise KeyError('items')
+            return transform_invalid_array
+
+        transform = self.compile(schema['items'])
+        uses_path = _uses_path(schema['items'])
+
+        def transform_array(data, path):
+            if not isinstance(data, list):
+                return _FAIL
+
+            result = []
+            success = True
+            for index, row in enumerate(data):
+                value = transform(row, path + [index] if uses_path else path)
+                if value is _FAIL:
+                    success = False
+                    value = None
+                result.append(value)
+
+            return result if success else _FAIL
+
+        return transform_array
+
+
+class CompiledTransformer:
+    """
+    Drop-in replacement of a singer Transformer that compiles each stream
+    schema and metadata once, on the first record, into a transform
+    function. The records are the same as the Transformer's: a record that
+    does not match its schema is transformed by the Transformer, which
+    raises the SchemaMismatch error. Transformers with a pre_hook or an
+    integer datetime format are always used as is.
+
+    :param transformer: The singer Transformer
+    """
+
+    def __init__(self, transformer: Transformer):
+        self.transformer = transformer
+        self.compiled = {}
+
+    def get_compiled_schema(self, schema: dict, metadata: dict) -> CompiledSchema:
+        """Returns the compiled schema, None when the Transformer must be used."""
+        key = (id(schema), id(metadata))
+        entry = self.compiled.get(key)
+        # The schema and metadata are kept with the entry so their ids are not reused
+        if entry is None or entry[0] is not schema or entry[1] is not metadata:
+            compiled_schema = None
+            if self.is_supported(metadata):
+                compiled_schema = CompiledSchema(self.transformer, schema, metadata)
+            entry = (schema, metadata, compiled_schema)
+            self.compiled[key] = entry
+        return entry[2]
+
+    def is_supported(self, metadata: dict) -> bool:
+        """Whether the compiler handles the Transformer options and the field selection."""
+        if self.transformer.pre_hook or self.transformer.integer_datetime_fmt != NO_INTEGER_DATETIME_PARSING:
+            return False
+        # The selection of nested fields is left to the Transformer
+        return not any(len(breadcrumb) > 2 for breadcrumb in (metadata or {}))
+
+    def transform(self, data, schema: dict, metadata: dict = None):
+        compiled_schema = self.get_compiled_schema(schema, metadata)
+        if compiled_schema is None:
+            return self.transformer.transform(data, schema, metadata)
+
+        value = compiled_schema.transform(compiled_schema.filter(data), [])
+        if value is _FAIL:
+            return self.transformer.transform(data, schema, metadata)
+        return value
@@ -0,0 +1,266 @@
+"""
+This module defines the writers used to emit Singer messages.
+"""
+
+import copy
+import queue
+import sys
+import threading
+import time
+
+import singer
+
+
+LOGGER = singer.get_logger()
+
+# Upper bound on messages waiting for the writer thread, keeps memory
+# bounded when the workers outpace stdout.
+MAX_QUEUED_MESSAGES = 10000
+
+# RECORD messages are buffered up to this many characters, or this many
+# seconds, before they are written to stdout in a single write
+DEFAULT_WRITE_BUFFER_SIZE = 256 * 1024
+DEFAULT_WRITE_FLUSH_SECONDS = 1
+
+_STOP = object()
+
+
+def get_config_value(config: dict, key: str, default: int) -> int:
+    """Returns the integer config value, the default when missing or empty, 0 is kept."""
+    value = config.get(key)
+    if value is None or str(value).strip() == '':
+        return default
+    return int(value)
+
+
+def merge_stream_state(state: dict, stream_state: dict, *tap_stream_ids: str) -> dict:
+    """
+    Copies the entries that belong to one stream from a worker's copy of the
+    state into the shared state. Every top-level dict keyed by stream
+    (e.g. `bookmarks`) is merged, entries removed by the worker are removed.
+
+    :param state: The shared state dict.
+    :param stream_state: The state dict written by the stream.
+    :param tap_stream_ids: The streams that wrote the state.
+    :return: The shared state dict.
+    """
+    for key in list(stream_state) + [key for key in state if key not in stream_state]:
+        # A dict the stream dropped once it was empty (e.g. `backfill`)
+        value = stream_state.get(key, {})
+        if not isinstance(value, dict):
+            continue
+        for tap_stream_id in tap_stream_ids:
+            if tap_stream_id in value:
+                state.setdefault(key, {})[tap_stream_id] = value[tap_stream_id]
+            elif isinstance(state.get(key), dict) and tap_stream_id in state[key]:
+                del state[key][tap_stream_id]
+                if not state[key]:
+                    del state[key]
+
+    return state
+
+
+class MessageWriter:
+    """
+    Writes Singer messages to stdout from the calling thread.
+
+    RECORD messages are buffered when `buffer_size` is set and written in a
+    single write once the buffer holds `buffer_size` characters, or
+    `flush_seconds` after the first buffered one, by the next record or by a
+    timer when no record follows (e.g. while the stream waits for the rate
+    limit). The buffer is always flushed before a SCHEMA or STATE message,
+    so a STATE never reaches the target before the records it covers.
+
+    :param json_backend: The JSON backend used to encode the RECORD messages,
+        they are written by singer-python when not set.
+    :param buffer_size: The size of the RECORD buffer, in characters. Each
+        record is written and flushed on its own when 0.
+    :param flush_seconds: The longest time a record waits in the buffer.
+    """
+
+    def __init__(self, json_backend=None, buffer_size: int = 0, flush_seconds: float = DEFAULT_WRITE_FLUSH_SECONDS):
+        self.json_backend = json_backend
+        self.buffer_size = buffer_size
+        self.flush_seconds = flush_seconds
+        self._buffer = []
+        self._buffered_size = 0
+        self._buffered_at = None
+        # Flushes the buffer when no record follows, see write_record
+        self._timer = None
+        # The timer writes from its own thread
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_config(cls, config: dict, json_backend=None):
+        """Creates the writer with the `write_buffer_size` and `write_flush_seconds` configs."""
+        return cls(
+            json_backend,
+            get_config_value(config, 'write_buffer_size', DEFAULT_WRITE_BUFFER_SIZE),
+            get_config_value(config, 'write_flush_seconds', DEFAULT_WRITE_FLUSH_SECONDS))
+
+    def write_schema(
+            self,
+            tap_stream_id: str,
+            schema: dict,
+            key_properties: list,
+            bookmark_properties: list = None):
+        with self._lock:
+            self.flush()
+            singer.write_schema(
+                tap_stream_id,
+                schema,
+                key_properties,
+                bookmark_properties)
+
+    def format_record(self, tap_stream_id: str, record: dict) -> str:
+        if self.json_backend is None:
+            return singer.format_message(singer.RecordMessage(stream=tap_stream_id, record=record))
+        # Same message as singer.write_record, the json backend writes the same line
+        message = {'type': 'RECORD', 'stream': tap_stream_id, 'record': record}
+        return self.json_backend.dumps(message)
+
+    def write_record(self, tap_stream_id: str, record: dict):
+        if not self.buffer_size:
+            if self.json_backend is None:
+                singer.write_record(tap_stream_id, record)
+                return
+            sys.stdout.write(self.format_record(tap_stream_id, record) + '\n')
+            sys.stdout.flush()
+            return
+
+        line = self.format_record(tap_stream_id, record) + '\n'
+        with self._lock:
+            self._buffer.append(line)
+            self._buffered_size += len(line)
+            now = time.monotonic()
+            if self._buffered_at is None:
+                self._buffered_at = now
+
+            if self._buffered_size >= self.buffer_size or now - self._buffered_at >= self.flush_seconds:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_seconds, self.flush)
+                # A daemon thread, so a pending flush never holds up the exit of the tap
+                self._timer.daemon = True
+                self._timer.start()
+
+    def write_state(self, state: dict):
+        with self._lock:
+            self.flush()
+            singer.write_state(state)
+
+    def flush(self):
+        """Writes the buffered RECORD messages to stdout."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._buffer:
+                return
+            sys.stdout.write(''.join(self._buffer))
+            sys.stdout.flush()
+            self._buffer = []
+            self._buffered_size = 0
+            self._buffered_at = None
+
+
+class StreamMessageWriter:
+    """
+    The writer handed to a single stream (or group of streams synced
+    together) when streams sync concurrently. Messages are queued for the
+    writer thread in the order they are written.
+
+    :param parent: The ThreadedMessageWriter that owns the writer thread.
+    :param tap_stream_ids: The streams the messages belong to.
+    """
+
+    def __init__(self, parent, *tap_stream_ids: str):
+        self.parent = parent
+        self.tap_stream_ids = tap_stream_ids
+
+    def write_schema(
+            self,
+            tap_stream_id: str,
+            schema: dict,
+            key_properties: list,
+            bookmark_properties: list = None):
+        self.parent.put(('schema', (tap_stream_id, schema, key_properties, bookmark_properties)))
+
+    def write_record(self, tap_stream_id: str, record: dict):
+        self.parent.put(('record', (tap_stream_id, record)))
+
+    def write_state(self, state: dict):
+        # The stream keeps mutating its state, so a snapshot is queued
+        self.parent.put(('state', (self.tap_stream_ids, copy.deepcopy(state))))
+
+
+class ThreadedMessageWriter:
+    """
+    Owns the single thread that writes to stdout while streams sync on a
+    thread pool. Messages of a stream are written in the order the stream
+    produced them, STATE messages carry the shared state with the latest
+    bookmarks of every stream merged in.
+
+    :param state: The state dict the sync started from.
+    :param sink: The writer used by the writer thread.
+    """
+
+    def __init__(self, state: dict, sink: MessageWriter = None):
+        self.state = copy.deepcopy(state)
+        self.sink = sink or MessageWriter()
+        self.error = None
+        self._queue = queue.Queue(MAX_QUEUED_MESSAGES)
+        self._thread = threading.Thread(target=self._run, name='singer-writer', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self.error and exception_type is None:
+            raise self.error
+
+    def for_stream(self, *tap_stream_ids: str) -> StreamMessageWriter:
+        return StreamMessageWriter(self, *tap_stream_ids)
+
+    def put(self, message: tuple):
+        if self.error:
+            raise self.error
+        self._queue.put(message)
+
+    def _write(self, kind: str, payload: tuple):
+        if kind == 'schema':
+            self.sink.write_schema(*payload)
+        elif kind == 'record':
+            self.sink.write_record(*payload)
+        elif kind == 'flush':
+            self.sink.flush()
+        else:
+            tap_stream_ids, stream_state = payload
+            merge_stream_state(self.state, stream_state, *tap_stream_ids)
+            self.sink.write_state(self.state)
+
+    def _run(self):
+        # Without new messages (e.g. while the streams wait for the rate
+        # limit), the buffered records are still written every flush_seconds
+        timeout = self.sink.flush_seconds or None
+        while True:
+            try:
+                message = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                message = ('flush', ())
+            if message is _STOP:
+                break
+            # Keep draining after a failure so producers never block on a full queue
+            if self.error:
+                continue
+            try:
+                self._write(*message)
+            except Exception as err: # pylint: disable=broad-except
+                LOGGER.error('Writer thread failed: %s', err)
+                self.error = err
+
+        if not self.error:
+            self.sink.flush()
@@ -120,6 +120,10 @@ class RechargeBaseTest(unittest.TestCase):
                 self.REPLICATION_METHOD: self.INCREMENTAL,
                 self.REPLICATION_KEYS: {"updated_at"}
             },
+            "products": {
+                self.PRIMARY_KEYS: {"external_product_id"},
+                self.REPLICATION_METHOD: self.FULL_TABLE
+            },
             "store": {
                 self.PRIMARY_KEYS: {"id"},
                 self.REPLICATION_METHOD: self.FULL_TABLE
@@ -0,0 +1,310 @@
+import asyncio
+import copy
+import datetime
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import singer
+from singer import Catalog
+from tap_recharge.async_client import AsyncRechargeClient, get_query_params, is_async_supported
+from tap_recharge.async_streams import AsyncCursorPagingStream
+from tap_recharge.client import (
+    RechargeClient,
+    RechargeMalformedResponseError,
+    RechargeNotFoundError)
+from tap_recharge.streams import Charges, MetafieldsStore, PageLimit
+from tap_recharge.sync import sync
+from tap_recharge.writer import merge_stream_state
+
+NOW = datetime.datetime(2021, 1, 5, tzinfo=datetime.timezone.utc)
+
+def mock_transform(*args, **kwargs):
+    """Mocked transformer function which returns the first argument received"""
+    return args[0]
+
+def get_pages(data_key, pages):
+    """Returns a mocked 'AsyncRechargeClient.get' serving the pages in order, chained by their cursor"""
+    async def mocked_get(path, url=None, params=None, **kwargs):
+        index = int(params.get('cursor', 0))
+        next_cursor = str(index + 1) if index + 1 < len(pages) else None
+        return {'next_cursor': next_cursor, data_key: pages[index]}
+    return mocked_get
+
+def get_catalog(stream_names):
+    """Returns a catalog with every stream selected"""
+    return Catalog.from_dict({'streams': [
+        {
+            'stream': stream_name,
+            'tap_stream_id': stream_name,
+            'schema': {'type': 'object', 'properties': {'id': {'type': 'integer'}, 'updated_at': {'type': 'string'}}},
+            'metadata': [{'breadcrumb': [], 'metadata': {'selected': True}}]
+        } for stream_name in stream_names]})
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves the response set by the test for each path"""
+    protocol_version = 'HTTP/1.1'
+    responses = {}
+    requests = []
+
+    def do_GET(self): # pylint: disable=invalid-name
+        self.requests.append(self.path)
+        status_code, headers, body = self.responses[self.path.split('?')[0]].pop(0)
+        self.send_response(status_code)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+class TestGetQueryParams(unittest.TestCase):
+    """Test cases to verify the query params are sent as requests sends them"""
+
+    def test_query_params(self):
+        updated_at_min = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+
+        self.assertEqual(
+            get_query_params({'updated_at_min': updated_at_min, 'limit': 250, 'cursor': None, 'sort_by': 'updated_at-asc'}),
+            {'updated_at_min': '2021-01-01 00:00:00+00:00', 'limit': 250, 'sort_by': 'updated_at-asc'})
+
+class TestMergeStreamState(unittest.TestCase):
+    """Test cases to verify the entries dropped by a stream are dropped from the shared state"""
+
+    def test_dropped_dict(self):
+        state = {'bookmarks': {'orders': 'a'}, 'backfill': {'charges': {'windows': []}}}
+        merge_stream_state(state, {'bookmarks': {'orders': 'a', 'charges': 'b'}}, 'charges')
+
+        self.assertEqual(state, {'bookmarks': {'orders': 'a', 'charges': 'b'}})
+
+@unittest.skipUnless(is_async_supported(), 'aiohttp is not installed')
+class TestAsyncRechargeClient(unittest.TestCase):
+    """Test cases to verify the async client maps the errors and retries as RechargeClient"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}/'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        Handler.requests = []
+        Handler.responses = {'/': [(200, {}, b'{}')]}
+
+    def get(self, path, **kwargs):
+        async def run():
+            async with AsyncRechargeClient('test_access_token', base_url=self.base_url, **kwargs) as client:
+                return await client.get(path, params={'limit': 250})
+        return asyncio.run(run())
+
+    def test_get(self):
+        Handler.responses['/charges'] = [(200, {'X-Recharge-Limit': '1/40'}, b'{"charges": [{"id": 1}], "next_cursor": null}')]
+
+        self.assertEqual(self.get('charges'), {'charges': [{'id': 1}], 'next_cursor': None})
+        self.assertEqual(Handler.requests, ['/', '/charges?limit=250'])
+
+    def test_error_mapping(self):
+        Handler.responses['/charges'] = [(404, {}, b'{"errors": "Not Found"}')]
+
+        with self.assertRaises(RechargeNotFoundError) as err:
+            self.get('charges')
+
+        self.assertEqual(str(err.exception), 'HTTP-error-code: 404, Error: Not Found')
+
+    def test_rate_limited(self):
+        Handler.responses['/charges'] = [
+            (429, {'Retry-After': '0.01'}, b'{"errors": "Too many requests"}'),
+            (200, {}, b'{"charges": [], "next_cursor": null}')]
+
+        self.assertEqual(self.get('charges'), {'charges': [], 'next_cursor': None})
+        self.assertEqual(len(Handler.requests), 3)
+
+    @mock.patch('tap_recharge.async_client.get_retry_delay', return_value=0)
+    def test_malformed_body(self, mocked_get_retry_delay):
+        Handler.responses['/charges'] = [(200, {}, b'<html>'), (200, {}, b'<html>')]
+
+        with self.assertRaises(RechargeMalformedResponseError):
+            self.get('charges')
+
+        # Malformed content is requested again once
+        self.assertEqual(len(Handler.requests), 3)
+
+    @mock.patch('tap_recharge.async_client.get_retry_delay', return_value=0)
+    def test_truncated_body_smaller_page(self, mocked_get_retry_delay):
+        Handler.responses['/charges'] = [
+            (200, {}, b'{"charges": [{"id": 1}'),
+            (200, {}, b'{"charges": [{"id": 1}], "next_cursor": null}')]
+        params = {'limit': 250}
+        page_limit = PageLimit(250, adaptive=True)
+
+        async def run():
+            async with AsyncRechargeClient('test_access_token', base_url=self.base_url) as client:
+                return await client.get('charges', params=params, on_retry=lambda err: page_limit.shrink(params, err))
+
+        self.assertEqual(asyncio.run(run()), {'charges': [{'id': 1}], 'next_cursor': None})
+        # The retried request asks for the smaller page
+        self.assertEqual(Handler.requests, ['/', '/charges?limit=250', '/charges?limit=125'])
+
+    def test_missing_aiohttp(self):
+        with mock.patch('tap_recharge.async_client.aiohttp', None):
+            with self.assertRaises(ValueError):
+                AsyncRechargeClient('test_access_token')
+
+@unittest.skipUnless(is_async_supported(), 'aiohttp is not installed')
+@mock.patch('singer.write_state')
+@mock.patch('singer.write_record')
+class TestAsyncCursorPagingStream(unittest.TestCase):
+    """Test cases to verify the async engine syncs the cursor paging streams as the threaded sync"""
+
+    config = {'start_date': '2021-01-01T00:00:00Z'}
+
+    def sync(self, stream, state, config):
+        client = stream.client
+        return asyncio.run(AsyncCursorPagingStream(stream, client).sync(state, {}, {}, config, mock.Mock(transform=mock_transform)))
+
+    @mock.patch('tap_recharge.async_client.AsyncRechargeClient.get')
+    def test_sync(self, mocked_get, mocked_write_record, mocked_write_state):
+        mocked_get.side_effect = get_pages('charges', [
+            [{'id': 1, 'updated_at': '2021-10-01T00:00:00Z'}],
+            [{'id': 2, 'updated_at': '2021-10-02T00:00:00Z'}],
+            [{'id': 3, 'updated_at': '2020-10-02T00:00:00Z'}]])
+        stream = Charges(AsyncRechargeClient('test_access_token'))
+
+        state = self.sync(stream, {}, self.config)
+
+        # The record older than the start date is skipped
+        self.assertEqual([call.args[1]['id'] for call in mocked_write_record.mock_calls], [1, 2])
+        self.assertEqual(state, {'bookmarks': {'charges': '2021-10-02T00:00:00.000000Z'}})
+        self.assertEqual(mocked_get.mock_calls[0].kwargs['params']['updated_at_min'], singer.utils.strptime_to_utc('2021-01-01T00:00:00Z'))
+
+    @mock.patch('tap_recharge.async_client.AsyncRechargeClient.get')
+    def test_checkpoint_saves_cursor(self, mocked_get, mocked_write_record, mocked_write_state):
+        mocked_get.side_effect = get_pages('charges', [
+            [{'id': 1, 'updated_at': '2021-10-01T00:00:00Z'}],
+            [{'id': 2, 'updated_at': '2021-10-02T00:00:00Z'}]])
+        written_states = []
+        mocked_write_state.side_effect = lambda state: written_states.append(copy.deepcopy(state))
+        stream = Charges(AsyncRechargeClient('test_access_token'))
+
+        self.sync(stream, {}, dict(self.config, checkpoint_records=1, prefetch_pages=0))
+
+        self.assertEqual(written_states[1]['cursors']['charges']['cursor'], '1')
+        self.assertNotIn('cursors', written_states[-1])
+
+    @mock.patch('tap_recharge.async_client.AsyncRechargeClient.get')
+    def test_resume_cursor(self, mocked_get, mocked_write_record, mocked_write_state):
+        mocked_get.side_effect = get_pages('charges', [
+            [{'id': 1, 'updated_at': '2021-10-01T00:00:00Z'}],
+            [{'id': 2, 'updated_at': '2021-10-02T00:00:00Z'}]])
+        state = {
+            'bookmarks': {'charges': '2021-01-01T00:00:00Z'},
+            'cursors': {'charges': {
+                'cursor': '1',
+                'created_at': singer.utils.strftime(singer.utils.now()),
+                'query': {'sort_by': 'updated_at-asc', 'updated_at_min': '2021-01-01T00:00:00.000000Z'}}}}
+        stream = Charges(AsyncRechargeClient('test_access_token'))
+
+        self.sync(stream, state, self.config)
+
+        self.assertEqual([call.args[1]['id'] for call in mocked_write_record.mock_calls], [2])
+
+    @mock.patch('tap_recharge.async_client.AsyncRechargeClient.get')
+    def test_descending_stops_at_bookmark(self, mocked_get, mocked_write_record, mocked_write_state):
+        mocked_get.side_effect = get_pages('metafields', [
+            [{'id': 2, 'updated_at': '2021-10-02T00:00:00Z'}, {'id': 1, 'updated_at': '2021-09-01T00:00:00Z'}],
+            [{'id': 0, 'updated_at': '2021-08-01T00:00:00Z'}]])
+        stream = MetafieldsStore(AsyncRechargeClient('test_access_token'))
+        stream.configure = mock.Mock(side_effect=lambda config: setattr(stream, 'sort_descending', True))
+
+        state = self.sync(stream, {'bookmarks': {'metafields_store': '2021-10-01T00:00:00Z'}}, dict(self.config, prefetch_pages=0))
+
+        self.assertEqual([call.args[1]['id'] for call in mocked_write_record.mock_calls], [2])
+        self.assertEqual(mocked_get.call_count, 1)
+        self.assertEqual(state['bookmarks']['metafields_store'], '2021-10-02T00:00:00.000000Z')
+
+    @mock.patch('tap_recharge.streams.utils.now', return_value=NOW)
+    @mock.patch('tap_recharge.async_client.AsyncRechargeClient.get')
+    def test_sync_backfill(self, mocked_get, mocked_now, mocked_write_record, mocked_write_state):
+        async def get(path, url=None, params=None, **kwargs):
+            updated_at_min = params['updated_at_min']
+            record = {'id': updated_at_min.day, 'updated_at': singer.utils.strftime(updated_at_min + datetime.timedelta(hours=1))}
+            return {'next_cursor': None, 'charges': [record]}
+        mocked_get.side_effect = get
+        stream = Charges(AsyncRechargeClient('test_access_token'))
+
+        state = self.sync(stream, {}, dict(self.config, backfill_windows=4))
+
+        # Every window is paged on its own
+        self.assertEqual(mocked_get.call_count, 4)
+        self.assertEqual(mocked_write_record.call_count, 4)
+        self.assertEqual(state, {'bookmarks': {'charges': '2021-01-04T01:00:00.000000Z'}})
+
+    @mock.patch('tap_recharge.async_client.AsyncRechargeClient.get')
+    def test_write_off_event_loop(self, mocked_get, mocked_write_record, mocked_write_state):
+        mocked_get.side_effect = get_pages('charges', [[{'id': 1, 'updated_at': '2021-10-01T00:00:00Z'}]])
+        release = threading.Event()
+        # Blocks like a put into a full writer queue when stdout is slow
+        mocked_write_record.side_effect = lambda *args, **kwargs: release.wait(timeout=5)
+        stream = Charges(AsyncRechargeClient('test_access_token'))
+
+        async def run():
+            sync_task = asyncio.ensure_future(AsyncCursorPagingStream(stream, stream.client).sync(
+                {}, {}, {}, self.config, mock.Mock(transform=mock_transform)))
+            await asyncio.sleep(0.05)
+            # The event loop keeps running while the record is written
+            running = not sync_task.done()
+            release.set()
+            await sync_task
+            return running
+
+        self.assertTrue(asyncio.run(run()))
+        self.assertEqual(mocked_write_record.call_count, 1)
+
+    @mock.patch('tap_recharge.streams.utils.now', return_value=NOW)
+    @mock.patch('tap_recharge.async_client.AsyncRechargeClient.get')
+    def test_missing_data_key(self, mocked_get, mocked_now, mocked_write_record, mocked_write_state):
+        async def get(path, url=None, params=None, **kwargs):
+            return {'next_cursor': None}
+        mocked_get.side_effect = get
+
+        state = self.sync(Charges(AsyncRechargeClient('test_access_token')), {}, self.config)
+        self.assertEqual(state, {'bookmarks': {'charges': '2021-01-01T00:00:00.000000Z'}})
+
+        # Each window of a backfill is paged through as an empty page
+        state = self.sync(Charges(AsyncRechargeClient('test_access_token')), {}, dict(self.config, backfill_windows=4))
+        self.assertEqual(state, {'bookmarks': {'charges': '2021-01-04T00:00:00.000000Z'}})
+        mocked_write_record.assert_not_called()
+
+@unittest.skipUnless(is_async_supported(), 'aiohttp is not installed')
+class TestAsyncSync(unittest.TestCase):
+    """Test cases to verify the async engine syncs every selected stream"""
+
+    @mock.patch('singer.write_state')
+    @mock.patch('tap_recharge.writer.MessageWriter.write_record')
+    @mock.patch('singer.write_schema')
+    @mock.patch('tap_recharge.async_client.AsyncRechargeClient.check_access_token')
+    @mock.patch('tap_recharge.async_client.AsyncRechargeClient.get')
+    @mock.patch('tap_recharge.client.RechargeClient.get')
+    def test_sync(self, mocked_get, mocked_async_get, mocked_check_access_token, mocked_write_schema, mocked_write_record, mocked_write_state):
+        # The store stream runs on a thread with the client
+        mocked_get.return_value = {'store': {'id': 1}}
+        mocked_async_get.side_effect = get_pages('orders', [[{'id': 2, 'updated_at': '2021-10-11T00:00:00.000000Z'}]])
+        config = {'access_token': 'test_access_token', 'start_date': '2021-01-01T00:00:00Z', 'async_engine': 'true'}
+
+        sync(RechargeClient('test_access_token'), config, {}, get_catalog(['orders', 'store']))
+
+        self.assertEqual(mocked_write_schema.call_count, 2)
+        self.assertCountEqual(
+            mocked_write_record.mock_calls,
+            [mock.call('orders', {'id': 2, 'updated_at': '2021-10-11T00:00:00.000000Z'}), mock.call('store', {'id': 1})])
+        self.assertEqual(
+            mocked_write_state.mock_calls[-1].args[0],
+            {'currently_syncing': None, 'bookmarks': {'orders': '2021-10-11T00:00:00.000000Z'}})
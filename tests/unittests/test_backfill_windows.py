@@ -0,0 +1,97 @@
+import unittest
+from unittest import mock
+import datetime
+import singer
+from tap_recharge.client import RechargeClient
+from tap_recharge.streams import Charges
+
+NOW = datetime.datetime(2021, 1, 5, tzinfo=datetime.timezone.utc)
+
+def mock_transform(*args, **kwargs):
+    """Mocked transformer function which returns the first argument received"""
+    return args[0]
+
+def get(path, url=None, params=None):
+    """Returns one record per window, dated right after the start of the window"""
+    updated_at_min = params['updated_at_min']
+    record = {'id': updated_at_min.day, 'updated_at': singer.utils.strftime(updated_at_min + datetime.timedelta(hours=1))}
+    return {'next_cursor': None, 'charges': [record]}
+
+@mock.patch('tap_recharge.streams.utils.now', return_value=NOW)
+@mock.patch('singer.write_state')
+@mock.patch('singer.write_record')
+@mock.patch('tap_recharge.client.RechargeClient.get', side_effect=get)
+class TestBackfillWindows(unittest.TestCase):
+    """Test cases to verify the sharded backfill of a cursor paging stream"""
+
+    config = {'start_date': '2021-01-01T00:00:00Z', 'backfill_windows': 4}
+
+    def test_plan_backfill(self, mocked_get, mocked_write_record, mocked_write_state, mocked_now):
+        stream = Charges(RechargeClient('test_access_token'))
+        state = stream.plan_backfill({}, self.config)
+
+        self.assertEqual(state['backfill']['charges'], {
+            'bookmark': '2021-01-01T00:00:00Z',
+            'windows': [
+                {'updated_at_min': '2021-01-01T00:00:00.000000Z', 'updated_at_max': '2021-01-02T00:00:00.000000Z'},
+                {'updated_at_min': '2021-01-02T00:00:00.000000Z', 'updated_at_max': '2021-01-03T00:00:00.000000Z'},
+                {'updated_at_min': '2021-01-03T00:00:00.000000Z', 'updated_at_max': '2021-01-04T00:00:00.000000Z'},
+                {'updated_at_min': '2021-01-04T00:00:00.000000Z', 'updated_at_max': None}]})
+
+    def test_no_backfill_for_short_range(self, mocked_get, mocked_write_record, mocked_write_state, mocked_now):
+        stream = Charges(RechargeClient('test_access_token'))
+        state = stream.plan_backfill({'bookmarks': {'charges': '2021-01-04T12:00:00Z'}}, self.config)
+
+        self.assertNotIn('backfill', state)
+
+    def test_sync_backfill(self, mocked_get, mocked_write_record, mocked_write_state, mocked_now):
+        stream = Charges(RechargeClient('test_access_token'))
+        state = stream.sync({}, {}, {}, self.config, mock.Mock(transform=mock_transform))
+
+        # Every window is paged on its own
+        self.assertEqual(mocked_get.call_count, 4)
+        self.assertEqual(mocked_write_record.call_count, 4)
+        self.assertEqual(state, {'bookmarks': {'charges': '2021-01-04T01:00:00.000000Z'}})
+
+    def test_resume_unfinished_windows(self, mocked_get, mocked_write_record, mocked_write_state, mocked_now):
+        state = {'backfill': {'charges': {
+            'bookmark': '2021-01-02T01:00:00.000000Z',
+            'windows': [{'updated_at_min': '2021-01-03T00:00:00.000000Z', 'updated_at_max': None}]}}}
+        stream = Charges(RechargeClient('test_access_token'))
+        state = stream.sync(state, {}, {}, self.config, mock.Mock(transform=mock_transform))
+
+        # Only the unfinished window is requested
+        self.assertEqual(mocked_get.call_count, 1)
+        self.assertEqual(state, {'bookmarks': {'charges': '2021-01-03T01:00:00.000000Z'}})
+
+    def test_saved_cursor_dropped(self, mocked_get, mocked_write_record, mocked_write_state, mocked_now):
+        # A cursor saved by an interrupted incremental sync, before the backfill was planned
+        cursor = {
+            'cursor': 'next_cursor_1',
+            'created_at': '2021-01-04T23:00:00.000000Z',
+            'query': {'sort_by': 'updated_at-asc', 'updated_at_min': '2021-01-01T00:00:00.000000Z'}}
+        stream = Charges(RechargeClient('test_access_token'))
+
+        state = stream.plan_backfill({'cursors': {'charges': cursor}}, self.config)
+        self.assertNotIn('cursors', state)
+
+        state = stream.sync({'cursors': {'charges': cursor}}, {}, {}, self.config, mock.Mock(transform=mock_transform))
+        self.assertEqual(state, {'bookmarks': {'charges': '2021-01-04T01:00:00.000000Z'}})
+
+        # The next incremental sync starts from the bookmark, not the stale cursor
+        mocked_get.reset_mock()
+        stream = Charges(RechargeClient('test_access_token'))
+        stream.sync(state, {}, {}, dict(self.config, backfill_windows=1), mock.Mock(transform=mock_transform))
+        self.assertNotIn('cursor', mocked_get.mock_calls[0].kwargs['params'])
+
+    def test_saved_cursor_dropped_when_resumed_backfill_ends(self, mocked_get, mocked_write_record, mocked_write_state, mocked_now):
+        state = {
+            'cursors': {'charges': {'cursor': 'next_cursor_1', 'created_at': '2021-01-04T23:00:00.000000Z', 'query': {}}},
+            'backfill': {'charges': {
+                'bookmark': '2021-01-02T01:00:00.000000Z',
+                'windows': [{'updated_at_min': '2021-01-03T00:00:00.000000Z', 'updated_at_max': None}]}}}
+        stream = Charges(RechargeClient('test_access_token'))
+
+        state = stream.sync(state, {}, {}, self.config, mock.Mock(transform=mock_transform))
+
+        self.assertEqual(state, {'bookmarks': {'charges': '2021-01-03T01:00:00.000000Z'}})
@@ -1,3 +1,4 @@
+import json
 import unittest
 from unittest import mock
 from parameterized import parameterized
@@ -10,6 +11,10 @@ class MockResponse:
         self.text = json
         self.links = {}
 
+    @property
+    def content(self):
+        return json.dumps(self.text).encode('utf-8')
+
     def json(self):
         return self.text
 
@@ -0,0 +1,159 @@
+import io
+import json
+import time
+import unittest
+from unittest import mock
+from parameterized import parameterized
+from singer import Catalog
+from tap_recharge.client import RechargeClient, RechargeBadRequestError
+from tap_recharge.json_backend import JsonBackend
+from tap_recharge.sync import sync
+from tap_recharge.writer import DEFAULT_WRITE_BUFFER_SIZE, MessageWriter, ThreadedMessageWriter
+
+class MockedStdout(io.StringIO):
+    """Records each write to stdout"""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+        return super().write(text)
+
+    def messages(self):
+        return [json.loads(line) for line in self.getvalue().splitlines()]
+
+def get_catalog(stream_names):
+    """Returns a catalog with every stream selected"""
+    return Catalog.from_dict({'streams': [
+        {
+            'stream': stream_name,
+            'tap_stream_id': stream_name,
+            'schema': {'type': 'object', 'properties': {'id': {'type': 'integer'}, 'updated_at': {'type': 'string'}}},
+            'metadata': [{'breadcrumb': [], 'metadata': {'selected': True}}]
+        } for stream_name in stream_names]})
+
+@mock.patch('sys.stdout', new_callable=MockedStdout)
+class TestBufferedWriter(unittest.TestCase):
+    """Test cases to verify the RECORD messages are batched and flushed before the STATE messages"""
+
+    @parameterized.expand([
+        ['singer', None],
+        ['json_backend', JsonBackend()],
+    ])
+    def test_records_batched(self, mocked_stdout, name, json_backend):
+        writer = MessageWriter(json_backend, buffer_size=1000)
+        for index in range(20):
+            writer.write_record('charges', {'id': index})
+
+        # 20 records of about 50 characters fill the buffer once
+        self.assertEqual(len(mocked_stdout.writes), 1)
+        writer.flush()
+        self.assertEqual(len(mocked_stdout.writes), 2)
+        self.assertEqual(
+            mocked_stdout.messages(),
+            [{'type': 'RECORD', 'stream': 'charges', 'record': {'id': index}} for index in range(20)])
+
+    def test_same_output(self, mocked_stdout):
+        records = [{'id': 1, 'price': 1.5, 'name': 'Café ☕'}, {'id': 2, 'price': None, 'name': ''}]
+        for writer in [MessageWriter(), MessageWriter(buffer_size=1000)]:
+            for record in records:
+                writer.write_record('charges', record)
+            writer.flush()
+
+        lines = mocked_stdout.getvalue().splitlines()
+        self.assertEqual(lines[:2], lines[2:])
+
+    def test_flush_before_state(self, mocked_stdout):
+        writer = MessageWriter(buffer_size=DEFAULT_WRITE_BUFFER_SIZE)
+        writer.write_schema('charges', {'type': 'object'}, ['id'])
+        writer.write_record('charges', {'id': 1})
+        writer.write_record('charges', {'id': 2})
+
+        self.assertEqual(len(mocked_stdout.messages()), 1)
+        writer.write_state({'bookmarks': {'charges': '2021-10-01T00:00:00Z'}})
+
+        self.assertEqual([message['type'] for message in mocked_stdout.messages()], ['SCHEMA', 'RECORD', 'RECORD', 'STATE'])
+
+    @mock.patch('time.monotonic')
+    def test_flush_on_time(self, mocked_monotonic, mocked_stdout):
+        writer = MessageWriter(buffer_size=DEFAULT_WRITE_BUFFER_SIZE, flush_seconds=1)
+        mocked_monotonic.return_value = 100
+        writer.write_record('charges', {'id': 1})
+        mocked_monotonic.return_value = 100.5
+        writer.write_record('charges', {'id': 2})
+        self.assertEqual(mocked_stdout.writes, [])
+
+        mocked_monotonic.return_value = 101
+        writer.write_record('charges', {'id': 3})
+
+        self.assertEqual(len(mocked_stdout.writes), 1)
+        self.assertEqual(len(mocked_stdout.messages()), 3)
+
+    def test_flush_on_time_without_records(self, mocked_stdout):
+        writer = MessageWriter(buffer_size=DEFAULT_WRITE_BUFFER_SIZE, flush_seconds=0.05)
+        writer.write_record('charges', {'id': 1})
+        self.assertEqual(mocked_stdout.writes, [])
+
+        # No other record follows, e.g. while the stream waits for the rate limit
+        deadline = time.monotonic() + 5
+        while not mocked_stdout.getvalue() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(len(mocked_stdout.messages()), 1)
+
+    def test_unbuffered(self, mocked_stdout):
+        writer = MessageWriter.from_config({'write_buffer_size': '0'})
+        writer.write_record('charges', {'id': 1})
+
+        self.assertEqual(len(mocked_stdout.messages()), 1)
+
+    def test_threaded_writer_flushed(self, mocked_stdout):
+        with ThreadedMessageWriter({}, MessageWriter(buffer_size=DEFAULT_WRITE_BUFFER_SIZE)) as writer:
+            writer.for_stream('charges').write_record('charges', {'id': 1})
+
+        self.assertEqual(len(mocked_stdout.messages()), 1)
+
+    def test_threaded_writer_flushed_on_time(self, mocked_stdout):
+        with ThreadedMessageWriter({}, MessageWriter(buffer_size=DEFAULT_WRITE_BUFFER_SIZE, flush_seconds=0.05)) as writer:
+            writer.for_stream('charges').write_record('charges', {'id': 1})
+
+            # No other message follows, e.g. while the stream waits for the rate limit
+            deadline = time.monotonic() + 5
+            while not mocked_stdout.getvalue() and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            self.assertEqual(len(mocked_stdout.messages()), 1)
+
+    @mock.patch('tap_recharge.client.RechargeClient.get')
+    def test_flushed_on_error(self, mocked_get, mocked_stdout):
+        mocked_get.side_effect = [
+            {'next_cursor': 'next_cursor_1', 'charges': [{'id': 1, 'updated_at': '2021-10-01T00:00:00Z'}]},
+            RechargeBadRequestError('bad request')]
+
+        with self.assertRaises(RechargeBadRequestError):
+            sync(RechargeClient('test_access_token'), {'start_date': '2021-01-01T00:00:00Z', 'prefetch_pages': 0}, {}, get_catalog(['charges']))
+
+        # The record synced before the error is written
+        self.assertEqual(
+            [message['type'] for message in mocked_stdout.messages()],
+            ['STATE', 'SCHEMA', 'RECORD'])
+
+class TestWriterConfig(unittest.TestCase):
+    """Test cases to verify the buffer configs are parsed as expected"""
+
+    def test_default(self):
+        writer = MessageWriter.from_config({})
+
+        self.assertEqual(writer.buffer_size, DEFAULT_WRITE_BUFFER_SIZE)
+        self.assertEqual(writer.flush_seconds, 1)
+
+    def test_string_values(self):
+        writer = MessageWriter.from_config({'write_buffer_size': '1024', 'write_flush_seconds': '5'})
+
+        self.assertEqual(writer.buffer_size, 1024)
+        self.assertEqual(writer.flush_seconds, 5)
+
+    def test_empty_values(self):
+        self.assertEqual(MessageWriter.from_config({'write_buffer_size': ''}).buffer_size, DEFAULT_WRITE_BUFFER_SIZE)
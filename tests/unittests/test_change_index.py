@@ -0,0 +1,141 @@
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from tap_recharge.change_index import COMMIT_RECORDS, ChangeIndex, get_record_hash
+from tap_recharge.client import RechargeClient
+from tap_recharge.streams import MetafieldsStore
+
+def mock_transform(*args, **kwargs):
+    """Mocked transformer function which returns the first argument received"""
+    return args[0]
+
+def get_metafield(id, updated_at, value='value'):
+    return {'id': id, 'owner_resource': 'store', 'value': value, 'updated_at': updated_at}
+
+class TestChangeIndex(unittest.TestCase):
+    """Test cases to verify the index only trusts the entries covered by the bookmark"""
+
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.index = ChangeIndex.from_config({'state_dir': os.path.join(self.state_dir.name, 'state')})
+
+    def tearDown(self):
+        self.index.close()
+        self.state_dir.cleanup()
+
+    def test_not_configured(self):
+        self.assertIsNone(ChangeIndex.from_config({}))
+
+    def test_record_hash(self):
+        record = get_metafield(1, '2021-10-01T00:00:00.000000Z')
+
+        # The replication key and the order of the keys do not change the hash
+        self.assertEqual(
+            get_record_hash(record, 'updated_at'),
+            get_record_hash(dict(reversed(list(record.items())), updated_at='2021-10-05T00:00:00Z'), 'updated_at'))
+        self.assertNotEqual(
+            get_record_hash(record, 'updated_at'),
+            get_record_hash(dict(record, value='other'), 'updated_at'))
+
+    def test_is_unchanged(self):
+        self.index.add('metafields_store', '[1]', '2021-10-01T00:00:00.000000Z', 'hash')
+
+        self.assertTrue(self.index.is_unchanged('metafields_store', '[1]', 'hash', '2021-10-01T00:00:00.000000Z'))
+        self.assertFalse(self.index.is_unchanged('metafields_store', '[1]', 'other_hash', '2021-10-01T00:00:00.000000Z'))
+        self.assertFalse(self.index.is_unchanged('metafields_customer', '[1]', 'hash', '2021-10-01T00:00:00.000000Z'))
+        # Not trusted before a bookmark covers it, the STATE may not have been committed
+        self.assertFalse(self.index.is_unchanged('metafields_store', '[1]', 'hash', '2021-09-30T00:00:00.000000Z'))
+
+    def test_concurrent_streams(self):
+        # Two streams synced at the same time, each opening the index
+        config = {'state_dir': os.path.join(self.state_dir.name, 'state')}
+        barrier = threading.Barrier(2, timeout=10)
+
+        def sync(tap_stream_id):
+            index = ChangeIndex.from_config(config)
+            try:
+                for key in range(COMMIT_RECORDS * 3):
+                    index.add(tap_stream_id, f'[{key}]', '2021-10-01T00:00:00.000000Z', 'hash')
+                    # The streams take turns, each one with written entries while the other writes
+                    if key % (COMMIT_RECORDS // 2) == 0:
+                        barrier.wait()
+            finally:
+                index.close()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for future in [executor.submit(sync, tap_stream_id) for tap_stream_id in ['metafields_store', 'metafields_customer']]:
+                future.result()
+
+        for tap_stream_id in ['metafields_store', 'metafields_customer']:
+            self.assertTrue(self.index.is_unchanged(
+                tap_stream_id, f'[{COMMIT_RECORDS * 3 - 1}]', 'hash', '2021-10-01T00:00:00.000000Z'))
+
+@mock.patch('singer.write_state')
+@mock.patch('singer.write_record')
+class TestChangeDetection(unittest.TestCase):
+    """Test cases to verify a pseudo-incremental stream skips unchanged records and stops at the bookmark"""
+
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.config = {'start_date': '2021-01-01T00:00:00Z', 'state_dir': self.state_dir.name, 'prefetch_pages': 0}
+
+    def tearDown(self):
+        self.state_dir.cleanup()
+
+    def sync(self, pages, state):
+        with mock.patch('tap_recharge.client.RechargeClient.get', side_effect=pages) as mocked_get:
+            state = MetafieldsStore(RechargeClient('test_access_token')).sync(
+                state, {}, {}, self.config, mock.Mock(transform=mock_transform))
+        return state, mocked_get
+
+    def test_skip_unchanged_records(self, mocked_write_record, mocked_write_state):
+        state, mocked_get = self.sync([
+            {'next_cursor': None, 'metafields': [
+                get_metafield(2, '2021-10-02T00:00:00.000000Z'),
+                get_metafield(1, '2021-10-01T00:00:00.000000Z')]}], {})
+
+        # Newest first, the bookmark is the first record
+        self.assertEqual(mocked_get.mock_calls[0].kwargs['params']['sort_by'], 'updated_at-desc')
+        self.assertEqual(state, {'bookmarks': {'metafields_store': '2021-10-02T00:00:00.000000Z'}})
+        self.assertEqual(mocked_write_record.call_count, 2)
+        mocked_write_record.reset_mock()
+
+        state, mocked_get = self.sync([
+            {'next_cursor': 'next_cursor_1', 'metafields': [
+                # updated_at moved but nothing else did
+                get_metafield(2, '2021-10-04T00:00:00.000000Z'),
+                get_metafield(3, '2021-10-03T00:00:00.000000Z'),
+                get_metafield(1, '2021-10-01T00:00:00.000000Z')]},
+            {'next_cursor': None, 'metafields': [get_metafield(4, '2021-09-01T00:00:00.000000Z')]}], state)
+
+        self.assertEqual([call.args[1]['id'] for call in mocked_write_record.mock_calls], [3])
+        # The paging stops at the first record older than the bookmark
+        self.assertEqual(mocked_get.call_count, 1)
+        self.assertEqual(state, {'bookmarks': {'metafields_store': '2021-10-04T00:00:00.000000Z'}})
+
+    def test_changed_record(self, mocked_write_record, mocked_write_state):
+        state, _ = self.sync([{'next_cursor': None, 'metafields': [get_metafield(1, '2021-10-01T00:00:00.000000Z')]}], {})
+
+        self.sync([{'next_cursor': None, 'metafields': [get_metafield(1, '2021-10-05T00:00:00.000000Z', 'new value')]}], state)
+
+        self.assertEqual(mocked_write_record.call_count, 2)
+
+    def test_interrupted_sync(self, mocked_write_record, mocked_write_state):
+        # The state of the first sync never reached the target
+        self.sync([{'next_cursor': None, 'metafields': [get_metafield(1, '2021-10-01T00:00:00.000000Z')]}], {})
+
+        self.sync([{'next_cursor': None, 'metafields': [get_metafield(1, '2021-10-01T00:00:00.000000Z')]}], {})
+
+        self.assertEqual(mocked_write_record.call_count, 2)
+
+    def test_old_records_not_transformed(self, mocked_write_record, mocked_write_state):
+        transformer = mock.Mock(transform=mock.Mock(side_effect=mock_transform))
+        stream = MetafieldsStore(RechargeClient('test_access_token'))
+        with mock.patch('tap_recharge.client.RechargeClient.get', return_value={'next_cursor': None, 'metafields': [
+                get_metafield(1, '2021-09-01T00:00:00.000000Z')]}):
+            stream.sync({'bookmarks': {'metafields_store': '2021-10-01T00:00:00.000000Z'}}, {}, {}, {'start_date': '2021-01-01T00:00:00Z'}, transformer)
+
+        self.assertEqual(transformer.transform.call_count, 0)
@@ -0,0 +1,54 @@
+import copy
+import unittest
+from unittest import mock
+from tap_recharge.client import RechargeClient
+from tap_recharge.streams import Checkpoint, IncrementalStream
+
+def mock_transform(*args, **kwargs):
+    """Mocked transformer function which returns the first argument received"""
+    return args[0]
+
+class TestCheckpoint(unittest.TestCase):
+    """Test cases to verify when a checkpoint is due"""
+
+    def test_default_interval(self):
+        checkpoint = Checkpoint({})
+        self.assertEqual(checkpoint.records, 1000)
+        self.assertEqual(checkpoint.seconds, 60)
+
+    def test_due_after_records(self):
+        checkpoint = Checkpoint({'checkpoint_records': 2})
+        self.assertEqual([checkpoint.tick() for _ in range(5)], [False, True, False, True, False])
+
+    @mock.patch('tap_recharge.streams.time.monotonic', side_effect=[0, 30, 61, 61])
+    def test_due_after_seconds(self, mocked_monotonic):
+        checkpoint = Checkpoint({'checkpoint_seconds': 60})
+        self.assertEqual([checkpoint.tick(), checkpoint.tick()], [False, True])
+
+@mock.patch("tap_recharge.streams.IncrementalStream.get_records")
+@mock.patch("singer.write_state")
+@mock.patch("singer.write_record")
+class TestMidStreamCheckpoint(unittest.TestCase):
+    """Test cases to verify intermediate STATE messages hold a safe bookmark"""
+
+    def test_sync_writes_intermediate_state(self, mocked_write_record, mocked_write_state, mocked_get_records):
+        written_states = []
+        mocked_write_state.side_effect = lambda state: written_states.append(copy.deepcopy(state))
+        mocked_get_records.return_value = [
+            {"id": "1", "updated_at": "2021-09-16T00:06:34.000000Z"},
+            {"id": "2", "updated_at": "2021-09-17T00:00:34.000000Z"},
+            {"id": "3", "updated_at": "2021-10-11T00:01:32.000000Z"},
+            {"id": "4", "updated_at": "2021-10-12T00:51:10.000000Z"},
+            {"id": "5", "updated_at": "2021-10-13T00:51:10.000000Z"}]
+        config = {"start_date": "2021-01-01T00:00:00Z", "checkpoint_records": 2}
+
+        stream_obj = IncrementalStream(RechargeClient("dummy_token"))
+        stream_obj.tap_stream_id = "orders"
+        stream_obj.replication_key = "updated_at"
+        stream_obj.sync({}, {}, {}, config, mock.Mock(transform=mock_transform))
+
+        # Each checkpoint holds the greatest replication value written before it
+        self.assertEqual(written_states, [
+            {"bookmarks": {"orders": "2021-09-17T00:00:34.000000Z"}},
+            {"bookmarks": {"orders": "2021-10-12T00:51:10.000000Z"}},
+            {"bookmarks": {"orders": "2021-10-13T00:51:10.000000Z"}}])
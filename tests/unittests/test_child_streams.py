@@ -0,0 +1,126 @@
+import copy
+import threading
+import unittest
+from unittest import mock
+from tap_recharge.client import RechargeBadRequestError, RechargeClient, RechargeNotFoundError
+from tap_recharge.streams import ChildStream, Customers
+
+def mock_transform(*args, **kwargs):
+    """Mocked transformer function which returns the first argument received"""
+    return args[0]
+
+class PaymentMethods(ChildStream):
+    """A child stream of the customers, requested per customer"""
+    tap_stream_id = 'payment_methods'
+    key_properties = ['id']
+    path = 'customers/{parent_id}/payment_methods'
+    replication_key = 'updated_at'
+    valid_replication_keys = ['updated_at']
+    parent = Customers
+    data_key = 'payment_methods'
+
+CUSTOMERS = [
+    {'id': 1, 'updated_at': '2021-10-01T00:00:00Z'},
+    {'id': 2, 'updated_at': '2021-10-02T00:00:00Z'},
+    # Returned twice, e.g. updated while the customers were paged
+    {'id': 2, 'updated_at': '2021-10-02T00:00:00Z'},
+    {'id': 3, 'updated_at': '2021-10-03T00:00:00Z'}]
+
+def get(path, url=None, params=None, **kwargs):
+    """Serves the customers and 2 payment methods per customer, the second one on its own page"""
+    if path == 'customers':
+        return {'next_cursor': None, 'customers': CUSTOMERS}
+    customer_id = int(path.split('/')[1])
+    if params.get('cursor'):
+        return {'next_cursor': None, 'payment_methods': [{'id': customer_id * 10 + 1}]}
+    return {'next_cursor': 'next', 'payment_methods': [{'id': customer_id * 10}]}
+
+@mock.patch('singer.write_state')
+@mock.patch('singer.write_record')
+class TestChildStream(unittest.TestCase):
+    """Test cases to verify the children of each parent are requested concurrently and checkpointed per parent"""
+
+    config = {'start_date': '2021-01-01T00:00:00Z'}
+
+    def sync(self, state, config=None):
+        stream = PaymentMethods(RechargeClient('test_access_token'))
+        return stream.sync(state, {}, {}, config or self.config, mock.Mock(transform=mock_transform))
+
+    @mock.patch('tap_recharge.client.RechargeClient.get', side_effect=get)
+    def test_sync(self, mocked_get, mocked_write_record, mocked_write_state):
+        state = self.sync({})
+
+        # The children are written in the parent order, each parent requested once
+        self.assertEqual([call.args[1]['id'] for call in mocked_write_record.mock_calls], [10, 11, 20, 21, 30, 31])
+        self.assertEqual(len([call for call in mocked_get.mock_calls if call.args[0] == 'customers/2/payment_methods']), 2)
+        self.assertEqual(state, {'bookmarks': {'payment_methods': '2021-10-03T00:00:00.000000Z'}})
+        self.assertEqual(mocked_get.mock_calls[0].kwargs['params']['sort_by'], 'updated_at-asc')
+
+    @mock.patch('tap_recharge.client.RechargeClient.get', side_effect=get)
+    def test_checkpoint_per_parent(self, mocked_get, mocked_write_record, mocked_write_state):
+        written_states = []
+        mocked_write_state.side_effect = lambda state: written_states.append(copy.deepcopy(state))
+
+        self.sync({}, dict(self.config, checkpoint_records=1))
+
+        self.assertEqual(written_states[0], {
+            'bookmarks': {'payment_methods': '2021-10-01T00:00:00.000000Z'},
+            'parents': {'payment_methods': [1]}})
+        self.assertEqual(written_states[1]['parents'], {'payment_methods': [2]})
+        self.assertNotIn('parents', written_states[-1])
+
+    @mock.patch('tap_recharge.client.RechargeClient.get', side_effect=get)
+    def test_resume(self, mocked_get, mocked_write_record, mocked_write_state):
+        state = {
+            'bookmarks': {'payment_methods': '2021-10-02T00:00:00.000000Z'},
+            'parents': {'payment_methods': [2]}}
+
+        self.sync(state)
+
+        # The parents older than the bookmark are filtered by the API, the ones synced at it are skipped
+        self.assertEqual(mocked_get.mock_calls[0].kwargs['params']['updated_at_min'].isoformat(), '2021-10-02T00:00:00+00:00')
+        self.assertEqual([call.args[1]['id'] for call in mocked_write_record.mock_calls], [10, 11, 30, 31])
+
+    @mock.patch('tap_recharge.client.RechargeClient.get')
+    def test_concurrent_requests(self, mocked_get, mocked_write_record, mocked_write_state):
+        # Every child request waits for the 3 others to be in flight
+        barrier = threading.Barrier(3)
+
+        def get_concurrently(path, url=None, params=None, **kwargs):
+            if path == 'customers':
+                return get(path, url, params)
+            barrier.wait(timeout=5)
+            return {'next_cursor': None, 'payment_methods': [{'id': int(path.split('/')[1])}]}
+        mocked_get.side_effect = get_concurrently
+
+        self.sync({}, dict(self.config, child_workers=3))
+
+        self.assertEqual([call.args[1]['id'] for call in mocked_write_record.mock_calls], [1, 2, 3])
+
+    @mock.patch('tap_recharge.client.RechargeClient.get')
+    def test_deleted_parent(self, mocked_get, mocked_write_record, mocked_write_state):
+        def get_deleted(path, url=None, params=None, **kwargs):
+            # The customer was deleted after the customers were listed
+            if path == 'customers/2/payment_methods':
+                raise RechargeNotFoundError('HTTP-error-code: 404, Error: Not Found')
+            return get(path, url, params)
+        mocked_get.side_effect = get_deleted
+
+        state = self.sync({})
+
+        self.assertEqual([call.args[1]['id'] for call in mocked_write_record.mock_calls], [10, 11, 30, 31])
+        self.assertEqual(state, {'bookmarks': {'payment_methods': '2021-10-03T00:00:00.000000Z'}})
+
+    @mock.patch('tap_recharge.client.RechargeClient.get')
+    def test_child_error(self, mocked_get, mocked_write_record, mocked_write_state):
+        def get_failing(path, url=None, params=None, **kwargs):
+            if path == 'customers/2/payment_methods':
+                raise RechargeBadRequestError('HTTP-error-code: 400, Error: Bad Request')
+            return get(path, url, params)
+        mocked_get.side_effect = get_failing
+
+        with self.assertRaises(RechargeBadRequestError):
+            self.sync({})
+
+        # Nothing is checkpointed past the failed parent
+        self.assertEqual([call.args[1]['id'] for call in mocked_write_record.mock_calls], [10, 11])
@@ -0,0 +1,120 @@
+import copy
+import decimal
+import random
+import unittest
+from parameterized import parameterized
+from singer import Transformer, metadata
+from singer.transform import SchemaMismatch
+from tap_recharge.schema import get_schemas
+from tap_recharge.transform import CompiledTransformer
+
+SCHEMAS, FIELD_METADATA = get_schemas()
+
+# Values the API may send in place of the expected type
+ODD_VALUES = [
+    None, '', 'text', '1,234', '12.50', '-3', 'false', 'True', 0, 1, -7, 2.5, 1e21, True, False,
+    decimal.Decimal('1.10'), '2021-10-01T00:00:00Z', '2021-10-01', 'not a date', [], [1, 'a'], {}, {'key': 'value'}
+]
+
+def get_value(schema, rnd, depth=0):
+    """Returns a value for the schema, an odd value one time out of ten"""
+    if rnd.random() < 0.1 or depth > 4:
+        return rnd.choice(ODD_VALUES)
+    if 'anyOf' in schema:
+        return get_value(rnd.choice(schema['anyOf']), rnd, depth + 1)
+    types = schema.get('type', [])
+    types = types if isinstance(types, list) else [types]
+    if 'object' in types:
+        record = {key: get_value(subschema, rnd, depth + 1)
+                  for key, subschema in schema.get('properties', {}).items() if rnd.random() < 0.9}
+        if rnd.random() < 0.2:
+            record['field_not_in_schema'] = {'nested': [1, 2]}
+        return record
+    if 'array' in types:
+        return [get_value(schema.get('items', {}), rnd, depth + 1) for _ in range(rnd.randint(0, 3))]
+    if schema.get('format') == 'date-time':
+        return rnd.choice(['2021-10-01T12:30:00.000000Z', '2021-10-01T12:30:00+02:00', '2021-10-01'])
+    if 'integer' in types:
+        return rnd.choice([rnd.randint(0, 10**6), str(rnd.randint(0, 10**6))])
+    if 'number' in types:
+        return rnd.choice([rnd.random() * 100, str(rnd.random()), '1,000.5'])
+    if 'boolean' in types:
+        return rnd.choice([True, False, 'false', 1])
+    return rnd.choice(['value', 'ünïcode  ', 42])
+
+def transform(transformer, record, schema, mdata):
+    """Returns the transformed record, or the class of the raised error"""
+    try:
+        return transformer.transform(record, schema, mdata)
+    except (SchemaMismatch, KeyError) as err:
+        return type(err)
+
+class TestCompiledTransform(unittest.TestCase):
+    """Test cases to verify the compiled transform writes the same records as the singer Transformer"""
+
+    def assert_same_records(self, schema, mdata, records):
+        with Transformer() as expected_transformer, Transformer() as singer_transformer:
+            compiled_transformer = CompiledTransformer(singer_transformer)
+            for record in records:
+                self.assertEqual(
+                    transform(compiled_transformer, copy.deepcopy(record), schema, mdata),
+                    # The Transformer changes the record and the schema it is given
+                    transform(expected_transformer, copy.deepcopy(record), copy.deepcopy(schema), mdata),
+                    record)
+                # A SchemaMismatch reports every error of the Transformer, a failed sync stops at the first
+                expected_transformer.errors.clear()
+                singer_transformer.errors.clear()
+
+            self.assertEqual(singer_transformer.removed, expected_transformer.removed)
+            self.assertEqual(singer_transformer.filtered, expected_transformer.filtered)
+
+    @parameterized.expand(sorted(SCHEMAS))
+    def test_recorded_fixtures(self, stream_name):
+        rnd = random.Random(stream_name)
+        schema = SCHEMAS[stream_name]
+        mdata = metadata.to_map(FIELD_METADATA[stream_name])
+
+        self.assert_same_records(schema, mdata, [get_value(schema, rnd, depth=-10) for _ in range(200)])
+
+    @parameterized.expand(sorted(SCHEMAS))
+    def test_deselected_fields(self, stream_name):
+        rnd = random.Random(stream_name)
+        schema = SCHEMAS[stream_name]
+        mdata = metadata.to_map(copy.deepcopy(FIELD_METADATA[stream_name]))
+        for breadcrumb in list(mdata):
+            if breadcrumb and rnd.random() < 0.3:
+                mdata = metadata.write(mdata, breadcrumb, 'selected', False)
+            elif breadcrumb and rnd.random() < 0.1:
+                mdata = metadata.write(mdata, breadcrumb, 'inclusion', 'unsupported')
+
+        self.assert_same_records(schema, mdata, [get_value(schema, rnd, depth=-10) for _ in range(50)])
+
+    def test_schema_mismatch(self):
+        schema = {'type': 'object', 'properties': {'id': {'type': 'integer'}}}
+
+        with Transformer() as singer_transformer:
+            with self.assertRaises(SchemaMismatch):
+                CompiledTransformer(singer_transformer).transform({'id': 'not an integer'}, schema)
+
+    def test_record_not_changed(self):
+        schema = {'type': 'object', 'properties': {'id': {'type': 'integer'}, 'name': {'type': 'string'}}}
+        mdata = {('properties', 'name'): {'selected': False}}
+        record = {'id': '1', 'name': 'name', 'extra': True}
+
+        with Transformer() as singer_transformer:
+            transformed = CompiledTransformer(singer_transformer).transform(record, schema, mdata)
+
+        self.assertEqual(transformed, {'id': 1})
+        self.assertEqual(record, {'id': '1', 'name': 'name', 'extra': True})
+
+    def test_pre_hook(self):
+        schema = {'type': 'object', 'properties': {'name': {'type': 'string'}}}
+
+        def pre_hook(data, typ, schema):
+            return data.upper() if typ == 'string' else data
+
+        # The Transformer options the compiler does not handle are left to the Transformer
+        with Transformer(pre_hook=pre_hook) as singer_transformer:
+            transformed = CompiledTransformer(singer_transformer).transform({'name': 'name'}, schema)
+
+        self.assertEqual(transformed, {'name': 'NAME'})
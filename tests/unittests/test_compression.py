@@ -0,0 +1,142 @@
+import asyncio
+import gzip
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from parameterized import parameterized
+from tap_recharge.async_client import AsyncRechargeClient, is_async_supported
+from tap_recharge.client import RechargeClient
+from tap_recharge.compression import TransferStats, get_accept_encoding
+
+PAGE = json.dumps({
+    'next_cursor': None,
+    'charges': [{'id': index, 'status': 'success', 'updated_at': '2021-10-01T00:00:00Z'} for index in range(500)]
+}).encode('utf-8')
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers with a page, gzipped when the request accepts it"""
+    protocol_version = 'HTTP/1.1'
+    accept_encodings = []
+
+    def do_GET(self): # pylint: disable=invalid-name
+        accept_encoding = self.headers.get('Accept-Encoding', '')
+        self.accept_encodings.append(accept_encoding)
+        data = PAGE
+        self.send_response(200)
+        if 'gzip' in accept_encoding:
+            data = gzip.compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+class TestAcceptEncoding(unittest.TestCase):
+    """Test cases to verify the Accept-Encoding header of each compression config"""
+
+    @parameterized.expand([
+        ['default', None, 'gzip, deflate'],
+        ['auto', 'auto', 'gzip, deflate'],
+        ['gzip', 'gzip', 'gzip'],
+        ['none', 'none', 'identity'],
+        ['false', 'false', 'identity'],
+    ])
+    @mock.patch('tap_recharge.compression.brotli', None)
+    def test_accept_encoding(self, name, compression, expected_accept_encoding):
+        self.assertEqual(get_accept_encoding(compression), expected_accept_encoding)
+
+    @mock.patch('tap_recharge.compression.brotli', mock.Mock())
+    def test_brotli_accepted_when_installed(self):
+        self.assertEqual(get_accept_encoding('auto'), 'br, gzip, deflate')
+        self.assertEqual(get_accept_encoding('br'), 'br')
+
+    @mock.patch('tap_recharge.compression.brotli', None)
+    def test_invalid_compression(self):
+        with self.assertRaises(ValueError):
+            get_accept_encoding('br')
+        with self.assertRaises(ValueError):
+            get_accept_encoding('zip')
+
+class TestTransferStats(unittest.TestCase):
+    """Test cases to verify the bytes of each endpoint are summed with their compression ratio"""
+
+    @mock.patch('singer.metrics.log')
+    def test_summary(self, mocked_log):
+        stats = TransferStats()
+        stats.add('charges', 'gzip', 100, 800)
+        stats.add('charges', 'identity', 300, 300)
+
+        self.assertEqual(stats.get_summary(), [{
+            'endpoint': 'charges', 'responses': 2, 'compressed': 1,
+            'wire_bytes': 400, 'decoded_bytes': 1100, 'ratio': 2.75}])
+
+        stats.log_metrics()
+        counters = {call.args[1].metric: call.args[1].value for call in mocked_log.mock_calls}
+        self.assertEqual(counters, {'bytes_on_wire': 400, 'decoded_bytes': 1100})
+
+class TestCompressedTransfer(unittest.TestCase):
+    """Test cases to verify the compressed pages are decoded and their bytes counted"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}/'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        Handler.accept_encodings = []
+
+    def test_gzip(self):
+        client = RechargeClient('test_access_token', base_url=self.base_url, compression='gzip')
+
+        self.assertEqual(client.get('charges'), json.loads(PAGE))
+
+        self.assertEqual(Handler.accept_encodings[-1], 'gzip')
+        stats = client.transfer_stats.get_summary()[0]
+        self.assertEqual(stats['compressed'], 1)
+        self.assertEqual(stats['wire_bytes'], len(gzip.compress(PAGE)))
+        self.assertEqual(stats['decoded_bytes'], len(PAGE))
+
+    def test_streaming_parse(self):
+        client = RechargeClient('test_access_token', base_url=self.base_url, compression='gzip')
+
+        page = client.get('charges', stream_key='charges')
+
+        # The body is decompressed as the records are parsed
+        self.assertEqual(list(page.get('charges')), json.loads(PAGE)['charges'])
+        stats = client.transfer_stats.get_summary()[0]
+        self.assertEqual(stats['responses'], 1)
+        self.assertEqual(stats['wire_bytes'], len(gzip.compress(PAGE)))
+        self.assertEqual(stats['decoded_bytes'], len(PAGE))
+
+    def test_no_compression(self):
+        client = RechargeClient('test_access_token', base_url=self.base_url, compression='none')
+
+        client.get('charges')
+
+        self.assertEqual(Handler.accept_encodings[-1], 'identity')
+        stats = client.transfer_stats.get_summary()[0]
+        self.assertEqual((stats['compressed'], stats['wire_bytes'], stats['ratio']), (0, len(PAGE), 1.0))
+
+    @unittest.skipUnless(is_async_supported(), 'aiohttp is not installed')
+    def test_async_client(self):
+        async def get():
+            async with AsyncRechargeClient('test_access_token', base_url=self.base_url, compression='gzip') as client:
+                return client, await client.get('charges')
+
+        client, page = asyncio.run(get())
+
+        self.assertEqual(page, json.loads(PAGE))
+        self.assertEqual(Handler.accept_encodings[-1], 'gzip')
+        stats = client.transfer_stats.get_summary()[0]
+        self.assertEqual((stats['wire_bytes'], stats['decoded_bytes']), (len(gzip.compress(PAGE)), len(PAGE)))
@@ -0,0 +1,150 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from parameterized import parameterized
+from tap_recharge.client import RechargeClient
+from tap_recharge.connection import DEFAULT_POOL_MAXSIZE, SessionReuseContext
+from tap_recharge.sync import get_pool_maxsize
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers every request with an empty page, keeping the connection open unless asked to close it"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self): # pylint: disable=invalid-name
+        data = b'{"charges": [], "next_cursor": null}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+class TestConnectionPool(unittest.TestCase):
+    """Test cases to verify the connections are reused, closed when idle and counted"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}/'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_connection_reused(self):
+        client = RechargeClient('test_access_token', base_url=self.base_url)
+        for _ in range(3):
+            client.get('charges')
+
+        stats = client.http_adapter.get_metrics()
+        # The access token check and the 3 pages
+        self.assertEqual(stats['requests'], 4)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['connections_reused'], 3)
+
+    def test_idle_connections_reaped(self):
+        client = RechargeClient('test_access_token', base_url=self.base_url, idle_connection_timeout=0.05)
+        client.get('charges')
+        time.sleep(0.1)
+        client.get('charges')
+
+        stats = client.http_adapter.get_metrics()
+        self.assertEqual(stats['idle_reaps'], 1)
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['connections_opened'], 2)
+
+    def test_idle_timeout_disabled(self):
+        client = RechargeClient('test_access_token', base_url=self.base_url, idle_connection_timeout=0)
+        client.get('charges')
+        time.sleep(0.1)
+        client.get('charges')
+
+        self.assertEqual(client.http_adapter.get_metrics()['connections_opened'], 1)
+
+    def test_keep_alive_disabled(self):
+        client = RechargeClient('test_access_token', base_url=self.base_url, keep_alive='false')
+        for _ in range(3):
+            client.get('charges')
+
+        stats = client.http_adapter.get_metrics()
+        self.assertEqual(stats['connections_opened'], 4)
+        self.assertEqual(stats['connections_reused'], 0)
+
+    @mock.patch('singer.metrics.log')
+    def test_metrics(self, mocked_log):
+        client = RechargeClient('test_access_token', base_url=self.base_url, tls_session_reuse='true')
+        client.get('charges')
+
+        client.http_adapter.log_metrics()
+
+        gauges = {call.args[1].metric: call.args[1].value for call in mocked_log.mock_calls}
+        self.assertEqual(gauges['connection_pool.connections_opened'], 1)
+        # Plain HTTP, no TLS handshake
+        self.assertEqual(gauges['connection_pool.tls_handshakes'], 0)
+
+class TestPoolSize(unittest.TestCase):
+    """Test cases to verify the pool is sized for the concurrency of the sync"""
+
+    @parameterized.expand([
+        ['default', {}, DEFAULT_POOL_MAXSIZE],
+        ['workers', {'max_workers': 8}, 16],
+        ['windows', {'max_workers': 4, 'backfill_windows': 4}, 32],
+        ['no_prefetch', {'max_workers': 12, 'prefetch_pages': 0}, 12],
+        ['configured', {'max_workers': 4, 'backfill_windows': 4, 'pool_maxsize': '16'}, 16],
+    ])
+    def test_pool_maxsize(self, name, config, expected_pool_maxsize):
+        self.assertEqual(get_pool_maxsize(config), expected_pool_maxsize)
+
+    def test_client_pool_maxsize(self):
+        client = RechargeClient('test_access_token', pool_maxsize='32')
+
+        self.assertEqual(client.http_adapter.get_metrics()['pool_maxsize'], 32)
+
+class TestSessionReuseContext(unittest.TestCase):
+    """Test cases to verify the TLS session of the last connection is resumed by the next one"""
+
+    @mock.patch('ssl.SSLContext.wrap_socket')
+    def test_session_resumed(self, mocked_wrap_socket):
+        first_session = mock.Mock(has_ticket=True)
+        first_socket = mock.Mock(session=first_session, session_reused=False)
+        second_socket = mock.Mock(session=first_session, session_reused=True)
+        mocked_wrap_socket.side_effect = [first_socket, second_socket]
+        context = SessionReuseContext()
+
+        context.wrap_socket(mock.Mock(), server_hostname='api.rechargeapps.com')
+        context.wrap_socket(mock.Mock(), server_hostname='api.rechargeapps.com')
+
+        self.assertIsNone(mocked_wrap_socket.mock_calls[0].kwargs['session'])
+        self.assertEqual(mocked_wrap_socket.mock_calls[1].kwargs['session'], first_session)
+        self.assertEqual((context.handshakes, context.resumed), (2, 1))
+
+    @mock.patch('ssl.SSLContext.wrap_socket')
+    def test_ticket_received_after_handshake(self, mocked_wrap_socket):
+        # The TLS 1.3 ticket is only read with the first response
+        first_socket = mock.Mock(session=mock.Mock(has_ticket=False), session_reused=False)
+        mocked_wrap_socket.side_effect = [first_socket, mock.Mock(session_reused=True)]
+        context = SessionReuseContext()
+
+        context.wrap_socket(mock.Mock(), server_hostname='api.rechargeapps.com')
+        first_socket.session = mock.Mock(has_ticket=True)
+        context.wrap_socket(mock.Mock(), server_hostname='api.rechargeapps.com')
+
+        self.assertEqual(mocked_wrap_socket.mock_calls[1].kwargs['session'], first_socket.session)
+
+    @mock.patch('ssl.SSLContext.wrap_socket')
+    def test_other_host(self, mocked_wrap_socket):
+        mocked_wrap_socket.side_effect = [
+            mock.Mock(session=mock.Mock(has_ticket=True), session_reused=False),
+            mock.Mock(session=None, session_reused=False)]
+        context = SessionReuseContext()
+
+        context.wrap_socket(mock.Mock(), server_hostname='api.rechargeapps.com')
+        context.wrap_socket(mock.Mock(), server_hostname='example.com')
+
+        self.assertIsNone(mocked_wrap_socket.mock_calls[1].kwargs['session'])
@@ -0,0 +1,102 @@
+import copy
+import datetime
+import unittest
+from unittest import mock
+from tap_recharge.client import RechargeClient, RechargeBadRequestError
+from tap_recharge.streams import Addresses, MetafieldsStore, get_recharge_cursor, write_recharge_cursor
+
+NOW = datetime.datetime(2021, 10, 12, tzinfo=datetime.timezone.utc)
+
+def mock_transform(*args, **kwargs):
+    """Mocked transformer function which returns the first argument received"""
+    return args[0]
+
+def get(page, *args, **kwargs):
+    """
+        Function to return API response with 'next_cursor' for 2 responses and last response without 'next_cursor'
+    """
+    response = {'next_cursor': f'next_cursor_{page}', 'addresses': [{'id': page, 'updated_at': f'2021-10-0{page}T00:00:00.000000Z'}]}
+    if page == 3:
+        response['next_cursor'] = None
+    return response
+
+def saved_cursor(created_at='2021-10-11T00:00:00.000000Z'):
+    return {
+        'cursor': 'next_cursor_1',
+        'created_at': created_at,
+        'query': {'sort_by': 'updated_at-asc', 'updated_at_min': '2021-01-01T00:00:00.000000Z'}}
+
+class TestRechargeCursorState(unittest.TestCase):
+    """Test cases to verify the cursor is written next to the bookmarks"""
+
+    def test_write_and_get_cursor(self):
+        state = write_recharge_cursor({}, 'addresses', saved_cursor())
+        self.assertEqual(get_recharge_cursor(state, 'addresses'), saved_cursor())
+
+    def test_remove_cursor(self):
+        state = write_recharge_cursor({'cursors': {'addresses': saved_cursor()}}, 'addresses', None)
+        self.assertEqual(state, {})
+
+@mock.patch('tap_recharge.streams.utils.now', return_value=NOW)
+@mock.patch('singer.write_state')
+@mock.patch('singer.write_record')
+class TestCursorResume(unittest.TestCase):
+    """Test cases to verify an interrupted sync resumes from the saved cursor"""
+
+    config = {'start_date': '2021-01-01T00:00:00Z'}
+
+    @mock.patch('tap_recharge.client.RechargeClient.request', side_effect=[get(1), get(2), get(3)])
+    def test_checkpoint_saves_cursor(self, mocked_request, mocked_write_record, mocked_write_state, mocked_now):
+        written_states = []
+        mocked_write_state.side_effect = lambda state: written_states.append(copy.deepcopy(state))
+        config = dict(self.config, checkpoint_records=1)
+
+        state = Addresses(RechargeClient('test_access_token')).sync({}, {}, {}, config, mock.Mock(transform=mock_transform))
+
+        # The checkpoint holds the cursor of the page being synced
+        self.assertNotIn('cursors', written_states[0])
+        self.assertEqual(written_states[1]['cursors']['addresses'], {
+            'cursor': 'next_cursor_1',
+            'created_at': '2021-10-12T00:00:00.000000Z',
+            'query': {'sort_by': 'updated_at-asc', 'updated_at_min': '2021-01-01T00:00:00.000000Z'}})
+        # The cursor is removed once the stream is synced
+        self.assertEqual(state, {'bookmarks': {'addresses': '2021-10-03T00:00:00.000000Z'}})
+
+    @mock.patch('tap_recharge.client.RechargeClient.request', side_effect=[get(2), get(3)])
+    def test_resume_from_saved_cursor(self, mocked_request, mocked_write_record, mocked_write_state, mocked_now):
+        state = {'cursors': {'addresses': saved_cursor()}}
+
+        Addresses(RechargeClient('test_access_token')).sync(state, {}, {}, self.config, mock.Mock(transform=mock_transform))
+
+        self.assertEqual(mocked_request.call_count, 2)
+        self.assertEqual(mocked_request.mock_calls[0], mock.call('GET', path='addresses', url=None, params={'cursor': 'next_cursor_1', 'limit': 250}))
+
+    @mock.patch('tap_recharge.client.RechargeClient.request', side_effect=[get(1), get(2), get(3)])
+    def test_expired_cursor(self, mocked_request, mocked_write_record, mocked_write_state, mocked_now):
+        state = {'cursors': {'addresses': saved_cursor('2021-10-01T00:00:00.000000Z')}}
+
+        Addresses(RechargeClient('test_access_token')).sync(state, {}, {}, self.config, mock.Mock(transform=mock_transform))
+
+        self.assertEqual(mocked_request.call_count, 3)
+        self.assertNotIn('cursor', mocked_request.mock_calls[0].kwargs['params'])
+
+    @mock.patch('tap_recharge.client.RechargeClient.request', side_effect=[get(1), get(2), get(3)])
+    def test_cursor_of_other_query(self, mocked_request, mocked_write_record, mocked_write_state, mocked_now):
+        state = {'cursors': {'metafields_store': saved_cursor()}}
+
+        stream = MetafieldsStore(RechargeClient('test_access_token'))
+        stream.data_key = 'addresses'
+        stream.sync(state, {}, {}, self.config, mock.Mock(transform=mock_transform))
+
+        self.assertEqual(mocked_request.call_count, 3)
+
+    @mock.patch('tap_recharge.client.RechargeClient.request', side_effect=[RechargeBadRequestError('invalid cursor'), get(1), get(2), get(3)])
+    def test_rejected_cursor(self, mocked_request, mocked_write_record, mocked_write_state, mocked_now):
+        state = {'cursors': {'addresses': saved_cursor()}}
+
+        state = Addresses(RechargeClient('test_access_token')).sync(state, {}, {}, self.config, mock.Mock(transform=mock_transform))
+
+        # Falls back to the bookmark query after the API rejects the cursor
+        self.assertEqual(mocked_request.call_count, 4)
+        self.assertEqual(mocked_write_record.call_count, 3)
+        self.assertEqual(state, {'bookmarks': {'addresses': '2021-10-03T00:00:00.000000Z'}})
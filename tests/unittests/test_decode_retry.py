@@ -0,0 +1,136 @@
+import json
+import unittest
+from unittest import mock
+from parameterized import parameterized
+from requests.exceptions import ChunkedEncodingError
+from tap_recharge.client import RechargeClient, RechargeMalformedResponseError, RechargeTruncatedResponseError, \
+    get_decode_error, get_retry_delay
+from tap_recharge.json_stream import StreamingPage, TruncatedPageError
+from tap_recharge.streams import Charges, PageLimit
+
+PAGE = {'charges': [{'id': 1}, {'id': 2}, {'id': 3}], 'next_cursor': None}
+BODY = json.dumps(PAGE).encode('utf-8')
+
+def get_response(content, headers=None):
+    return mock.Mock(status_code=200, headers=headers or {}, content=content)
+
+class MockStreamedResponse:
+    def __init__(self, chunks):
+        self.status_code = 200
+        self.headers = {}
+        self.chunks = chunks
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def close(self):
+        pass
+
+class TestDecodeError(unittest.TestCase):
+    """Test cases to verify a truncated body is told apart from malformed content"""
+
+    @parameterized.expand([
+        ['empty_body', b'', {}, RechargeTruncatedResponseError],
+        ['cut_in_array', BODY[:20], {}, RechargeTruncatedResponseError],
+        ['cut_in_string', b'{"charges": [{"note": "abc', {}, RechargeTruncatedResponseError],
+        ['cut_in_literal', b'{"next_cursor": nu', {}, RechargeTruncatedResponseError],
+        ['short_content_length', b'{"a": 1}x', {'Content-Length': '100'}, RechargeTruncatedResponseError],
+        ['html', b'<html>Bad gateway</html>', {}, RechargeMalformedResponseError],
+        ['extra_data', b'{"a": 1}}', {}, RechargeMalformedResponseError],
+        ['compressed_content_length', b'{"a": 1}x', {'Content-Length': '100', 'Content-Encoding': 'gzip'}, RechargeMalformedResponseError],
+    ])
+    def test_get_decode_error(self, name, content, headers, expected_error):
+        try:
+            json.loads(content)
+        except ValueError as err:
+            error = get_decode_error(get_response(content, headers), err)
+
+        self.assertIs(type(error), expected_error)
+
+    @mock.patch('tap_recharge.client.random.uniform', side_effect=lambda low, high: high)
+    def test_retry_delay(self, mocked_uniform):
+        self.assertEqual([get_retry_delay(attempt) for attempt in range(1, 8)], [2, 4, 8, 16, 32, 60, 60])
+
+    def test_truncated_streamed_page(self):
+        with self.assertRaises(TruncatedPageError):
+            list(StreamingPage([BODY[:25]], 'charges'))
+        with self.assertRaises(ValueError) as err:
+            list(StreamingPage([b'{"charges": [{"id": 1}}'], 'charges'))
+        self.assertNotIsInstance(err.exception, TruncatedPageError)
+
+@mock.patch('time.sleep')
+@mock.patch('tap_recharge.client.RechargeClient.check_access_token')
+@mock.patch('requests.Session.request')
+class TestDecodeRetry(unittest.TestCase):
+    """Test cases to verify the request is retried within the budget after a decode error"""
+
+    def test_truncated_body_recovers(self, mocked_request, mocked_check_access_token, mocked_sleep):
+        mocked_request.side_effect = [get_response(BODY[:10]), get_response(BODY[:30]), get_response(BODY)]
+
+        self.assertEqual(RechargeClient('test_access_token').get('charges'), PAGE)
+        self.assertEqual(mocked_sleep.call_count, 2)
+
+    def test_truncated_body_budget(self, mocked_request, mocked_check_access_token, mocked_sleep):
+        mocked_request.return_value = get_response(BODY[:10])
+
+        with self.assertRaises(RechargeTruncatedResponseError):
+            RechargeClient('test_access_token', decode_retries='2').get('charges')
+        self.assertEqual(mocked_request.call_count, 3)
+
+    def test_malformed_body_retried_once(self, mocked_request, mocked_check_access_token, mocked_sleep):
+        mocked_request.return_value = get_response(b'<html>Bad gateway</html>')
+
+        with self.assertRaises(RechargeMalformedResponseError):
+            RechargeClient('test_access_token').get('charges')
+        self.assertEqual(mocked_request.call_count, 2)
+
+    def test_no_retries(self, mocked_request, mocked_check_access_token, mocked_sleep):
+        mocked_request.return_value = get_response(BODY[:10])
+
+        with self.assertRaises(RechargeTruncatedResponseError):
+            RechargeClient('test_access_token', decode_retries=0).get('charges')
+        self.assertEqual(mocked_request.call_count, 1)
+
+    def test_smaller_page_for_same_cursor(self, mocked_request, mocked_check_access_token, mocked_sleep):
+        requested_params = []
+        responses = [get_response(BODY[:10]), get_response(BODY)]
+
+        def request(*args, **kwargs):
+            requested_params.append(dict(kwargs['params']))
+            return responses.pop(0)
+
+        mocked_request.side_effect = request
+        stream = Charges(RechargeClient('test_access_token'))
+        stream.page_limit = PageLimit(250, adaptive=True)
+
+        self.assertEqual(list(stream.get_pages({}, 'cursor_1'))[0][1], PAGE['charges'])
+        self.assertEqual(requested_params, [{'cursor': 'cursor_1', 'limit': 250}, {'cursor': 'cursor_1', 'limit': 125}])
+
+    def test_streamed_page_recovers(self, mocked_request, mocked_check_access_token, mocked_sleep):
+        mocked_request.side_effect = [
+            # The connection drops after the first record
+            MockStreamedResponse([BODY[:27], ChunkedEncodingError('Connection broken')]),
+            # The second attempt is cut after the second record
+            MockStreamedResponse([BODY[:37]]),
+            MockStreamedResponse([BODY])]
+        stream = Charges(RechargeClient('test_access_token'))
+        stream.streaming_parse = True
+
+        # Records synced before the errors are not synced again
+        self.assertEqual(list(stream.get_records()), PAGE['charges'])
+        self.assertEqual(mocked_request.call_count, 3)
+        self.assertEqual(mocked_request.mock_calls[0], mocked_request.mock_calls[2])
+
+    def test_streamed_page_budget(self, mocked_request, mocked_check_access_token, mocked_sleep):
+        mocked_request.side_effect = lambda *args, **kwargs: MockStreamedResponse([BODY[:27]])
+        stream = Charges(RechargeClient('test_access_token', decode_retries=1))
+        stream.streaming_parse = True
+        records = []
+
+        with self.assertRaises(RechargeTruncatedResponseError):
+            records.extend(stream.get_records())
+        self.assertEqual(records, [{'id': 1}])
+        self.assertEqual(mocked_request.call_count, 2)
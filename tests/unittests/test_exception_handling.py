@@ -1,3 +1,4 @@
+import json
 import unittest
 from parameterized import parameterized
 from unittest import mock
@@ -12,6 +13,10 @@ class MockResponse:
         self.text = json
         self.links = {}
 
+    @property
+    def content(self):
+        return json.dumps(self.text).encode('utf-8')
+
     def json(self):
         return self.text
 
@@ -0,0 +1,162 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import singer
+from tap_recharge.client import RechargeCacheMissError, RechargeClient, RechargeMalformedResponseError
+from tap_recharge.http_cache import ResponseCache, get_request_key
+from tap_recharge.streams import Charges
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers every request with the same page"""
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    data = b'{"charges": [{"id": 1}], "next_cursor": null}'
+
+    def do_GET(self): # pylint: disable=invalid-name
+        self.requests.append(self.path)
+        data = self.data
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+class TestResponseCache(unittest.TestCase):
+    """Test cases to verify the pages of a sync are recorded and replayed offline"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}/'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        Handler.requests = []
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def get_client(self, mode):
+        return RechargeClient('test_access_token', base_url=self.base_url, response_cache=ResponseCache(self.cache_dir, mode))
+
+    def test_replay(self):
+        params = {'updated_at_min': datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc), 'limit': 250}
+        with self.get_client('record') as client:
+            recorded = client.get('charges', params=params)
+        Handler.requests = []
+
+        with self.get_client('replay') as client:
+            with mock.patch.object(client.rate_limiter, 'acquire') as mocked_acquire:
+                replayed = client.get('charges', params=params)
+
+        self.assertEqual(replayed, recorded)
+        # Neither the access token check nor the page reach the API, nor wait for the rate limit
+        self.assertEqual(Handler.requests, [])
+        mocked_acquire.assert_not_called()
+        self.assertEqual(client.response_cache.get_metrics(), {'hits': 1, 'misses': 0, 'stored': 0})
+
+    def test_replay_streaming_page(self):
+        with self.get_client('record') as client:
+            page = client.get('charges', params={'cursor': 'abc'}, stream_key='charges')
+            self.assertEqual(list(page.get('charges')), [{'id': 1}])
+
+        with self.get_client('replay') as client:
+            page = client.get('charges', params={'cursor': 'abc'}, stream_key='charges')
+
+        self.assertEqual(list(page.get('charges')), [{'id': 1}])
+        self.assertIsNone(page.get('next_cursor'))
+
+    def test_replay_miss(self):
+        with self.get_client('record') as client:
+            client.get('charges', params={'cursor': 'abc'})
+
+        with self.get_client('replay') as client:
+            with self.assertRaises(RechargeCacheMissError):
+                client.get('charges', params={'cursor': 'def'})
+
+    def test_bodies_stored_once(self):
+        with self.get_client('record') as client:
+            client.get('charges', params={'cursor': 'abc'})
+            client.get('charges', params={'cursor': 'def'})
+
+        self.assertEqual(len(os.listdir(os.path.join(self.cache_dir, 'requests'))), 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.cache_dir, 'bodies'))), 1)
+
+    @mock.patch('tap_recharge.client.get_retry_delay', return_value=0)
+    def test_malformed_body_not_recorded(self, mocked_get_retry_delay):
+        client = self.get_client('record')
+        mocked_response = mock.Mock(status_code=200, headers={}, content=b'{"charges": [')
+        with mock.patch('requests.Session.request', return_value=mocked_response):
+            with self.assertRaises(RechargeMalformedResponseError):
+                client.get('charges')
+
+        self.assertEqual(client.response_cache.get_metrics()['stored'], 0)
+
+    def test_from_config(self):
+        self.assertIsNone(ResponseCache.from_config({}))
+        self.assertEqual(ResponseCache.from_config({'http_cache_dir': self.cache_dir}).mode, 'record')
+        self.assertTrue(ResponseCache.from_config({'http_cache_dir': self.cache_dir, 'http_cache_mode': 'Replay'}).replaying)
+        with self.assertRaises(ValueError):
+            ResponseCache(self.cache_dir, 'refresh')
+
+    def test_request_key(self):
+        # The values are keyed as they are sent, the page size is left out
+        self.assertEqual(
+            get_request_key('get', 'charges', {'limit': 250, 'cursor': None, 'sort_by': 'updated_at-asc'}),
+            {'method': 'GET', 'path': 'charges', 'params': {'sort_by': 'updated_at-asc'}, 'body': None})
+        self.assertEqual(
+            get_request_key('get', 'charges', {'limit': 125, 'cursor': 'abc'}),
+            get_request_key('get', 'charges', {'limit': 250, 'cursor': 'abc'}))
+
+    def test_clock(self):
+        recording = ResponseCache(self.cache_dir, 'record')
+        recorded_now = recording.get_now()
+        # Fixed for the whole sync
+        self.assertEqual(recording.get_now(), recorded_now)
+
+        with mock.patch('singer.utils.now', return_value=recorded_now + datetime.timedelta(days=1)):
+            self.assertEqual(ResponseCache(self.cache_dir, 'replay').get_now(), recorded_now)
+
+    @mock.patch('singer.write_state')
+    @mock.patch('singer.write_record')
+    def test_replay_backfill(self, mocked_write_record, mocked_write_state):
+        self.addCleanup(setattr, Handler, 'data', Handler.data)
+        updated_at = singer.utils.strftime(singer.utils.now() - datetime.timedelta(hours=12))
+        Handler.data = f'{{"charges": [{{"id": 1, "updated_at": "{updated_at}"}}], "next_cursor": null}}'.encode('utf-8')
+        start_date = singer.utils.strftime(singer.utils.now() - datetime.timedelta(days=4))
+        config = {'start_date': start_date, 'backfill_windows': 4, 'adaptive_page_size': True}
+
+        def sync(mode):
+            with self.get_client(mode) as client:
+                return Charges(client).sync({}, {}, {}, config, mock.Mock(transform=lambda record, *args: record))
+
+        recorded_state = sync('record')
+        recorded_records = mocked_write_record.mock_calls
+        # One page per window
+        self.assertEqual(len(recorded_records), 4)
+        self.assertEqual(len([path for path in Handler.requests if path.startswith('/charges')]), 4)
+        Handler.requests = []
+        mocked_write_record.reset_mock()
+
+        # Replayed later, the windows are split at the time of the recording
+        later = singer.utils.now() + datetime.timedelta(hours=2)
+        with mock.patch('singer.utils.now', return_value=later):
+            replayed_state = sync('replay')
+
+        self.assertEqual(Handler.requests, [])
+        self.assertEqual(replayed_state, recorded_state)
+        self.assertEqual(mocked_write_record.mock_calls, recorded_records)
@@ -0,0 +1,118 @@
+import io
+import json
+import unittest
+from decimal import Decimal
+import singer
+from unittest import mock
+from parameterized import parameterized
+from tap_recharge.client import RechargeClient
+from tap_recharge.json_backend import JsonBackend, OrjsonBackend, OrjsonLoadsBackend, dumps_compact, get_json_backend, orjson
+from tap_recharge.writer import MessageWriter
+
+RECORDS = [
+    {'id': 1, 'total_price': '10.00', 'tax_lines': 0.0825, 'is_prepaid': False, 'note': None},
+    {'id': 2, 'line_items': [{'title': 'Café ☕ 日本', 'quantity': 2, 'price': 12.5}], 'tags': []},
+    {'id': 3, 'note': 'a "quoted"\ttab\nnew line \\ back\x01slash \u2028 \u2029 /', 'emoji': '🙂'},
+    {'id': 2 ** 70, 'price': Decimal('1.10')},
+    {'id': 4, 'small': 1e-07, 'large': 1e+16, 'negative': -2.5e-10, 'text': '1e5 is not a number'},
+    {'id': 5, 'nested': {'a': {'b': [1, 2.0, {'c': True}]}}, 'max': 9007199254740993, 'float': 0.1 + 0.2},
+    # orjson writes plain decimals where repr() uses an exponent
+    {'id': 6, 'rates': [1e-05, 1.5000000000000002e-05, -9.999999999999999e-05, 0.0001, 9999999999999998.0]},
+    {'id': 7, 'nan': float('nan'), 'inf': float('inf'), 'negative_inf': float('-inf'), 'zero': -0.0},
+]
+
+@unittest.skipIf(orjson is None, 'orjson is not installed')
+class TestJsonBackends(unittest.TestCase):
+    """Test cases to verify the orjson backend writes the same bytes as the compact reference encoder"""
+
+    @parameterized.expand([[f'record_{index}', record] for index, record in enumerate(RECORDS)])
+    def test_byte_identical_dumps(self, name, record):
+        message = {'type': 'RECORD', 'stream': 'charges', 'record': record}
+
+        self.assertEqual(
+            OrjsonBackend.dumps(message).encode('utf-8'),
+            dumps_compact(message).encode('utf-8'))
+
+    def test_byte_identical_floats(self):
+        # Every power of ten of a double, and values around the bounds of plain decimals
+        values = [sign * mantissa * 10.0 ** exponent
+                  for sign in (1, -1)
+                  for mantissa in (1, 1.5, 9.999999999999999)
+                  for exponent in range(-307, 308)]
+
+        self.assertEqual(OrjsonBackend.dumps(values), dumps_compact(values))
+
+    def test_byte_identical_characters(self):
+        # Every character of the basic multilingual plane, except surrogates
+        text = ''.join(chr(code) for code in range(0x10000) if not 0xd800 <= code <= 0xdfff)
+        message = {'type': 'RECORD', 'stream': 'charges', 'record': {'text': text}}
+
+        self.assertEqual(OrjsonBackend.dumps(message), dumps_compact(message))
+
+    def test_non_finite_floats(self):
+        self.assertEqual(OrjsonBackend.dumps({'a': float('nan'), 'b': float('-inf')}), '{"a":NaN,"b":-Infinity}')
+
+    def test_dumps_is_valid_json(self):
+        for record in RECORDS[:3]:
+            self.assertEqual(json.loads(OrjsonBackend.dumps(record)), record)
+
+    @parameterized.expand([
+        ['page', b'{"next_cursor": null, "charges": [{"id": 1, "price": 1.5, "title": "Caf\\u00e9"}]}'],
+        ['big_integer', b'{"id": 1180591620717411303424}'],
+        ['lone_surrogate', b'{"note": "\\ud800"}'],
+    ])
+    def test_same_loads(self, name, data):
+        self.assertEqual(OrjsonBackend.loads(data), JsonBackend.loads(data))
+        self.assertEqual(OrjsonLoadsBackend.loads(data), JsonBackend.loads(data))
+
+    def test_malformed_json(self):
+        with self.assertRaises(ValueError):
+            OrjsonBackend.loads(b'{"charges": [')
+
+    def test_get_json_backend(self):
+        self.assertIs(get_json_backend(), OrjsonLoadsBackend)
+        self.assertIs(get_json_backend('auto'), OrjsonLoadsBackend)
+        self.assertIs(get_json_backend('orjson'), OrjsonBackend)
+        self.assertIs(get_json_backend('json'), JsonBackend)
+        with self.assertRaises(ValueError):
+            get_json_backend('ujson')
+
+    @mock.patch('tap_recharge.json_backend.orjson', None)
+    def test_fallback_without_orjson(self):
+        self.assertIs(get_json_backend(), JsonBackend)
+        with self.assertRaises(ValueError):
+            get_json_backend('orjson')
+
+@unittest.skipIf(orjson is None, 'orjson is not installed')
+class TestJsonBackendOutput(unittest.TestCase):
+    """Test cases to verify the client and the writer use the configured backend"""
+
+    @mock.patch('tap_recharge.client.RechargeClient.check_access_token')
+    @mock.patch('requests.Session.request')
+    def test_client_decodes_content(self, mocked_request, mocked_check_access_token):
+        mocked_request.return_value = mock.Mock(status_code=200, headers={}, content=b'{"charges": [{"id": 1}]}')
+
+        for backend in ['json', 'orjson']:
+            client = RechargeClient('test_access_token', json_backend=backend)
+            self.assertEqual(client.get('charges'), {'charges': [{'id': 1}]})
+
+    @parameterized.expand([
+        ['auto', '{"type": "RECORD", "stream": "charges", "record": {"id": 1, "note": "Caf\\u00e9"}}\n'],
+        ['json', '{"type": "RECORD", "stream": "charges", "record": {"id": 1, "note": "Caf\\u00e9"}}\n'],
+        ['orjson', '{"type":"RECORD","stream":"charges","record":{"id":1,"note":"Café"}}\n'],
+    ])
+    def test_record_message(self, backend, expected_line):
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            MessageWriter(get_json_backend(backend)).write_record('charges', {'id': 1, 'note': 'Café'})
+
+        self.assertEqual(stdout.getvalue(), expected_line)
+
+    @parameterized.expand([
+        [f'{backend}_record_{index}', backend, record]
+        for backend in ['auto', 'json']
+        for index, record in enumerate(RECORDS)])
+    def test_writes_singer_lines(self, name, backend, record):
+        # The default backend and the json backend write the bytes of singer.write_record
+        self.assertEqual(
+            MessageWriter(get_json_backend(backend)).format_record('charges', record).encode('utf-8'),
+            singer.format_message(singer.RecordMessage(stream='charges', record=record)).encode('utf-8'))
@@ -0,0 +1,131 @@
+import unittest
+from unittest import mock
+from singer import Catalog
+from tap_recharge.client import RechargeClient, RechargeUnprocessableEntityError
+from tap_recharge.sync import get_sync_groups, sync
+
+METAFIELDS = [
+    {'id': 1, 'owner_resource': 'store', 'updated_at': '2021-09-01T00:00:00.000000Z'},
+    {'id': 2, 'owner_resource': 'customer', 'updated_at': '2021-09-02T00:00:00.000000Z'},
+    {'id': 3, 'owner_resource': 'subscription', 'updated_at': '2021-09-03T00:00:00.000000Z'},
+    {'id': 4, 'owner_resource': 'customer', 'updated_at': '2021-10-04T00:00:00.000000Z'},
+    {'id': 5, 'owner_resource': 'store', 'updated_at': '2021-10-05T00:00:00.000000Z'},
+]
+
+def get_catalog(stream_names):
+    """Returns a catalog with every stream selected"""
+    return Catalog.from_dict({'streams': [
+        {
+            'stream': stream_name,
+            'tap_stream_id': stream_name,
+            'schema': {'type': 'object', 'properties': {
+                'id': {'type': 'integer'}, 'owner_resource': {'type': 'string'}, 'updated_at': {'type': 'string'}}},
+            'metadata': [{'breadcrumb': [], 'metadata': {'selected': True}}]
+        } for stream_name in stream_names]})
+
+def get(path, params=None, **kwargs):
+    """Mocked 'RechargeClient.get' serving the metafields in 2 pages, filtered like the API"""
+    records = [record for record in METAFIELDS
+               if record['owner_resource'] == params.get('owner_resource', record['owner_resource'])]
+    if params.get('cursor'):
+        return {'next_cursor': None, 'metafields': records[3:]}
+    return {'next_cursor': 'next_cursor_1' if len(records) > 3 else None, 'metafields': records[:3]}
+
+def get_written_records(mocked_write_record):
+    written_records = {}
+    for call in mocked_write_record.mock_calls:
+        written_records.setdefault(call.args[0], []).append(call.args[1]['id'])
+    return written_records
+
+class TestSyncGroups(unittest.TestCase):
+    """Test cases to verify the selected metafields streams are synced together"""
+
+    def test_metafields_grouped(self):
+        streams = list(get_catalog(['orders', 'metafields_customer', 'charges', 'metafields_store']).streams)
+
+        groups = get_sync_groups(streams, {'metafields_single_pass': 'true'})
+
+        self.assertEqual(
+            [[stream.tap_stream_id for stream in group] for group in groups],
+            [['orders'], ['metafields_customer', 'metafields_store'], ['charges']])
+
+    def test_single_metafields_stream(self):
+        streams = list(get_catalog(['metafields_store', 'orders']).streams)
+
+        self.assertEqual(len(get_sync_groups(streams, {'metafields_single_pass': True})), 2)
+
+    def test_not_grouped_by_default(self):
+        streams = list(get_catalog(['metafields_customer', 'metafields_store']).streams)
+
+        self.assertEqual(len(get_sync_groups(streams, {})), 2)
+
+@mock.patch('singer.write_state')
+@mock.patch('tap_recharge.writer.MessageWriter.write_record')
+@mock.patch('singer.write_schema')
+class TestMetafieldsExtractor(unittest.TestCase):
+    """Test cases to verify the metafields streams share a single pass of the endpoint"""
+
+    config = {'start_date': '2021-01-01T00:00:00Z', 'metafields_single_pass': True}
+
+    @mock.patch('tap_recharge.client.RechargeClient.get', side_effect=get)
+    def test_single_pass(self, mocked_get, mocked_write_schema, mocked_write_record, mocked_write_state):
+        state = {'bookmarks': {'metafields_customer': '2021-10-01T00:00:00.000000Z'}}
+
+        sync(RechargeClient('test_access_token'), self.config, state, get_catalog(['metafields_store', 'metafields_customer']))
+
+        # The endpoint is paged once, without owner_resource
+        self.assertEqual(mocked_get.call_count, 2)
+        self.assertNotIn('owner_resource', mocked_get.mock_calls[0].kwargs['params'])
+        self.assertEqual(mocked_write_schema.call_count, 2)
+        # Each stream gets the records of its owner resource newer than its own bookmark
+        self.assertEqual(get_written_records(mocked_write_record), {'metafields_store': [1, 5], 'metafields_customer': [4]})
+        self.assertEqual(mocked_write_state.mock_calls[-1].args[0], {
+            'currently_syncing': None,
+            'bookmarks': {
+                'metafields_store': '2021-10-05T00:00:00.000000Z',
+                'metafields_customer': '2021-10-04T00:00:00.000000Z'}})
+
+    @mock.patch('tap_recharge.client.RechargeClient.get', side_effect=get)
+    def test_concurrent_sync(self, mocked_get, mocked_write_schema, mocked_write_record, mocked_write_state):
+        config = dict(self.config, max_workers=2)
+        catalog = get_catalog(['metafields_store', 'metafields_customer', 'metafields_subscription'])
+
+        sync(RechargeClient('test_access_token'), config, {}, catalog)
+
+        self.assertEqual(mocked_get.call_count, 2)
+        self.assertEqual(
+            get_written_records(mocked_write_record),
+            {'metafields_store': [1, 5], 'metafields_customer': [2, 4], 'metafields_subscription': [3]})
+        # The bookmarks of every stream of the group are merged in the state
+        self.assertEqual(mocked_write_state.mock_calls[-1].args[0]['bookmarks'], {
+            'metafields_store': '2021-10-05T00:00:00.000000Z',
+            'metafields_customer': '2021-10-04T00:00:00.000000Z',
+            'metafields_subscription': '2021-09-03T00:00:00.000000Z'})
+
+    @mock.patch('tap_recharge.client.RechargeClient.get')
+    def test_fallback_to_owner_resource(self, mocked_get, mocked_write_schema, mocked_write_record, mocked_write_state):
+        def get_with_owner_resource(path, params=None, **kwargs):
+            if 'owner_resource' not in params and 'cursor' not in params:
+                raise RechargeUnprocessableEntityError('owner_resource is required')
+            return get(path, params, **kwargs)
+
+        mocked_get.side_effect = get_with_owner_resource
+
+        sync(RechargeClient('test_access_token'), self.config, {}, get_catalog(['metafields_store', 'metafields_customer']))
+
+        self.assertEqual(get_written_records(mocked_write_record), {'metafields_store': [1, 5], 'metafields_customer': [2, 4]})
+        self.assertEqual(
+            [call.kwargs['params'].get('owner_resource') for call in mocked_get.mock_calls[1:]],
+            ['store', 'customer'])
+
+    @mock.patch('tap_recharge.client.RechargeClient.get', side_effect=get)
+    def test_owner_resource_by_default(self, mocked_get, mocked_write_schema, mocked_write_record, mocked_write_state):
+        config = {'start_date': '2021-01-01T00:00:00Z'}
+
+        sync(RechargeClient('test_access_token'), config, {}, get_catalog(['metafields_store', 'metafields_customer']))
+
+        # No request is sent without owner_resource
+        self.assertEqual(
+            [call.kwargs['params'].get('owner_resource') for call in mocked_get.mock_calls],
+            ['store', 'customer'])
+        self.assertEqual(get_written_records(mocked_write_record), {'metafields_store': [1, 5], 'metafields_customer': [2, 4]})
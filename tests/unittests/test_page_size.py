@@ -0,0 +1,87 @@
+import json
+import unittest
+from unittest import mock
+from requests.exceptions import Timeout, ChunkedEncodingError
+from tap_recharge.client import RechargeClient
+from tap_recharge.streams import Addresses, Charges, PageLimit
+
+class MockResponse:
+    def __init__(self,  status_code, json):
+        self.status_code = status_code
+        self.text = json
+        self.links = {}
+
+    @property
+    def content(self):
+        return json.dumps(self.text).encode('utf-8')
+
+    def json(self):
+        return self.text
+
+class TestPageLimitConfig(unittest.TestCase):
+    """Test cases to verify the page size is read from the config"""
+
+    def test_default_page_size(self):
+        page_limit = PageLimit.from_config({}, 'charges', 250)
+        self.assertEqual((page_limit.limit, page_limit.adaptive), (250, False))
+
+    def test_page_size_for_every_stream(self):
+        self.assertEqual(PageLimit.from_config({'page_size': '100'}, 'charges', 250).limit, 100)
+
+    def test_page_size_by_stream(self):
+        config = {'page_size': {'orders': 50}}
+        self.assertEqual(PageLimit.from_config(config, 'orders', 250).limit, 50)
+        self.assertEqual(PageLimit.from_config(config, 'charges', 250).limit, 250)
+
+    def test_page_size_above_api_limit(self):
+        self.assertEqual(PageLimit.from_config({'page_size': 1000}, 'charges', 250).limit, 250)
+
+    def test_adaptive_string_value(self):
+        self.assertTrue(PageLimit.from_config({'adaptive_page_size': 'true'}, 'charges', 250).adaptive)
+
+class TestAdaptivePageLimit(unittest.TestCase):
+    """Test cases to verify the adaptive page size shrinks and grows back"""
+
+    def test_shrink_and_grow(self):
+        page_limit = PageLimit(200, adaptive=True)
+        params = {'limit': 200}
+        page_limit.shrink(params)
+        page_limit.shrink(params)
+        self.assertEqual((page_limit.limit, params['limit']), (50, 50))
+
+        for _ in range(5):
+            page_limit.success()
+        self.assertEqual(page_limit.limit, 100)
+
+    def test_minimum_page_size(self):
+        page_limit = PageLimit(16, adaptive=True)
+        page_limit.shrink({})
+        page_limit.shrink({})
+        self.assertEqual(page_limit.limit, 10)
+
+    @mock.patch('tap_recharge.client.RechargeClient.check_access_token')
+    @mock.patch('time.sleep')
+    @mock.patch('requests.Session.request')
+    def test_retry_with_smaller_page(self, mocked_request, mocked_sleep, mocked_check_access_token):
+        requested_limits = []
+        responses = [Timeout('timeout'), ChunkedEncodingError('chunked'), MockResponse(200, {'next_cursor': None, 'charges': [{'id': 1}]})]
+
+        def request(*args, **kwargs):
+            requested_limits.append(kwargs['params']['limit'])
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        mocked_request.side_effect = request
+        stream = Charges(RechargeClient('test_access_token'))
+        stream.page_limit = PageLimit(200, adaptive=True)
+
+        self.assertEqual(list(stream.get_records()), [{'id': 1}])
+        self.assertEqual(requested_limits, [200, 100, 50])
+
+    @mock.patch('tap_recharge.client.RechargeClient.request', return_value={'next_cursor': None, 'addresses': []})
+    def test_not_adaptive_by_default(self, mocked_request):
+        list(Addresses(RechargeClient('test_access_token')).get_records())
+
+        self.assertNotIn('on_retry', mocked_request.mock_calls[0].kwargs)
@@ -0,0 +1,89 @@
+import unittest
+from unittest import mock
+from singer import Catalog
+from tap_recharge.client import RechargeClient
+from tap_recharge.sync import get_max_workers, sync
+from tap_recharge.writer import ThreadedMessageWriter, merge_stream_state
+
+def get_catalog(stream_names):
+    """Returns a catalog with every stream selected"""
+    return Catalog.from_dict({'streams': [
+        {
+            'stream': stream_name,
+            'tap_stream_id': stream_name,
+            'schema': {'type': 'object', 'properties': {'id': {'type': 'integer'}, 'updated_at': {'type': 'string'}}},
+            'metadata': [{'breadcrumb': [], 'metadata': {'selected': True}}]
+        } for stream_name in stream_names]})
+
+def get(page_by_path):
+    """Returns a mocked 'RechargeClient.get' which serves a single page per path"""
+    def mocked_get(path, **kwargs):
+        return {'next_cursor': None, path: page_by_path[path]}
+    return mocked_get
+
+class TestGetMaxWorkers(unittest.TestCase):
+    """Test cases to verify the 'max_workers' config value is parsed as expected"""
+
+    def test_default(self):
+        self.assertEqual(get_max_workers({}), 1)
+
+    def test_empty_values(self):
+        self.assertEqual(get_max_workers({'max_workers': ''}), 1)
+        self.assertEqual(get_max_workers({'max_workers': '0'}), 1)
+
+    def test_string_value(self):
+        self.assertEqual(get_max_workers({'max_workers': '4'}), 4)
+
+class TestThreadedMessageWriter(unittest.TestCase):
+    """Test cases to verify the writer thread orders messages and merges state"""
+
+    def test_merge_stream_state(self):
+        state = {'bookmarks': {'orders': 'a', 'charges': 'b'}, 'currently_syncing': None}
+        merge_stream_state(state, {'bookmarks': {'orders': 'c', 'charges': 'x'}}, 'orders')
+
+        self.assertEqual(state, {'bookmarks': {'orders': 'c', 'charges': 'b'}, 'currently_syncing': None})
+
+    def test_messages_are_written_in_order(self):
+        # Without a flush on time
+        sink = mock.Mock(flush_seconds=0)
+        with ThreadedMessageWriter({'bookmarks': {'charges': 'b'}}, sink) as writer:
+            orders_writer = writer.for_stream('orders')
+            orders_writer.write_record('orders', {'id': 1})
+            orders_writer.write_record('orders', {'id': 2})
+            orders_writer.write_state({'bookmarks': {'orders': 'a'}})
+
+        self.assertEqual(sink.mock_calls, [
+            mock.call.write_record('orders', {'id': 1}),
+            mock.call.write_record('orders', {'id': 2}),
+            mock.call.write_state({'bookmarks': {'charges': 'b', 'orders': 'a'}}),
+            # The buffered records are written once the writer thread stops
+            mock.call.flush()])
+
+class TestConcurrentSync(unittest.TestCase):
+    """Test cases to verify streams synced on a thread pool write valid output"""
+
+    @mock.patch('singer.write_state')
+    @mock.patch('tap_recharge.writer.MessageWriter.write_record')
+    @mock.patch('singer.write_schema')
+    @mock.patch('tap_recharge.client.RechargeClient.get')
+    def test_sync_with_max_workers(self, mocked_get, mocked_write_schema, mocked_write_record, mocked_write_state):
+        mocked_get.side_effect = get({
+            'orders': [{'id': 1, 'updated_at': '2021-10-11T00:01:32.000000Z'}],
+            'charges': [{'id': 2, 'updated_at': '2021-09-16T00:06:34.000000Z'}]})
+        config = {'start_date': '2021-01-01T00:00:00Z', 'max_workers': 2}
+        client = RechargeClient('test_access_token')
+
+        sync(client, config, {}, get_catalog(['orders', 'charges']))
+
+        self.assertEqual(mocked_write_schema.call_count, 2)
+        self.assertCountEqual(
+            mocked_write_record.mock_calls,
+            [mock.call('orders', {'id': 1, 'updated_at': '2021-10-11T00:01:32.000000Z'}),
+             mock.call('charges', {'id': 2, 'updated_at': '2021-09-16T00:06:34.000000Z'})])
+        # The final state holds the bookmarks of both streams
+        final_state = mocked_write_state.mock_calls[-1].args[0]
+        self.assertEqual(final_state, {
+            'currently_syncing': None,
+            'bookmarks': {
+                'orders': '2021-10-11T00:01:32.000000Z',
+                'charges': '2021-09-16T00:06:34.000000Z'}})
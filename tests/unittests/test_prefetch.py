@@ -0,0 +1,106 @@
+import time
+import unittest
+from unittest import mock
+from tap_recharge.client import RechargeClient, RechargeBadRequestError
+from tap_recharge.streams import Charges
+
+def mock_transform(*args, **kwargs):
+    """Mocked transformer function which returns the first argument received"""
+    return args[0]
+
+def get_page(page, last_page=5):
+    return {'next_cursor': None if page == last_page else f'next_cursor_{page}', 'charges': [{'id': page}]}
+
+class MockedGet:
+    """Serves the pages in order and records the cursors they were requested with"""
+
+    def __init__(self, fail_on=None):
+        self.cursors = []
+        self.fail_on = fail_on
+
+    def __call__(self, *args, params=None, **kwargs):
+        self.cursors.append(params.get('cursor'))
+        page = len(self.cursors)
+        if page == self.fail_on:
+            raise RechargeBadRequestError('bad request')
+        return get_page(page)
+
+    def wait_for(self, count, timeout=2):
+        deadline = time.monotonic() + timeout
+        while len(self.cursors) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Leave time for requests beyond the expected count
+        time.sleep(0.1)
+        return len(self.cursors)
+
+class TestPrefetch(unittest.TestCase):
+    """Test cases to verify the next pages are fetched while the current page is synced"""
+
+    def get_stream(self, mocked_get, prefetch_pages):
+        stream = Charges(RechargeClient('test_access_token'))
+        stream.client.get = mocked_get
+        stream.prefetch_pages = prefetch_pages
+        return stream
+
+    def test_pages_in_order(self):
+        stream = self.get_stream(MockedGet(), 2)
+
+        self.assertEqual(list(stream.get_records()), [{'id': page} for page in range(1, 6)])
+
+    def test_next_page_fetched_ahead(self):
+        mocked_get = MockedGet()
+        records = self.get_stream(mocked_get, 1).get_records()
+
+        self.assertEqual(next(records), {'id': 1})
+        # The second page is requested with the cursor of the first while the first is synced
+        self.assertEqual(mocked_get.wait_for(2), 2)
+        self.assertEqual(mocked_get.cursors, [None, 'next_cursor_1'])
+        records.close()
+
+    def test_prefetch_depth(self):
+        mocked_get = MockedGet()
+        records = self.get_stream(mocked_get, 2).get_records()
+
+        next(records)
+        # The page being synced and 2 pages ahead
+        self.assertEqual(mocked_get.wait_for(3), 3)
+        records.close()
+
+    def test_prefetch_disabled(self):
+        mocked_get = MockedGet()
+        records = self.get_stream(mocked_get, 0).get_records()
+
+        next(records)
+        self.assertEqual(mocked_get.wait_for(2, timeout=0.2), 1)
+
+    def test_error_after_prefetched_pages(self):
+        stream = self.get_stream(MockedGet(fail_on=3), 2)
+        records = []
+
+        with self.assertRaises(RechargeBadRequestError):
+            records.extend(stream.get_records())
+        # The pages fetched before the error are synced first
+        self.assertEqual(records, [{'id': 1}, {'id': 2}])
+
+    def test_prefetch_stops_with_the_sync(self):
+        mocked_get = MockedGet()
+        records = self.get_stream(mocked_get, 1).get_records()
+
+        next(records)
+        mocked_get.wait_for(2)
+        records.close()
+        # No page is fetched once the sync stopped reading
+        self.assertEqual(mocked_get.wait_for(5, timeout=0.3), 2)
+
+    @mock.patch('singer.write_state')
+    @mock.patch('singer.write_record')
+    def test_prefetch_pages_config(self, mocked_write_record, mocked_write_state):
+        config = {'start_date': '2021-01-01T00:00:00Z'}
+        stream = self.get_stream(MockedGet(), 0)
+
+        stream.sync({}, {}, {}, config, mock.Mock(transform=mock_transform))
+        self.assertEqual(stream.prefetch_pages, 1)
+
+        stream.client.get = MockedGet()
+        stream.sync({}, {}, {}, dict(config, prefetch_pages='0'), mock.Mock(transform=mock_transform))
+        self.assertEqual(stream.prefetch_pages, 0)
@@ -0,0 +1,69 @@
+import unittest
+from unittest import mock
+from singer import metadata
+from tap_recharge.client import RechargeClient, get_headers
+from tap_recharge.discover import discover
+from tap_recharge.streams import Products
+
+def mock_transform(*args, **kwargs):
+    """Mocked transformer function which returns the first argument received"""
+    return args[0]
+
+class TestProductsStream(unittest.TestCase):
+    """Test cases to verify the products stream is discovered and synced full table"""
+
+    def test_discovered(self):
+        stream = discover().get_stream('products')
+        mdata = metadata.to_map(stream.metadata)
+
+        self.assertEqual(metadata.get(mdata, (), 'forced-replication-method'), 'FULL_TABLE')
+        self.assertEqual(metadata.get(mdata, (), 'table-key-properties'), ['external_product_id'])
+        self.assertIsNone(metadata.get(mdata, (), 'valid-replication-keys'))
+        self.assertEqual(metadata.get(mdata, ('properties', 'external_product_id'), 'inclusion'), 'automatic')
+
+    def test_api_version(self):
+        # The schema is the one of the 2021-11 product resource
+        self.assertEqual(get_headers('test_access_token')['X-Recharge-Version'], '2021-11')
+
+    @mock.patch('singer.write_state')
+    @mock.patch('singer.write_record')
+    @mock.patch('tap_recharge.client.RechargeClient.get')
+    def test_sync(self, mocked_get, mocked_write_record, mocked_write_state):
+        mocked_get.side_effect = [
+            {'next_cursor': 'next_cursor_1', 'products': [{'external_product_id': '1'}]},
+            {'next_cursor': None, 'products': [{'external_product_id': '2'}]}]
+        config = {'start_date': '2021-01-01T00:00:00Z'}
+
+        state = Products(RechargeClient('test_access_token')).sync(
+            {}, {}, {}, config, mock.Mock(transform=mock_transform))
+
+        # Every page is read, the first one without a query filter
+        self.assertEqual(
+            [call.kwargs['params'] for call in mocked_get.mock_calls],
+            [{'limit': 250}, {'cursor': 'next_cursor_1', 'limit': 250}])
+        self.assertEqual(mocked_write_record.call_count, 2)
+        self.assertEqual(state, {})
+
+    @mock.patch('singer.write_state')
+    @mock.patch('singer.write_record')
+    @mock.patch('tap_recharge.client.RechargeClient.get')
+    def test_paging_config(self, mocked_get, mocked_write_record, mocked_write_state):
+        mocked_get.side_effect = [
+            {'next_cursor': 'next_cursor_1', 'products': [{'external_product_id': '1', 'title': 'a', 'vendor': 'b'}]},
+            {'next_cursor': None, 'products': [{'external_product_id': '2', 'title': 'c', 'vendor': 'd'}]}]
+        config = {'start_date': '2021-01-01T00:00:00Z', 'page_size': {'products': 50}, 'prefetch_pages': 1}
+        stream_metadata = {
+            (): {'selected': True},
+            ('properties', 'external_product_id'): {'inclusion': 'automatic'},
+            ('properties', 'title'): {'selected': True},
+            ('properties', 'vendor'): {'selected': False}}
+
+        Products(RechargeClient('test_access_token')).sync(
+            {}, {}, stream_metadata, config, mock.Mock(transform=mock_transform))
+
+        # The page size of the stream is used, and the unselected fields are dropped
+        self.assertEqual(
+            [call.kwargs['params']['limit'] for call in mocked_get.mock_calls], [50, 50])
+        self.assertEqual(
+            [call.args[1] for call in mocked_write_record.mock_calls],
+            [{'external_product_id': '1', 'title': 'a'}, {'external_product_id': '2', 'title': 'c'}])
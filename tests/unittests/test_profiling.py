@@ -0,0 +1,159 @@
+import cProfile
+import json
+import os
+import pstats
+import tempfile
+import unittest
+from unittest import mock
+from singer import Catalog
+from tap_recharge.client import RechargeClient
+from tap_recharge.profiling import Histogram, Profiler
+from tap_recharge.streams import Charges
+from tap_recharge.sync import sync
+
+PAGE = {'charges': [{'id': 1, 'updated_at': '2021-10-01T00:00:00Z'}, {'id': 2, 'updated_at': '2021-10-02T00:00:00Z'}], 'next_cursor': None}
+
+class SingleProfile(cProfile.Profile):
+    """A cProfile profile failing when another one is active, as from Python 3.12"""
+    active = 0
+
+    def enable(self, *args, **kwargs):
+        if SingleProfile.active:
+            raise ValueError('Another profiling tool is already active')
+        SingleProfile.active += 1
+        super().enable(*args, **kwargs)
+
+    def disable(self):
+        super().disable()
+        SingleProfile.active = 0
+
+def mock_transform(*args, **kwargs):
+    """Mocked transformer function which returns the first argument received"""
+    return args[0]
+
+class TestHistogram(unittest.TestCase):
+    """Test cases to verify the percentiles are read from the log scale buckets"""
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for _ in range(90):
+            histogram.add(0.001)
+        for _ in range(10):
+            histogram.add(0.1)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.total, 1.09)
+        # Within a bucket of the measured duration
+        self.assertTrue(0.001 <= histogram.percentile(50) < 0.001 * 1.19)
+        self.assertTrue(0.001 <= histogram.percentile(90) < 0.001 * 1.19)
+        # Capped at the maximum
+        self.assertEqual(histogram.percentile(95), 0.1)
+        self.assertEqual(histogram.percentile(100), 0.1)
+
+    def test_zero_duration(self):
+        histogram = Histogram()
+        histogram.add(0.0)
+
+        self.assertEqual(histogram.percentile(50), 0.0)
+
+class TestProfiler(unittest.TestCase):
+    """Test cases to verify the phases are timed by stream and reported"""
+
+    def test_summary(self):
+        profiler = Profiler()
+        profiler.add('orders', 'write', 0.002)
+        profiler.add('charges', 'transform', 0.001)
+        profiler.add('orders', 'request', 0.5)
+        profiler.add('orders', 'request', 0.3)
+
+        summary = profiler.get_summary()
+
+        # By endpoint, the phases in the order a record goes through them
+        self.assertEqual([(stats['endpoint'], stats['phase']) for stats in summary],
+                         [('charges', 'transform'), ('orders', 'request'), ('orders', 'write')])
+        self.assertEqual(summary[1]['count'], 2)
+        self.assertEqual(summary[1]['total'], 0.8)
+        self.assertEqual(summary[1]['max'], 0.5)
+
+    @mock.patch('singer.metrics.log')
+    def test_metrics(self, mocked_log):
+        profiler = Profiler()
+        profiler.add('orders', 'decode', 0.25)
+
+        profiler.log_metrics()
+
+        point = mocked_log.mock_calls[0].args[1]
+        self.assertEqual((point.metric_type, point.metric, point.value), ('timer', 'phase_duration', 0.25))
+        self.assertEqual(point.tags['endpoint'], 'orders')
+        self.assertEqual(point.tags['phase'], 'decode')
+        self.assertEqual(point.tags['count'], 1)
+
+    @mock.patch('tap_recharge.client.RechargeClient.check_access_token', return_value=True)
+    @mock.patch('requests.Session.request')
+    def test_client_phases(self, mocked_request, mocked_check_access_token):
+        mocked_request.return_value = mock.Mock(status_code=200, headers={}, content=json.dumps(PAGE).encode('utf-8'))
+        client = RechargeClient('test_access_token')
+
+        client.get('charges')
+
+        self.assertEqual(
+            [stats['phase'] for stats in client.profiler.get_summary()],
+            ['throttle', 'request', 'download', 'decode'])
+
+    @mock.patch('singer.write_state')
+    @mock.patch('singer.write_record')
+    @mock.patch('tap_recharge.client.RechargeClient.get', return_value=PAGE)
+    def test_stream_phases(self, mocked_get, mocked_write_record, mocked_write_state):
+        stream = Charges(RechargeClient('test_access_token'))
+
+        stream.sync({}, {}, {}, {'start_date': '2021-01-01T00:00:00Z'}, mock.Mock(transform=mock_transform))
+
+        self.assertEqual(
+            [(stats['endpoint'], stats['phase'], stats['count']) for stats in stream.client.profiler.get_summary()],
+            [('charges', 'transform', 2), ('charges', 'write', 2)])
+
+    def test_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = Profiler(os.path.join(directory, 'sync.prof'))
+            with profiler.profile():
+                sorted(range(1000), key=str)
+
+            profiler.dump_profile()
+
+            stats = pstats.Stats(os.path.join(directory, 'sync.prof'))
+            self.assertTrue(any(function[2] == 'sorted' or 'sorted' in function[2] for function in stats.stats))
+
+    def test_profile_disabled(self):
+        profiler = Profiler()
+        with profiler.profile():
+            pass
+
+        self.assertEqual(profiler.profiles, [])
+        # Nothing to save
+        profiler.dump_profile()
+
+    @mock.patch('singer.write_state')
+    @mock.patch('tap_recharge.writer.MessageWriter.write_record')
+    @mock.patch('singer.write_schema')
+    @mock.patch('tap_recharge.client.RechargeClient.get')
+    @mock.patch('tap_recharge.profiling.PROFILER_PER_THREAD', False)
+    @mock.patch('tap_recharge.profiling.cProfile.Profile', SingleProfile)
+    def test_profile_concurrent_sync(self, mocked_get, mocked_write_schema, mocked_write_record, mocked_write_state):
+        mocked_get.side_effect = lambda path, **kwargs: {'next_cursor': None, path: [{'id': 1, 'updated_at': '2021-10-01T00:00:00Z'}]}
+        catalog = Catalog.from_dict({'streams': [
+            {
+                'stream': stream_name,
+                'tap_stream_id': stream_name,
+                'schema': {'type': 'object', 'properties': {'id': {'type': 'integer'}, 'updated_at': {'type': 'string'}}},
+                'metadata': [{'breadcrumb': [], 'metadata': {'selected': True}}]
+            } for stream_name in ['charges', 'orders']]})
+
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'start_date': '2021-01-01T00:00:00Z', 'max_workers': 2, 'profile_path': os.path.join(directory, 'sync.prof')}
+            client = RechargeClient('test_access_token')
+            sync(client, config, {}, catalog)
+
+            # A single profile, around the whole sync
+            self.assertEqual(len(client.profiler.profiles), 1)
+            self.assertEqual(mocked_write_record.call_count, 2)
+            self.assertTrue(os.path.exists(config['profile_path']))
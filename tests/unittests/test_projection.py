@@ -0,0 +1,102 @@
+import copy
+import unittest
+from unittest import mock
+from parameterized import parameterized
+from singer import Transformer, metadata
+from tap_recharge.client import RechargeClient
+from tap_recharge.schema import get_schemas
+from tap_recharge.streams import Charges, MetafieldsExtractor, MetafieldsCustomer, MetafieldsStore
+
+SCHEMAS, FIELD_METADATA = get_schemas()
+
+CHARGES = [
+    {'id': 1, 'updated_at': '2021-10-01T00:00:00Z', 'status': 'success', 'total_price': '10.00',
+     'line_items': [{'title': 'line item', 'quantity': 2}], 'shipping_address': {'city': 'Paris'}},
+    {'id': 2, 'updated_at': '2021-10-02T00:00:00Z', 'status': 'refunded', 'total_price': '7.50',
+     'line_items': [], 'shipping_address': None, 'field_not_in_schema': True},
+]
+
+def get_metadata(stream_name, selected_fields):
+    """Returns the metadata map of the stream with only the given fields selected"""
+    mdata = metadata.to_map(copy.deepcopy(FIELD_METADATA[stream_name]))
+    for breadcrumb in mdata:
+        if breadcrumb:
+            mdata = metadata.write(mdata, breadcrumb, 'selected', breadcrumb[1] in selected_fields)
+    return mdata
+
+class TestProjection(unittest.TestCase):
+    """Test cases to verify the fields left out of the selection are dropped as the pages arrive"""
+
+    def get_stream(self, selected_fields):
+        stream = Charges(RechargeClient('test_access_token'))
+        stream.set_projection(get_metadata('charges', selected_fields))
+        return stream
+
+    def test_excluded_fields(self):
+        stream = self.get_stream(['status'])
+
+        self.assertIn('line_items', stream.excluded_fields)
+        self.assertNotIn('status', stream.excluded_fields)
+        # The key properties and the replication key are kept
+        self.assertNotIn('id', stream.excluded_fields)
+        self.assertNotIn('updated_at', stream.excluded_fields)
+
+    def test_nothing_excluded(self):
+        stream = Charges(RechargeClient('test_access_token'))
+        stream.set_projection(metadata.to_map(FIELD_METADATA['charges']))
+
+        self.assertEqual(stream.excluded_fields, frozenset())
+
+    @parameterized.expand([
+        ['list', False],
+        ['streaming_parse', True],
+    ])
+    @mock.patch('tap_recharge.client.RechargeClient.get')
+    def test_projected_pages(self, name, streaming_parse, mocked_get):
+        mocked_get.return_value = {'next_cursor': None, 'charges': CHARGES}
+        stream = self.get_stream(['status'])
+        stream.streaming_parse = streaming_parse
+
+        [(_, page)] = list(stream.get_pages({}))
+
+        self.assertEqual(list(page), [
+            {'id': 1, 'updated_at': '2021-10-01T00:00:00Z', 'status': 'success'},
+            {'id': 2, 'updated_at': '2021-10-02T00:00:00Z', 'status': 'refunded', 'field_not_in_schema': True}])
+
+    @parameterized.expand([
+        ['status'],
+        ['total_price', 'line_items'],
+        ['shipping_address'],
+    ])
+    @mock.patch('tap_recharge.writer.MessageWriter.write_record')
+    @mock.patch('singer.write_state')
+    def test_same_records(self, *args):
+        *selected_fields, mocked_write_state, mocked_write_record = args
+        mdata = get_metadata('charges', selected_fields)
+        written_records = []
+        for projection in [True, False]:
+            stream = Charges(RechargeClient('test_access_token'))
+            if not projection:
+                stream.set_projection = mock.Mock()
+            with mock.patch('tap_recharge.client.RechargeClient.get', return_value={'next_cursor': None, 'charges': CHARGES}), \
+                    Transformer() as transformer:
+                stream.sync({}, SCHEMAS['charges'], mdata, {'start_date': '2021-01-01T00:00:00Z'}, transformer)
+            written_records.append([call.args[1] for call in mocked_write_record.mock_calls])
+            mocked_write_record.reset_mock()
+
+        self.assertEqual(written_records[0], written_records[1])
+
+    def test_metafields_owner_resource_kept(self):
+        client = RechargeClient('test_access_token')
+        extractor = MetafieldsExtractor(client, [MetafieldsStore(client), MetafieldsCustomer(client)])
+        stream_metadatas = {
+            'metafields_store': get_metadata('metafields_store', ['value']),
+            'metafields_customer': get_metadata('metafields_customer', ['value', 'namespace'])}
+
+        with mock.patch.object(extractor, 'sync_pass'):
+            extractor.sync_streams({}, {}, stream_metadatas, {'start_date': '2021-01-01T00:00:00Z'}, None)
+
+        # Only the fields excluded by every stream are dropped
+        self.assertNotIn('namespace', extractor.excluded_fields)
+        self.assertNotIn('owner_resource', extractor.excluded_fields)
+        self.assertIn('description', extractor.excluded_fields)
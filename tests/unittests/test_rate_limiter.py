@@ -0,0 +1,96 @@
+import json
+import unittest
+from unittest import mock
+from tap_recharge.client import RateLimiter, RechargeClient, RechargeRateLimitError
+
+class MockResponse:
+    def __init__(self,  status_code, json, headers):
+        self.status_code = status_code
+        self.text = json
+        self.headers = headers
+        self.links = {}
+
+    @property
+    def content(self):
+        return json.dumps(self.text).encode('utf-8')
+
+    def json(self):
+        return self.text
+
+@mock.patch('tap_recharge.client.time.monotonic', return_value=1000)
+@mock.patch('tap_recharge.client.time.sleep')
+class TestRateLimiter(unittest.TestCase):
+    """Test cases to verify the leaky bucket limiter follows the rate limit headers"""
+
+    def test_no_wait_while_bucket_has_room(self, mocked_sleep, mocked_monotonic):
+        limiter = RateLimiter()
+        for _ in range(38):
+            limiter.acquire()
+
+        mocked_sleep.assert_not_called()
+
+    def test_wait_for_leak_when_bucket_is_full(self, mocked_sleep, mocked_monotonic):
+        limiter = RateLimiter()
+        limiter.update(200, {'X-Recharge-Limit': '38/40'})
+        limiter.acquire()
+
+        # The call has to wait for one call to leak at 2 calls per second
+        mocked_sleep.assert_called_once_with(0.5)
+
+    def test_bucket_size_from_header(self, mocked_sleep, mocked_monotonic):
+        limiter = RateLimiter()
+        limiter.update(200, {'X-Recharge-Limit': '38/80'})
+        limiter.acquire()
+
+        mocked_sleep.assert_not_called()
+        self.assertEqual(limiter.get_metrics()['bucket_size'], 80)
+
+    def test_retry_after(self, mocked_sleep, mocked_monotonic):
+        limiter = RateLimiter(leak_rate=100)
+        limiter.update(429, {'Retry-After': '3'})
+        limiter.acquire()
+
+        mocked_sleep.assert_called_once_with(3)
+        self.assertEqual(limiter.get_metrics()['rate_limited'], 1)
+
+    def test_default_delay_without_retry_after(self, mocked_sleep, mocked_monotonic):
+        limiter = RateLimiter(leak_rate=100)
+        limiter.update(429, {})
+        limiter.acquire()
+
+        mocked_sleep.assert_called_once_with(5)
+
+    def test_metrics(self, mocked_sleep, mocked_monotonic):
+        limiter = RateLimiter()
+        limiter.acquire()
+        limiter.update(200, {'X-Recharge-Limit': '5/40'})
+        limiter.release()
+
+        self.assertEqual(limiter.get_metrics(), {
+            'bucket_size': 40,
+            'bucket_level': 5,
+            'leak_rate': 2.0,
+            'requests': 1,
+            'rate_limited': 0,
+            'throttled_seconds': 0})
+
+class TestClientRateLimit(unittest.TestCase):
+    """Test cases to verify the client feeds the responses to the limiter"""
+
+    def test_leak_rate_from_config(self):
+        self.assertEqual(RechargeClient('test_access_token', rate_limit_leak_rate='4').rate_limiter.leak_rate, 4)
+        self.assertEqual(RechargeClient('test_access_token', rate_limit_leak_rate='').rate_limiter.leak_rate, 2)
+
+    @mock.patch('tap_recharge.client.RechargeClient.check_access_token')
+    @mock.patch('tap_recharge.client.time.sleep')
+    @mock.patch('requests.Session.request')
+    def test_429_honors_retry_after(self, mocked_request, mocked_sleep, mocked_check_access_token):
+        mocked_request.side_effect = [
+            MockResponse(429, {'error': 'rate limited'}, {'Retry-After': '7', 'X-Recharge-Limit': '40/40'}),
+            MockResponse(200, {'key': 'value'}, {'X-Recharge-Limit': '1/40'})]
+        client = RechargeClient('test_access_token')
+
+        self.assertEqual(client.request('GET', 'path'), {'key': 'value'})
+        # The only wait is the one requested by the API
+        self.assertEqual([round(call.args[0]) for call in mocked_sleep.mock_calls if call.args[0]], [7])
+        self.assertEqual(client.rate_limiter.in_flight, 0)
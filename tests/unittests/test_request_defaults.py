@@ -0,0 +1,107 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from singer import utils
+from tap_recharge.client import RechargeClient
+from tap_recharge.streams import Charges, MetafieldsStore
+
+class Handler(BaseHTTPRequestHandler):
+    """Keeps the headers of each request"""
+    protocol_version = 'HTTP/1.1'
+    headers_received = []
+
+    def do_GET(self): # pylint: disable=invalid-name
+        self.headers_received.append(dict(self.headers))
+        self.answer()
+
+    def do_POST(self): # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.do_GET()
+
+    def answer(self):
+        data = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+class TestSessionHeaders(unittest.TestCase):
+    """Test cases to verify every request carries the headers set once on the session"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}/'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        Handler.headers_received = []
+
+    def test_headers(self):
+        client = RechargeClient('test_access_token', 'test_user_agent', base_url=self.base_url, compression='gzip')
+        client.get('charges')
+        client.post('charges', json={})
+
+        # The access token check, the GET and the POST
+        self.assertEqual(len(Handler.headers_received), 3)
+        for headers in Handler.headers_received:
+            self.assertEqual(headers['X-Recharge-Access-Token'], 'test_access_token')
+            self.assertEqual(headers['X-Recharge-Version'], '2021-11')
+            self.assertEqual(headers['Accept'], 'application/json')
+            self.assertEqual(headers['Accept-Encoding'], 'gzip')
+            self.assertEqual(headers['User-Agent'], 'test_user_agent')
+        self.assertEqual(Handler.headers_received[2]['Content-Type'], 'application/json')
+
+class TestStreamParams(unittest.TestCase):
+    """Test cases to verify the stream params are read-only and each query is built on its own"""
+
+    def test_class_params_read_only(self):
+        with self.assertRaises(TypeError):
+            Charges.params['updated_at_min'] = '2021-01-01'
+        with self.assertRaises(TypeError):
+            Charges(mock.Mock()).params['cursor'] = 'next_cursor'
+
+    def test_get_params(self):
+        stream = MetafieldsStore(mock.Mock())
+
+        params = stream.get_params(limit=250)
+
+        self.assertEqual(params, {'sort_by': 'updated_at-asc', 'owner_resource': 'store', 'limit': 250})
+        self.assertEqual(dict(MetafieldsStore.params), {'sort_by': 'updated_at-asc', 'owner_resource': 'store'})
+
+    def test_concurrent_instances(self):
+        # Two instances of the same stream class paging at once from different bookmarks
+        requests = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(2)
+
+        def get(path, url=None, params=None, **kwargs):
+            with lock:
+                requests.append(dict(params))
+            barrier.wait(timeout=5)
+            return {'next_cursor': None, 'charges': []}
+
+        bookmarks = [utils.strptime_to_utc('2021-01-01T00:00:00Z'), utils.strptime_to_utc('2021-06-01T00:00:00Z')]
+
+        def run(bookmark):
+            stream = Charges(mock.Mock(get=get))
+            list(stream.get_records(bookmark))
+
+        threads = [threading.Thread(target=run, args=(bookmark,)) for bookmark in bookmarks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertCountEqual([params['updated_at_min'] for params in requests], bookmarks)
+        self.assertEqual(dict(Charges.params), {'sort_by': 'updated_at-asc'})
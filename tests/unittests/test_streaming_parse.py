@@ -0,0 +1,99 @@
+import json
+import unittest
+from unittest import mock
+from parameterized import parameterized
+from tap_recharge.client import RechargeClient
+from tap_recharge.json_stream import StreamingPage
+from tap_recharge.streams import Charges
+
+PAGE = {
+    'next_cursor': 'next_cursor_1',
+    'charges': [
+        {'id': 1, 'total_price': '10.00', 'line_items': [{'title': 'Café ☕', 'quantity': 2}]},
+        {'id': 22, 'total_price': '7.50', 'line_items': [], 'note': 'a "quoted" } ] note'}],
+    'previous_cursor': None,
+    'count': 12345
+}
+
+def get_chunks(body, chunk_size):
+    """Splits the encoded body into chunks of the given size"""
+    data = json.dumps(body, ensure_ascii=False, indent=1).encode('utf-8')
+    return [data[index:index + chunk_size] for index in range(0, len(data), chunk_size)]
+
+class MockResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {}
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        return iter(get_chunks(self.body, 5))
+
+    def close(self):
+        self.closed = True
+
+class TestStreamingPage(unittest.TestCase):
+    """Test cases to verify a page is parsed while it downloads"""
+
+    @parameterized.expand([
+        ['one_byte_chunks', 1],
+        ['small_chunks', 7],
+        ['whole_body', 100000],
+    ])
+    def test_records_and_fields(self, name, chunk_size):
+        page = StreamingPage(get_chunks(PAGE, chunk_size), 'charges')
+
+        self.assertEqual(list(page.get('charges')), PAGE['charges'])
+        self.assertEqual(page.get('next_cursor'), 'next_cursor_1')
+        self.assertIsNone(page.get('previous_cursor'))
+        # A number split across chunks is read in full
+        self.assertEqual(page.get('count'), 12345)
+
+    def test_records_are_yielded_before_the_body_ends(self):
+        chunks = get_chunks(PAGE, 10)
+        chunks_read = []
+
+        def read():
+            for chunk in chunks:
+                chunks_read.append(chunk)
+                yield chunk
+
+        records = StreamingPage(read(), 'charges').get('charges')
+        next(records)
+
+        self.assertLess(len(chunks_read), len(chunks))
+
+    def test_field_after_records(self):
+        body = {'charges': [{'id': 1}, {'id': 2}], 'next_cursor': 'next_cursor_1'}
+        page = StreamingPage(get_chunks(body, 3), 'charges')
+
+        # Records parsed while looking for the cursor are kept for the iterator
+        self.assertEqual(page.get('next_cursor'), 'next_cursor_1')
+        self.assertEqual(list(page.get('charges')), [{'id': 1}, {'id': 2}])
+
+    def test_empty_records(self):
+        page = StreamingPage(get_chunks({'next_cursor': None, 'charges': []}, 4), 'charges')
+
+        self.assertEqual(list(page.get('charges')), [])
+        self.assertIsNone(page.get('next_cursor'))
+
+    def test_truncated_body(self):
+        chunks = get_chunks(PAGE, 10)[:-3]
+        with self.assertRaises(ValueError):
+            list(StreamingPage(chunks, 'charges').get('charges'))
+
+class TestStreamingRequest(unittest.TestCase):
+    """Test cases to verify the client and the streams use the streaming parse path"""
+
+    @mock.patch('tap_recharge.client.RechargeClient.check_access_token')
+    @mock.patch('requests.Session.request')
+    def test_get_records(self, mocked_request, mocked_check_access_token):
+        response = MockResponse(200, dict(PAGE, next_cursor=None))
+        mocked_request.return_value = response
+        stream = Charges(RechargeClient('test_access_token'))
+        stream.streaming_parse = True
+
+        self.assertEqual(list(stream.get_records()), PAGE['charges'])
+        # The connection is released once the page is read
+        self.assertTrue(response.closed)
@@ -0,0 +1,67 @@
+import random
+import unittest
+from unittest import mock
+from parameterized import parameterized
+from singer import utils
+from tap_recharge import timestamps
+from tap_recharge.timestamps import strptime_to_utc
+
+class TestStrptimeToUtc(unittest.TestCase):
+    """Test cases to verify the fast timestamp parser returns the same datetimes as singer.utils.strptime_to_utc"""
+
+    @parameterized.expand([
+        ['naive', '2021-11-18T16:05:22'],
+        ['space_separator', '2021-11-18 16:05:22'],
+        ['utc_offset', '2021-11-18T16:05:22+00:00'],
+        ['bookmark', '2021-11-18T16:05:22.000000Z'],
+        ['milliseconds', '2021-11-18T16:05:22.123Z'],
+        ['nanoseconds', '2021-11-18T16:05:22.123456789Z'],
+        ['negative_offset', '2021-11-18T16:05:22-05:30'],
+        ['offset_without_colon', '2021-11-18T23:05:22+0200'],
+        ['negative_zero_offset', '2021-11-18T16:05:22-00:00'],
+        # Other formats go through the generic parser
+        ['date', '2021-11-18'],
+        ['comma_fraction', '2021-11-18T16:05:22,5Z'],
+        ['text_month', 'Nov 18 2021 16:05:22'],
+    ])
+    def test_same_datetime(self, name, value):
+        self.assertEqual(strptime_to_utc(value), utils.strptime_to_utc(value))
+        self.assertEqual(utils.strftime(strptime_to_utc(value)), utils.strftime(utils.strptime_to_utc(value)))
+
+    @parameterized.expand([
+        ['invalid_day', '2021-02-29T00:00:00Z'],
+        ['invalid_hour', '2021-11-18T24:00:00Z'],
+        ['invalid_offset', '2021-11-18T16:05:22+24:00'],
+        ['not_a_date', 'not a date'],
+        ['empty', ''],
+        ['integer', 1637251522],
+    ])
+    def test_same_error(self, name, value):
+        with self.assertRaises(Exception) as expected:
+            utils.strptime_to_utc(value)
+
+        with self.assertRaises(type(expected.exception)):
+            strptime_to_utc(value)
+
+    def test_random_timestamps(self):
+        rnd = random.Random(0)
+        for _ in range(1000):
+            value = '{:04}-{:02}-{:02}T{:02}:{:02}:{:02}{}{}'.format(
+                rnd.randint(1, 9999), rnd.randint(1, 12), rnd.randint(1, 28),
+                rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59),
+                rnd.choice(['', '.5', '.000000', '.1234567']),
+                rnd.choice(['', 'Z', '+00:00', '-07:00', '+1345']))
+
+            self.assertEqual(strptime_to_utc(value), utils.strptime_to_utc(value), value)
+
+    @mock.patch('singer.utils.strptime_to_utc', side_effect=utils.strptime_to_utc)
+    def test_cached_values(self, mocked_strptime_to_utc):
+        timestamps._cached_strptime_to_utc.cache_clear()
+
+        for _ in range(3):
+            strptime_to_utc('2021-11-18T16:05:22')
+            strptime_to_utc('Nov 18 2021 16:05:22')
+
+        self.assertEqual(timestamps._cached_strptime_to_utc.cache_info().misses, 2)
+        # Only the format the fast path does not handle reaches the generic parser, once
+        self.assertEqual(mocked_strptime_to_utc.call_count, 1)